@@ -1,12 +1,22 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
 import os
+import base64
+import json
+import time
 from datetime import datetime
-import markdown
-from weasyprint import HTML
-from io import BytesIO
+from functools import wraps
+from threading import Thread
 from werkzeug.utils import secure_filename
 from werkzeug.middleware.proxy_fix import ProxyFix
-from models import Document, Folder, Tag, Category, RecentFile
+from models import (Document, Folder, Tag, Category, RecentFile, group_commit, paginate,
+                    start_unit_of_work, end_unit_of_work, store_versions, sync_search_index)
+from export_cache import cached_export
+from export_jobs import ExportQueueFull, get_job, job_artifact, submit_job
+from renderer import EXPORT_FORMATS, render_html
+from search_index import parse_query, snippet
+from zip_export import safe_part, stream_zip
+
+SEARCH_LIMIT = 50
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
@@ -18,6 +28,79 @@ EXPORTS_DIR = 'exports'
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 os.makedirs(EXPORTS_DIR, exist_ok=True)
 
+Thread(target=sync_search_index, daemon=True).start()
+
+@app.before_request
+def open_unit_of_work():
+    g.unit_of_work = start_unit_of_work()
+
+@app.teardown_request
+def close_unit_of_work(exc):
+    token = g.pop('unit_of_work', None)
+    if token is not None:
+        end_unit_of_work(token)
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        key = None
+    if not (isinstance(key, list) and len(key) == 2 and isinstance(key[0], str) and isinstance(key[1], int)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+def listing_args():
+    """Parse the ``limit``, ``cursor`` and ``fields`` parameters of listing endpoints."""
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be a positive integer")
+    cursor = request.args.get('cursor')
+    fields = request.args.get('fields')
+    return (limit,
+            decode_cursor(cursor) if cursor else None,
+            set(fields.split(',')) if fields else None)
+
+def id_list(name):
+    """Parse the comma-separated ids of query parameter ``name``."""
+    try:
+        return [int(part) for part in request.args.get(name, '').split(',') if part]
+    except ValueError:
+        raise ValueError(f"{name} must be a comma-separated list of ids")
+
+def page_of(items, limit, sort_key):
+    """Trim ``items`` (fetched with ``limit + 1``) to ``limit`` and return it with the next cursor."""
+    if limit is None or len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(sort_key(items[-1]))
+
+def versioned(*stores):
+    """Tag the view's responses with an ETag built from the versions of ``stores``
+    and answer a matching ``If-None-Match`` with 304 without running the view.
+    
+    The versions are read before the view runs, so a write landing meanwhile
+    can only make the ETag older than the body, never newer.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = store_versions()
+            etag = '-'.join(str(versions[store]) for store in stores)
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
 def safe_join_path(base_dir, filename):
     safe_name = secure_filename(filename)
     if not safe_name:
@@ -61,12 +144,7 @@ def save_file():
             else:
                 document = Document.create(filename, content, folder_id)
         else:
-            all_docs = Document.get_all()
-            existing = None
-            for doc in all_docs:
-                if doc['filename'] == filename and doc.get('folder_id') == folder_id:
-                    existing = doc
-                    break
+            existing = Document.get_by_filename(filename, folder_id)
             
             if existing:
                 Document.update(existing['id'], content=content)
@@ -101,28 +179,26 @@ def open_file():
             if not document:
                 return jsonify({'success': False, 'error': 'Document not found'}), 404
         elif filename:
-            all_docs = Document.get_all()
-            document = None
-            for doc in all_docs:
-                if doc['filename'] == filename:
-                    document = doc
-                    break
+            matches = Document.find_by_filename(filename)
+            document = matches[0] if matches else None
             if not document:
                 return jsonify({'success': False, 'error': 'Document not found'}), 404
         else:
             return jsonify({'success': False, 'error': 'No filename or document_id provided'}), 400
         
-        Document.update(document['id'], last_opened_at=datetime.utcnow().isoformat())
-        RecentFile.add(document['id'])
+        with group_commit():
+            Document.update(document['id'], last_opened_at=datetime.utcnow().isoformat())
+            RecentFile.add(document['id'])
         
         document = Document.get_by_id(document['id'])
+        document_dict = Document.to_dict(document, include_content=True)
         
         return jsonify({
             'success': True,
-            'content': document.get('content', ''),
+            'content': document_dict['content'],
             'filename': document['filename'],
             'document_id': document['id'],
-            'document': Document.to_dict(document, include_content=True)
+            'document': document_dict
         })
     except ValueError as e:
         return jsonify({'success': False, 'error': str(e)}), 400
@@ -130,22 +206,29 @@ def open_file():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/files', methods=['GET'])
+@versioned('documents')
 def list_files():
     try:
-        documents = Document.get_all()
-        documents_sorted = sorted(documents, key=lambda x: x.get('updated_at', ''), reverse=True)
+        limit, after, fields = listing_args()
+        documents = Document.get_page(limit + 1 if limit else None, after)
+        documents, next_cursor = page_of(documents, limit, Document.sort_key)
         
         files = [{
             'filename': doc['filename'],
-            'size': len(doc.get('content', '').encode('utf-8')),
+            'size': doc.get('size', 0),
             'modified': doc.get('updated_at'),
             'document_id': doc['id'],
             'folder_id': doc.get('folder_id'),
             'is_favorite': doc.get('is_favorite', False),
             'is_pinned': doc.get('is_pinned', False)
-        } for doc in documents_sorted]
+        } for doc in documents]
+        if fields is not None:
+            files = [{key: value for key, value in f.items() if key == 'document_id' or key in fields}
+                     for f in files]
         
-        return jsonify({'success': True, 'files': files})
+        return jsonify({'success': True, 'files': files, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -159,84 +242,11 @@ def export_html():
         content = data.get('content', '')
         filename = data.get('filename', 'document')
         
-        html_content = markdown.markdown(
-            content,
-            extensions=['extra', 'codehilite', 'tables', 'fenced_code']
-        )
-        
         safe_title = secure_filename(filename.replace('.md', ''))
-        
-        full_html = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{safe_title}</title>
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 2rem;
-            line-height: 1.6;
-            color: #333;
-        }}
-        h1, h2, h3, h4, h5, h6 {{
-            margin-top: 1.5em;
-            margin-bottom: 0.5em;
-        }}
-        code {{
-            background: #f4f4f4;
-            padding: 0.2em 0.4em;
-            border-radius: 3px;
-            font-family: 'Courier New', monospace;
-        }}
-        pre {{
-            background: #f4f4f4;
-            padding: 1em;
-            border-radius: 5px;
-            overflow-x: auto;
-        }}
-        pre code {{
-            background: none;
-            padding: 0;
-        }}
-        blockquote {{
-            border-left: 4px solid #ddd;
-            margin-left: 0;
-            padding-left: 1em;
-            color: #666;
-        }}
-        table {{
-            border-collapse: collapse;
-            width: 100%;
-            margin: 1em 0;
-        }}
-        th, td {{
-            border: 1px solid #ddd;
-            padding: 0.5em;
-            text-align: left;
-        }}
-        th {{
-            background: #f4f4f4;
-        }}
-    </style>
-</head>
-<body>
-{html_content}
-</body>
-</html>
-"""
-        
         export_filename = f"{safe_title}_export.html"
-        export_path, _ = safe_join_path(EXPORTS_DIR, export_filename)
-        
-        with open(export_path, 'w', encoding='utf-8') as f:
-            f.write(full_html)
         
         return send_file(
-            export_path,
+            cached_export('html', content, safe_title),
             as_attachment=True,
             download_name=export_filename,
             mimetype='text/html'
@@ -256,89 +266,18 @@ def export_pdf():
         content = data.get('content', '')
         filename = data.get('filename', 'document')
         
-        html_content = markdown.markdown(
-            content,
-            extensions=['extra', 'codehilite', 'tables', 'fenced_code']
-        )
-        
-        full_html = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <style>
-        @page {{
-            size: A4;
-            margin: 2cm;
-        }}
-        body {{
-            font-family: 'DejaVu Sans', Arial, sans-serif;
-            line-height: 1.6;
-            color: #333;
-        }}
-        h1, h2, h3, h4, h5, h6 {{
-            margin-top: 1.5em;
-            margin-bottom: 0.5em;
-            page-break-after: avoid;
-        }}
-        code {{
-            background: #f4f4f4;
-            padding: 0.2em 0.4em;
-            border-radius: 3px;
-            font-family: 'Courier New', monospace;
-        }}
-        pre {{
-            background: #f4f4f4;
-            padding: 1em;
-            border-radius: 5px;
-            overflow-x: auto;
-            page-break-inside: avoid;
-        }}
-        pre code {{
-            background: none;
-            padding: 0;
-        }}
-        blockquote {{
-            border-left: 4px solid #ddd;
-            margin-left: 0;
-            padding-left: 1em;
-            color: #666;
-        }}
-        table {{
-            border-collapse: collapse;
-            width: 100%;
-            margin: 1em 0;
-            page-break-inside: avoid;
-        }}
-        th, td {{
-            border: 1px solid #ddd;
-            padding: 0.5em;
-            text-align: left;
-        }}
-        th {{
-            background: #f4f4f4;
-        }}
-    </style>
-</head>
-<body>
-{html_content}
-</body>
-</html>
-"""
-        
-        pdf_buffer = BytesIO()
-        HTML(string=full_html).write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
-        
         safe_filename = secure_filename(filename.replace('.md', ''))
         export_filename = f"{safe_filename}_export.pdf"
         
+        # Laid out in an export worker process unless already cached.
         return send_file(
-            pdf_buffer,
+            cached_export('pdf', content, safe_filename),
             as_attachment=True,
             download_name=export_filename,
             mimetype='application/pdf'
         )
+    except ExportQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '5'}
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -354,13 +293,9 @@ def export_txt():
         
         safe_filename = secure_filename(filename.replace('.md', ''))
         export_filename = f"{safe_filename}_export.txt"
-        export_path, _ = safe_join_path(EXPORTS_DIR, export_filename)
-        
-        with open(export_path, 'w', encoding='utf-8') as f:
-            f.write(content)
         
         return send_file(
-            export_path,
+            cached_export('txt', content, safe_filename),
             as_attachment=True,
             download_name=export_filename,
             mimetype='text/plain'
@@ -370,14 +305,177 @@ def export_txt():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/export/<fmt>', methods=['POST'])
+def export_document(fmt):
+    """Export as any other registered format (DOCX, ODT, EPUB, Markdown)."""
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
+        
+        content = data.get('content', '')
+        filename = data.get('filename', 'document')
+        
+        safe_filename = secure_filename(filename.replace('.md', ''))
+        path = cached_export(fmt, content, safe_filename)
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        
+        return send_file(
+            path,
+            as_attachment=True,
+            download_name=f"{safe_filename}_export.{extension}",
+            mimetype=mimetype
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/export/jobs', methods=['POST'])
+def create_export_job():
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
+        
+        digest = None
+        if data.get('document_id') is not None:
+            document = Document.get_by_id(data['document_id'])
+            if not document:
+                return jsonify({'success': False, 'error': 'Document not found'}), 404
+            content = Document.get_content(document)
+            filename = document['filename']
+            digest = document.get('content_hash')
+        else:
+            content = data.get('content', '')
+            filename = data.get('filename', 'document')
+        
+        safe_filename = secure_filename(filename.replace('.md', '')) or 'document'
+        job = submit_job(data.get('format', 'pdf'), content, safe_filename, digest)
+        return jsonify({'success': True, 'job': job}), 202
+    except ExportQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '5'}
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/export/jobs/<job_id>', methods=['GET'])
+def get_export_job(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/export/jobs/<job_id>/events', methods=['GET'])
+def stream_export_job(job_id):
+    """Server-sent events carrying the job's status each time it changes."""
+    if not get_job(job_id):
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def events():
+        last = None
+        while True:
+            job = get_job(job_id)
+            if job != last:
+                yield f"data: {json.dumps(job)}\n\n"
+                last = job
+            if not job or job['status'] in ('done', 'failed'):
+                return
+            time.sleep(0.5)
+    
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/export/jobs/<job_id>/download', methods=['GET'])
+def download_export_job(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'error': f"Job is {job['status']}"}), 409
+    return send_file(
+        job_artifact(job),
+        as_attachment=True,
+        download_name=job['filename'],
+        mimetype=EXPORT_FORMATS[job['format']][0]
+    )
+
+@app.route('/api/export/zip', methods=['GET'])
+def export_zip():
+    """Stream a ZIP of the documents in a folder (``recursive`` for its
+    subtree), with a tag or in a category, exported as ``format``."""
+    try:
+        fmt = request.args.get('format', 'html')
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        folder_id = request.args.get('folder_id', type=int)
+        tag_id = request.args.get('tag_id', type=int)
+        category_id = request.args.get('category_id', type=int)
+        
+        if folder_id is not None:
+            source = Folder.get_by_id(folder_id)
+            recursive = request.args.get('recursive', '0') in ('1', 'true')
+            ids = Document.filter_ids(folder_id=folder_id, recursive=recursive) if source else None
+        elif tag_id is not None:
+            source = Tag.get_by_id(tag_id)
+            ids = Document.filter_ids(tag_ids=[tag_id])
+        elif category_id is not None:
+            source = Category.get_by_id(category_id)
+            ids = Document.filter_ids(category_ids=[category_id])
+        else:
+            return jsonify({'success': False, 'error': 'folder_id, tag_id or category_id is required'}), 400
+        if not source:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        
+        _, nodes = Folder.get_tree()
+        
+        def folder_parts(parent_id):
+            # Archive directories from the exported folder (or the root) down.
+            parts = []
+            while parent_id is not None and parent_id != folder_id and parent_id in nodes:
+                parts.append(safe_part(nodes[parent_id]['name']))
+                parent_id = nodes[parent_id]['parent_id']
+            return parts[::-1]
+        
+        names = set()
+        entries = []
+        for doc in Document.get_many(sorted(ids)):
+            if not doc:
+                continue
+            parts = folder_parts(doc.get('folder_id'))
+            stem = doc['filename'][:-3] if doc['filename'].endswith('.md') else doc['filename']
+            name = '/'.join(parts + [f"{safe_part(stem)}.{EXPORT_FORMATS[fmt][1]}"])
+            counter = 1
+            while name in names:
+                counter += 1
+                name = '/'.join(parts + [f"{safe_part(stem)} ({counter}).{EXPORT_FORMATS[fmt][1]}"])
+            names.add(name)
+            entries.append((name, doc))
+        
+        def contents():
+            for name, doc in entries:
+                title = secure_filename(doc['filename'].replace('.md', '')) or 'document'
+                yield name, Document.get_content(doc), title, doc.get('content_hash')
+        
+        archive_name = f"{secure_filename(source['name']) or 'export'}.zip"
+        return Response(
+            stream_with_context(stream_zip(contents(), fmt)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{archive_name}"'}
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/folders', methods=['GET'])
+@versioned('folders', 'documents')
 def get_folders():
     try:
-        root_folders = [f for f in Folder.get_all() if f.get('parent_id') is None]
-        root_folders_sorted = sorted(root_folders, key=lambda x: x.get('position', 0))
+        root_folders, _ = Folder.get_tree()
         return jsonify({
             'success': True,
-            'folders': [Folder.to_dict(folder) for folder in root_folders_sorted]
+            'folders': root_folders
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -393,6 +491,8 @@ def create_folder():
             icon=data.get('icon', 'folder')
         )
         return jsonify({'success': True, 'folder': Folder.to_dict(folder)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -419,6 +519,8 @@ def update_folder(folder_id):
         
         folder = Folder.update(folder_id, **update_data)
         return jsonify({'success': True, 'folder': Folder.to_dict(folder)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -435,21 +537,27 @@ def delete_folder(folder_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/documents', methods=['GET'])
+@versioned('documents', 'folders', 'tags', 'categories')
 def get_documents():
     try:
         folder_id = request.args.get('folder_id', type=int)
+        recursive = request.args.get('recursive', '0') in ('1', 'true')
+        limit, after, fields = listing_args()
+        fetch = limit + 1 if limit else None
         
-        if folder_id is not None:
-            documents = Document.get_by_folder(folder_id)
+        if folder_id is not None and recursive:
+            documents = paginate(Document.get_by_folder_tree(folder_id), Document.sort_key, fetch, after)
         else:
-            documents = Document.get_all()
-        
-        documents_sorted = sorted(documents, key=lambda x: x.get('updated_at', ''), reverse=True)
+            documents = Document.get_page(fetch, after, folder_id)
+        documents, next_cursor = page_of(documents, limit, Document.sort_key)
         
         return jsonify({
             'success': True,
-            'documents': [Document.to_dict(doc) for doc in documents_sorted]
+            'documents': [Document.to_dict(doc, fields=fields) for doc in documents],
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -466,6 +574,21 @@ def create_document():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/documents/bulk', methods=['POST'])
+def bulk_update_documents():
+    try:
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('operations'), list):
+            return jsonify({'success': False, 'error': 'No operations provided'}), 400
+        
+        with group_commit():
+            result = Document.bulk_update(data['operations'])
+        return jsonify({'success': True, **result})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/documents/<int:doc_id>', methods=['GET'])
 def get_document(doc_id):
     try:
@@ -473,8 +596,9 @@ def get_document(doc_id):
         if not document:
             return jsonify({'success': False, 'error': 'Document not found'}), 404
         
-        Document.update(doc_id, last_opened_at=datetime.utcnow().isoformat())
-        RecentFile.add(doc_id)
+        with group_commit():
+            Document.update(doc_id, last_opened_at=datetime.utcnow().isoformat())
+            RecentFile.add(doc_id)
         
         document = Document.get_by_id(doc_id)
         
@@ -482,6 +606,58 @@ def get_document(doc_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/documents/<int:doc_id>/content', methods=['GET'])
+def get_document_content(doc_id):
+    try:
+        document = Document.get_by_id(doc_id)
+        if not document:
+            return jsonify({'success': False, 'error': 'Document not found'}), 404
+        
+        return send_file(
+            Document.open_content(document),
+            mimetype='text/markdown; charset=utf-8',
+            download_name=document['filename'],
+            etag=document.get('content_hash') or True
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/documents/<int:doc_id>/outline', methods=['GET'])
+@versioned('documents')
+def get_document_outline(doc_id):
+    try:
+        document = Document.get_by_id(doc_id)
+        if not document:
+            return jsonify({'success': False, 'error': 'Document not found'}), 404
+        
+        return jsonify({'success': True, 'outline': Document.get_outline(document)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/documents/<int:doc_id>/preview', methods=['GET'])
+@versioned('documents')
+def get_document_preview(doc_id):
+    try:
+        document = Document.get_by_id(doc_id)
+        if not document:
+            return jsonify({'success': False, 'error': 'Document not found'}), 404
+        
+        html = render_html(Document.get_content(document), digest=document.get('content_hash'))
+        return jsonify({'success': True, 'html': html})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/preview', methods=['POST'])
+def preview():
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
+        
+        return jsonify({'success': True, 'html': render_html(data.get('content', ''))})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/documents/<int:doc_id>', methods=['PUT'])
 def update_document(doc_id):
     try:
@@ -494,7 +670,10 @@ def update_document(doc_id):
         
         if 'filename' in data:
             update_data['filename'] = data['filename']
-        if 'content' in data:
+        if data.get('content') is not None:
+            # null leaves the content unchanged, like an omitted key.
+            if not isinstance(data['content'], str):
+                raise ValueError("content must be a string")
             update_data['content'] = data['content']
         if 'folder_id' in data:
             update_data['folder_id'] = data['folder_id']
@@ -505,6 +684,8 @@ def update_document(doc_id):
         
         document = Document.update(doc_id, **update_data)
         return jsonify({'success': True, 'document': Document.to_dict(document, include_content=True)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -521,6 +702,7 @@ def delete_document(doc_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/tags', methods=['GET'])
+@versioned('tags', 'documents')
 def get_tags():
     try:
         tags = Tag.get_all()
@@ -596,6 +778,7 @@ def remove_tag_from_document(doc_id, tag_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/categories', methods=['GET'])
+@versioned('categories', 'documents')
 def get_categories():
     try:
         categories = Category.get_all()
@@ -672,33 +855,78 @@ def remove_category_from_document(doc_id, cat_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/recent', methods=['GET'])
+@versioned('recent_files', 'documents', 'folders', 'tags', 'categories')
 def get_recent_files():
     try:
-        limit = request.args.get('limit', 20, type=int)
-        recent = RecentFile.get_recent(limit)
+        limit, after, fields = listing_args()
+        limit = limit or 20
+        recent, next_cursor = page_of(RecentFile.get_recent(limit + 1, after), limit, RecentFile.sort_key)
+        Document.get_many([r['document_id'] for r in recent])
         
         return jsonify({
             'success': True,
-            'recent': [RecentFile.to_dict(r) for r in recent]
+            'recent': [RecentFile.to_dict(r, fields=fields) for r in recent],
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/quick-open', methods=['GET'])
+@versioned('documents', 'folders')
+def quick_open():
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        if limit < 1:
+            raise ValueError("limit must be a positive integer")
+        matches = Document.quick_open(request.args.get('q', ''), min(limit, 100))
+        return jsonify({'success': True, 'results': matches})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/search', methods=['GET'])
+@versioned('documents', 'folders', 'tags', 'categories')
 def search_documents():
     try:
-        query = request.args.get('q', '').lower()
-        if not query:
-            return jsonify({'success': True, 'results': []})
+        clauses = parse_query(request.args.get('q', ''))
+        limit, after, fields = listing_args()
+        candidates = Document.filter_ids(
+            tag_ids=id_list('tags'),
+            category_ids=id_list('categories'),
+            folder_id=request.args.get('folder_id', type=int),
+            recursive=request.args.get('recursive', '0') in ('1', 'true'))
+        
+        if not clauses:
+            # Filters alone list the matching documents newest first.
+            if candidates is None:
+                return jsonify({'success': True, 'results': [], 'next_cursor': None})
+            documents = [doc for doc in Document.get_many(list(candidates)) if doc]
+            documents = paginate(documents, Document.sort_key, limit + 1 if limit else None, after)
+            documents, next_cursor = page_of(documents, limit, Document.sort_key)
+            results = [Document.to_dict(doc, fields=fields) for doc in documents]
+            return jsonify({'success': True, 'results': results, 'next_cursor': next_cursor})
+        
+        # SEARCH_LIMIT only sizes the page; next_cursor continues past it.
+        limit = limit or SEARCH_LIMIT
+        hits = paginate(Document.search(clauses, candidates), Document.search_key, limit + 1, after)
+        hits, next_cursor = page_of(hits, limit, Document.search_key)
+        documents = Document.get_many([doc_id for doc_id, _ in hits])
         
-        documents = Document.get_all()
         results = []
-        
-        for doc in documents:
-            if (query in doc.get('filename', '').lower() or 
-                query in doc.get('content', '').lower()):
-                results.append(Document.to_dict(doc))
-        
-        return jsonify({'success': True, 'results': results})
+        for (doc_id, score), doc in zip(hits, documents):
+            if not doc:
+                continue
+            result = Document.to_dict(doc, fields=fields)
+            result['score'] = round(score, 4)
+            if fields is None or 'snippet' in fields:
+                result['snippet'] = snippet(Document.get_content(doc), clauses)
+            results.append(result)
+        
+        return jsonify({'success': True, 'results': results, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
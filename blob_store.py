@@ -0,0 +1,109 @@
+"""Content-addressed storage for document bodies.
+
+Document records only carry the metadata returned by ``content_metadata``
+(hash, sizes, counts and heading outline, computed once per save); the
+text itself lives in a blob named after its SHA-256, so identical contents
+are stored once and listings never have to touch it.
+"""
+import hashlib
+import os
+import re
+import threading
+
+_FENCE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+_ATX_HEADING = re.compile(r'^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$')
+_SETEXT_UNDERLINE = re.compile(r'^ {0,3}(=+|-+)[ \t]*$')
+_NOT_PARAGRAPH = re.compile(r'^(?: {4}|\t| {0,3}(?:>|[-*+][ \t]|\d+[.)][ \t]))')
+
+
+def content_outline(content):
+    """Return the Markdown headings of ``content`` as ``{level, text, line}`` dicts.
+    
+    Handles ATX (``## Title``) and setext (underlined) headings and skips
+    fenced code blocks. ``line`` is 1-based.
+    """
+    outline = []
+    fence = None
+    paragraph = None
+    for number, line in enumerate(content.split('\n'), 1):
+        match = _FENCE.match(line)
+        if fence:
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence):
+                fence = None
+            continue
+        if match:
+            fence = match.group(1)
+            paragraph = None
+            continue
+        match = _ATX_HEADING.match(line)
+        if match:
+            outline.append({'level': len(match.group(1)), 'text': (match.group(2) or '').strip(), 'line': number})
+            paragraph = None
+            continue
+        match = _SETEXT_UNDERLINE.match(line)
+        if match and paragraph:
+            outline.append({'level': 1 if match.group(1)[0] == '=' else 2, 'text': paragraph[1], 'line': paragraph[0]})
+            paragraph = None
+            continue
+        if not line.strip() or _NOT_PARAGRAPH.match(line):
+            paragraph = None
+        elif paragraph is None:
+            paragraph = [number, line.strip()]
+        else:
+            paragraph[1] += ' ' + line.strip()
+    return outline
+
+
+def content_metadata(content):
+    """Return the statistics recorded for ``content``.
+    
+    Word and character counts match the editor's status bar (whitespace
+    separated words, characters as code points).
+    """
+    encoded = content.encode('utf-8')
+    return {
+        'content_hash': hashlib.sha256(encoded).hexdigest(),
+        'size': len(encoded),
+        'line_count': content.count('\n') + 1 if content else 0,
+        'word_count': len(content.split()),
+        'char_count': len(content),
+        'outline': content_outline(content),
+    }
+
+
+class BlobStore:
+    """Blobs stored as ``<root>/<hash[:2]>/<hash>`` files."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, content_hash):
+        return os.path.join(self.root, content_hash[:2], content_hash)
+
+    def put(self, content):
+        """Store ``content`` if it is not already present and return its metadata."""
+        metadata = content_metadata(content)
+        path = self.path(metadata['content_hash'])
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return metadata
+
+    def get(self, content_hash):
+        with open(self.path(content_hash), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def open(self, content_hash):
+        return open(self.path(content_hash), 'rb')
+
+    def delete(self, content_hash):
+        try:
+            os.remove(self.path(content_hash))
+        except FileNotFoundError:
+            pass
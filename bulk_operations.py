@@ -0,0 +1,56 @@
+"""Validation of bulk document operations, shared by every storage engine.
+
+``bulk_update_documents`` in ``storage`` and in ``sql_storage`` both
+accept the operations described by ``BULK_DOCUMENT_OPS`` and check them
+with ``check_bulk_operations`` before changing anything, so a bad request
+fails with ``ValueError`` whatever the backend.
+"""
+
+# op -> the argument it requires (None: no argument or an optional ``value``).
+BULK_DOCUMENT_OPS = {
+    'move': 'folder_id',
+    'add_tag': 'tag_id',
+    'remove_tag': 'tag_id',
+    'add_category': 'category_id',
+    'remove_category': 'category_id',
+    'favorite': None,
+    'pin': None,
+    'delete': None,
+}
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def check_bulk_operations(operations, exists):
+    """Raise ``ValueError`` unless every operation is well formed.
+
+    ``exists(argument, value)`` tells whether the folder, tag or category
+    named by ``argument`` (``'folder_id'``, ``'tag_id'`` or
+    ``'category_id'``) and ``value`` exists. ``move`` accepts a
+    ``folder_id`` of None, for the root.
+    """
+    if not isinstance(operations, list):
+        raise ValueError("Bulk operations must be a list")
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ValueError("Each bulk operation must be an object")
+        op = operation.get('op')
+        if op not in BULK_DOCUMENT_OPS:
+            raise ValueError(f"Unknown bulk operation: {op}")
+        document_ids = operation.get('document_ids')
+        if not isinstance(document_ids, list) or not all(_is_id(doc_id) for doc_id in document_ids):
+            raise ValueError(f"Bulk operation '{op}' requires 'document_ids', a list of integers")
+        argument = BULK_DOCUMENT_OPS[op]
+        if not argument:
+            continue
+        if argument not in operation:
+            raise ValueError(f"Bulk operation '{op}' requires '{argument}'")
+        value = operation[argument]
+        if value is None and op == 'move':
+            continue
+        if not _is_id(value):
+            raise ValueError(f"'{argument}' must be an integer")
+        if not exists(argument, value):
+            raise ValueError(f"{argument.split('_')[0].capitalize()} {value} not found")
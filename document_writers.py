@@ -0,0 +1,483 @@
+"""DOCX, ODT and EPUB writers over the mistune AST of a document.
+
+Each ``write_*`` function takes the Markdown content, the title and the
+content hash, gets the (cached) AST from ``markdown_ast.parse`` and returns
+the exported file as bytes. Constructs a format has no counterpart for
+degrade to their text: images become their alt text and raw HTML loses
+its tags, except in EPUB, which is HTML to begin with.
+"""
+import io
+import re
+
+from docx import Document as DocxDocument
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.opc.constants import RELATIONSHIP_TYPE
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.shared import Pt, RGBColor
+from ebooklib import epub
+from odf import teletype
+from odf.dc import Title
+from odf.opendocument import OpenDocumentText
+from odf.style import (ListLevelProperties, ParagraphProperties, Style, TableCellProperties,
+                       TextProperties)
+from odf.table import Table, TableCell, TableColumn, TableRow
+from odf.text import (A, H, LineBreak, List, ListItem, ListLevelStyleBullet, ListLevelStyleNumber,
+                      ListStyle, Note, NoteBody, NoteCitation, P, Span)
+
+from markdown_ast import HIGHLIGHT_CSS, HTMLRenderer, create_markdown, parse, plain_text, to_html
+
+MONOSPACE = 'Courier New'
+_TAG = re.compile(r'<[^>]*>')
+# Characters XML 1.0 cannot hold, escaped or not (NUL, form feed, ...).
+_XML_INVALID = re.compile('[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]')
+_ALIGN = {'left': WD_ALIGN_PARAGRAPH.LEFT, 'center': WD_ALIGN_PARAGRAPH.CENTER, 'right': WD_ALIGN_PARAGRAPH.RIGHT}
+
+
+def _xml_safe(text):
+    """Return ``text`` without the characters XML cannot represent."""
+    return _XML_INVALID.sub('', text)
+
+
+def _parse(content, title, digest):
+    """Return the AST and title of a document, both stripped of characters
+    XML cannot represent; every writer here emits XML."""
+    safe = _xml_safe(content)
+    # The cached AST under ``digest`` is the unstripped content's.
+    return parse(safe, digest if safe == content else None), _xml_safe(title)
+
+
+def _footnotes(tokens):
+    """Return ``{index: block tokens}`` for the footnotes of a document."""
+    notes = {}
+    for token in tokens:
+        if token['type'] == 'footnotes':
+            for item in token['children']:
+                notes[item['attrs']['index']] = item['children']
+    return notes
+
+
+class _DocxWriter:
+    def __init__(self, title):
+        self.doc = DocxDocument()
+        self.doc.core_properties.title = title
+        code = self.doc.styles.add_style('Code', WD_STYLE_TYPE.PARAGRAPH)
+        code.base_style = self.doc.styles['No Spacing']
+        code.font.name = MONOSPACE
+        code.font.size = Pt(9)
+
+    def blocks(self, tokens, style=None, indent=0):
+        for token in tokens:
+            kind = token['type']
+            if kind == 'heading':
+                self.inlines(self.doc.add_heading(level=min(token['attrs']['level'], 9)), token['children'])
+            elif kind in ('paragraph', 'block_text'):
+                self.inlines(self.paragraph(style, indent), token['children'])
+            elif kind == 'block_quote':
+                self.blocks(token['children'], 'Quote', indent)
+            elif kind == 'list':
+                self.list(token, indent)
+            elif kind == 'block_code':
+                paragraph = self.paragraph('Code', indent)
+                lines = token['raw'].rstrip('\n').split('\n')
+                for i, line in enumerate(lines):
+                    run = paragraph.add_run(line)
+                    if i < len(lines) - 1:
+                        run.add_break()
+            elif kind == 'block_html':
+                text = _TAG.sub('', token['raw']).strip()
+                if text:
+                    self.paragraph(style, indent).add_run(text)
+            elif kind == 'thematic_break':
+                self.rule()
+            elif kind == 'table':
+                self.table(token)
+            elif kind == 'def_list':
+                for item in token['children']:
+                    if item['type'] == 'def_list_head':
+                        paragraph = self.paragraph(style, indent)
+                        self.inlines(paragraph, item['children'], {'bold': True})
+                    else:
+                        self.blocks(item['children'], style, indent + 1)
+            elif kind == 'footnotes':
+                self.rule()
+                for item in token['children']:
+                    paragraph = self.paragraph(None, 0)
+                    paragraph.add_run(f"{item['attrs']['index']}. ").font.superscript = True
+                    self.inlines(paragraph, [child for block in item['children'] for child in block.get('children', ())])
+
+    def paragraph(self, style, indent):
+        paragraph = self.doc.add_paragraph(style=style)
+        if indent:
+            paragraph.paragraph_format.left_indent = Pt(18 * indent)
+        return paragraph
+
+    def rule(self):
+        self.doc.add_paragraph('* * *').alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    def list(self, token, indent):
+        depth = token['attrs']['depth']
+        style = 'List Number' if token['attrs']['ordered'] else 'List Bullet'
+        if depth:
+            style = f'{style} {min(depth + 1, 3)}'
+        for item in token['children']:
+            first = True
+            for child in item['children']:
+                if child['type'] == 'list':
+                    self.list(child, indent)
+                elif first and child['type'] in ('paragraph', 'block_text'):
+                    self.inlines(self.paragraph(style, indent), child['children'])
+                else:
+                    self.blocks([child], None, indent + depth + 1)
+                first = False
+
+    def table(self, token):
+        rows = []
+        for section in token['children']:
+            if section['type'] == 'table_head':
+                rows.append(section['children'])
+            else:
+                rows.extend(row['children'] for row in section['children'])
+        table = self.doc.add_table(rows=len(rows), cols=max(len(cells) for cells in rows), style='Table Grid')
+        for row, cells in zip(table.rows, rows):
+            for cell, token in zip(row.cells, cells):
+                paragraph = cell.paragraphs[0]
+                if token['attrs']['align'] in _ALIGN:
+                    paragraph.alignment = _ALIGN[token['attrs']['align']]
+                self.inlines(paragraph, token['children'], {'bold': True} if token['attrs']['head'] else {})
+
+    def inlines(self, paragraph, tokens, fmt=None, link=None):
+        fmt = fmt or {}
+        for token in tokens:
+            kind = token['type']
+            if kind == 'emphasis':
+                self.inlines(paragraph, token['children'], {**fmt, 'italic': True}, link)
+            elif kind == 'strong':
+                self.inlines(paragraph, token['children'], {**fmt, 'bold': True}, link)
+            elif kind == 'strikethrough':
+                self.inlines(paragraph, token['children'], {**fmt, 'strike': True}, link)
+            elif kind == 'codespan':
+                self.run(paragraph, token['raw'], {**fmt, 'code': True}, link)
+            elif kind == 'link':
+                self.inlines(paragraph, token['children'], fmt, self.hyperlink(paragraph, token['attrs']['url']))
+            elif kind == 'image':
+                self.run(paragraph, plain_text(token['children']), {**fmt, 'italic': True}, link)
+            elif kind == 'linebreak':
+                self.run(paragraph, '', fmt, link).add_break()
+            elif kind == 'softbreak':
+                self.run(paragraph, ' ', fmt, link)
+            elif kind == 'footnote_ref':
+                self.run(paragraph, str(token['attrs']['index']), {**fmt, 'superscript': True}, link)
+            elif kind == 'inline_html':
+                continue
+            elif 'children' in token:
+                self.inlines(paragraph, token['children'], fmt, link)
+            else:
+                self.run(paragraph, token.get('raw', ''), fmt, link)
+
+    def run(self, paragraph, text, fmt, link):
+        run = paragraph.add_run(text)
+        run.bold = fmt.get('bold')
+        run.italic = fmt.get('italic')
+        run.font.strike = fmt.get('strike')
+        run.font.superscript = fmt.get('superscript')
+        if fmt.get('code'):
+            run.font.name = MONOSPACE
+        if link is not None:
+            run.font.underline = True
+            run.font.color.rgb = RGBColor(0x05, 0x63, 0xC1)
+            link.append(run._r)
+        return run
+
+    def hyperlink(self, paragraph, url):
+        element = OxmlElement('w:hyperlink')
+        if url.startswith('#'):
+            element.set(qn('w:anchor'), url[1:])
+        else:
+            element.set(qn('r:id'), paragraph.part.relate_to(url, RELATIONSHIP_TYPE.HYPERLINK, is_external=True))
+        paragraph._p.append(element)
+        return element
+
+
+def write_docx(content, title, digest=None):
+    """Return ``content`` as a Word document."""
+    tokens, title = _parse(content, title, digest)
+    writer = _DocxWriter(title)
+    writer.blocks(tokens)
+    buffer = io.BytesIO()
+    writer.doc.save(buffer)
+    return buffer.getvalue()
+
+
+class _OdtWriter:
+    def __init__(self, title, notes):
+        self.doc = OpenDocumentText()
+        self.notes = notes
+        self.text_styles = {}
+        self.paragraph_styles = {}
+        self.tables = 0
+        styles = self.doc.styles
+        for level in range(1, 7):
+            style = Style(name=f'Heading_20_{level}', displayname=f'Heading {level}', family='paragraph')
+            style.addElement(ParagraphProperties(margintop='0.4cm', marginbottom='0.2cm', keepwithnext='always'))
+            style.addElement(TextProperties(fontsize=f'{max(20 - 2 * level, 11)}pt', fontweight='bold'))
+            styles.addElement(style)
+        for name, paragraph, text in (
+                ('Text_20_body', {'marginbottom': '0.2cm'}, {}),
+                ('Quotations', {'marginleft': '1cm', 'marginbottom': '0.2cm'}, {'color': '#666666'}),
+                ('Preformatted_20_Text', {}, {'fontfamily': MONOSPACE, 'fontsize': '9pt'}),
+                ('Horizontal_20_Line', {'textalign': 'center'}, {})):
+            style = Style(name=name, displayname=name.replace('_20_', ' '), family='paragraph')
+            style.addElement(ParagraphProperties(**paragraph))
+            style.addElement(TextProperties(**text))
+            styles.addElement(style)
+        self.bullets = self.list_style('Bullets', False)
+        self.numbers = self.list_style('Numbering', True)
+        self.cell_style = Style(name='TableCell', family='table-cell')
+        self.cell_style.addElement(TableCellProperties(border='0.5pt solid #999999', padding='0.1cm'))
+        self.doc.automaticstyles.addElement(self.cell_style)
+        self.doc.meta.addElement(Title(text=title))
+
+    def list_style(self, name, ordered):
+        style = ListStyle(name=name)
+        for level in range(1, 11):
+            if ordered:
+                level_style = ListLevelStyleNumber(level=level, numformat='1', numsuffix='.')
+            else:
+                level_style = ListLevelStyleBullet(level=level, bulletchar='•')
+            level_style.addElement(ListLevelProperties(spacebefore=f'{0.6 * (level - 1):.1f}cm', minlabelwidth='0.6cm'))
+            style.addElement(level_style)
+        self.doc.automaticstyles.addElement(style)
+        return style
+
+    def paragraph_style(self, base, fmt):
+        """Return an automatic paragraph style over ``base`` with ``fmt`` text properties."""
+        key = (base, tuple(sorted(fmt.items())))
+        style = self.paragraph_styles.get(key)
+        if style is None:
+            style = Style(name=f'P{len(self.paragraph_styles) + 1}', family='paragraph', parentstylename=base)
+            style.addElement(ParagraphProperties(**fmt))
+            self.doc.automaticstyles.addElement(style)
+            self.paragraph_styles[key] = style
+        return style
+
+    def text_style(self, fmt):
+        key = tuple(sorted(key for key, value in fmt.items() if value))
+        if not key:
+            return None
+        style = self.text_styles.get(key)
+        if style is None:
+            properties = {}
+            if 'bold' in key:
+                properties['fontweight'] = 'bold'
+            if 'italic' in key:
+                properties['fontstyle'] = 'italic'
+            if 'strike' in key:
+                properties['textlinethroughstyle'] = 'solid'
+            if 'code' in key:
+                properties['fontfamily'] = MONOSPACE
+            if 'superscript' in key:
+                properties['textposition'] = 'super 58%'
+            style = Style(name=f'T{len(self.text_styles) + 1}', family='text')
+            style.addElement(TextProperties(**properties))
+            self.doc.automaticstyles.addElement(style)
+            self.text_styles[key] = style
+        return style
+
+    def blocks(self, parent, tokens, style='Text_20_body'):
+        for token in tokens:
+            kind = token['type']
+            if kind == 'heading':
+                level = min(token['attrs']['level'], 6)
+                self.inlines(self.add(parent, H(outlinelevel=level, stylename=f'Heading_20_{level}')), token['children'])
+            elif kind in ('paragraph', 'block_text'):
+                self.inlines(self.add(parent, P(stylename=style)), token['children'])
+            elif kind == 'block_quote':
+                self.blocks(parent, token['children'], 'Quotations')
+            elif kind == 'list':
+                self.list(parent, token)
+            elif kind == 'block_code':
+                paragraph = self.add(parent, P(stylename='Preformatted_20_Text'))
+                teletype.addTextToElement(paragraph, token['raw'].rstrip('\n'))
+            elif kind == 'block_html':
+                text = _TAG.sub('', token['raw']).strip()
+                if text:
+                    teletype.addTextToElement(self.add(parent, P(stylename=style)), text)
+            elif kind == 'thematic_break':
+                self.add(parent, P(stylename='Horizontal_20_Line', text='* * *'))
+            elif kind == 'table':
+                self.table(parent, token)
+            elif kind == 'def_list':
+                for item in token['children']:
+                    if item['type'] == 'def_list_head':
+                        self.inlines(self.add(parent, P(stylename=style)), item['children'], {'bold': True})
+                    else:
+                        self.blocks(parent, item['children'], self.paragraph_style(style, {'marginleft': '1cm'}))
+
+    def add(self, parent, element):
+        (parent if parent is not None else self.doc.text).addElement(element)
+        return element
+
+    def list(self, parent, token):
+        if token['attrs']['depth']:
+            element = self.add(parent, List())
+        else:
+            element = self.add(parent, List(stylename=self.numbers if token['attrs']['ordered'] else self.bullets))
+        for item in token['children']:
+            self.blocks(self.add(element, ListItem()), item['children'])
+
+    def table(self, parent, token):
+        rows = []
+        for section in token['children']:
+            if section['type'] == 'table_head':
+                rows.append(section['children'])
+            else:
+                rows.extend(row['children'] for row in section['children'])
+        self.tables += 1
+        table = self.add(parent, Table(name=f'Table{self.tables}'))
+        table.addElement(TableColumn(numbercolumnsrepeated=max(len(cells) for cells in rows)))
+        for cells in rows:
+            row = TableRow()
+            table.addElement(row)
+            for token in cells:
+                cell = TableCell(valuetype='string', stylename=self.cell_style)
+                row.addElement(cell)
+                align = token['attrs']['align']
+                style = self.paragraph_style('Text_20_body', {'textalign': align}) if align else 'Text_20_body'
+                self.inlines(self.add(cell, P(stylename=style)), token['children'],
+                             {'bold': True} if token['attrs']['head'] else {})
+
+    def inlines(self, element, tokens, fmt=None):
+        fmt = fmt or {}
+        for token in tokens:
+            kind = token['type']
+            if kind == 'emphasis':
+                self.inlines(element, token['children'], {**fmt, 'italic': True})
+            elif kind == 'strong':
+                self.inlines(element, token['children'], {**fmt, 'bold': True})
+            elif kind == 'strikethrough':
+                self.inlines(element, token['children'], {**fmt, 'strike': True})
+            elif kind == 'codespan':
+                self.text(element, token['raw'], {**fmt, 'code': True})
+            elif kind == 'link':
+                self.inlines(self.add(element, A(type='simple', href=token['attrs']['url'])), token['children'], fmt)
+            elif kind == 'image':
+                self.text(element, plain_text(token['children']), {**fmt, 'italic': True})
+            elif kind == 'linebreak':
+                element.addElement(LineBreak())
+            elif kind == 'softbreak':
+                self.text(element, ' ', fmt)
+            elif kind == 'footnote_ref':
+                self.note(element, token['attrs']['index'])
+            elif kind == 'inline_html':
+                continue
+            elif 'children' in token:
+                self.inlines(element, token['children'], fmt)
+            else:
+                self.text(element, token.get('raw', ''), fmt)
+
+    def text(self, element, text, fmt):
+        style = self.text_style(fmt)
+        if style is not None:
+            element = self.add(element, Span(stylename=style))
+        teletype.addTextToElement(element, text)
+
+    def note(self, element, index):
+        note = self.add(element, Note(id=f'ftn{index}', noteclass='footnote'))
+        note.addElement(NoteCitation(text=str(index)))
+        body = NoteBody()
+        note.addElement(body)
+        self.blocks(body, self.notes.get(index, ()))
+
+
+def write_odt(content, title, digest=None):
+    """Return ``content`` as an OpenDocument text document."""
+    tokens, title = _parse(content, title, digest)
+    writer = _OdtWriter(title, _footnotes(tokens))
+    writer.blocks(None, [token for token in tokens if token['type'] != 'footnotes'])
+    buffer = io.BytesIO()
+    writer.doc.write(buffer)
+    return buffer.getvalue()
+
+
+EPUB_STYLE = """
+body { font-family: serif; line-height: 1.5; }
+h1, h2, h3, h4, h5, h6 { font-family: sans-serif; page-break-after: avoid; }
+code, pre { font-family: monospace; font-size: 0.9em; }
+pre { white-space: pre-wrap; background: #f4f4f4; padding: 0.5em; }
+blockquote { border-left: 4px solid #ddd; margin-left: 0; padding-left: 1em; color: #666; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #ddd; padding: 0.3em; }
+"""
+
+
+def _chapters(tokens):
+    """Split top-level ``tokens`` before each heading of the highest level used."""
+    levels = [token['attrs']['level'] for token in tokens if token['type'] == 'heading']
+    chapters = [[]]
+    for token in tokens:
+        if levels and token['type'] == 'heading' and token['attrs']['level'] == min(levels) and chapters[-1]:
+            chapters.append([])
+        chapters[-1].append(token)
+    return [chapter for chapter in chapters if chapter]
+
+
+def _footnote_refs(tokens):
+    """Yield the indexes of the footnotes referenced in ``tokens``."""
+    for token in tokens:
+        if token['type'] == 'footnote_ref':
+            yield token['attrs']['index']
+        elif 'children' in token:
+            yield from _footnote_refs(token['children'])
+
+
+def write_epub(content, title, digest=None):
+    """Return ``content`` as an EPUB book, one chapter per top-level heading."""
+    tokens, title = _parse(content, title, digest)
+    notes = [token for token in tokens if token['type'] == 'footnotes']
+    chapters = _chapters([token for token in tokens if token['type'] != 'footnotes'])
+
+    # Notes live in their own file, so references have to name the files.
+    ref_files = {}
+    for number, chapter in enumerate(chapters, 1):
+        for index in _footnote_refs(chapter):
+            ref_files.setdefault(index, f'chapter_{number}.xhtml')
+    md = create_markdown(HTMLRenderer(escape=False))
+    md.renderer.register('footnote_ref', lambda renderer, key, index: (
+        f'<sup id="fnref-{index}"><a epub:type="noteref" href="notes.xhtml#fn-{index}">{index}</a></sup>'))
+    md.renderer.register('footnote_item', lambda renderer, text, key, index: (
+        f'<li id="fn-{index}">{text.rstrip()} '
+        f'<a href="{ref_files.get(index, "")}#fnref-{index}">&#8617;</a></li>\n'))
+
+    book = epub.EpubBook()
+    book.set_identifier(digest or title)
+    book.set_title(title)
+    book.set_language('en')
+    style = epub.EpubItem(uid='style', file_name='style/book.css', media_type='text/css',
+                          content=EPUB_STYLE + HIGHLIGHT_CSS)
+    book.add_item(style)
+
+    items = []
+    for number, chapter in enumerate(chapters, 1):
+        heading = chapter[0]['type'] == 'heading' and plain_text(chapter[0]['children'])
+        item = epub.EpubHtml(title=heading or title, file_name=f'chapter_{number}.xhtml', lang='en')
+        item.content = f'<div dir="auto">{to_html(chapter, md.renderer)}</div>'
+        items.append(item)
+    if notes:
+        item = epub.EpubHtml(title='Notes', file_name='notes.xhtml', lang='en')
+        item.content = f'<div dir="auto" epub:type="footnotes">{to_html(notes, md.renderer)}</div>'
+        items.append(item)
+    if not items:
+        items.append(epub.EpubHtml(title=title, file_name='chapter_1.xhtml', lang='en', content='<p></p>'))
+    for item in items:
+        item.add_item(style)
+        book.add_item(item)
+
+    book.toc = items
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ['nav'] + items
+    buffer = io.BytesIO()
+    epub.write_epub(buffer, book)
+    return buffer.getvalue()
@@ -0,0 +1,133 @@
+"""Size-bounded on-disk cache of export artifacts.
+
+Artifacts are stored as ``<root>/<key[:2]>/<key>.<ext>`` files, where the
+key hashes the document's content hash, the export format and the options
+the output depends on (the page styles, and the title for the formats
+whose files carry it). Asking again for an export of unchanged content is
+served from the file without rendering anything; files are written
+atomically, so concurrent processes never see a partial artifact.
+
+Every hit touches the file's mtime; once the files exceed
+``EXPORT_CACHE_BYTES`` the least recently used are removed, sparing those
+used in the last ``EVICTION_GRACE`` seconds so that a file is never
+removed while a response for it is being set up.
+"""
+import hashlib
+import os
+import threading
+import time
+
+from export_jobs import pool
+from markdown_ast import HIGHLIGHT_CSS, PLUGINS
+from renderer import EXPORT_FORMATS, PRINT_PAGE, SCREEN_PAGE, TITLED_FORMATS, content_hash, render_export
+
+EXPORT_CACHE_DIR = os.path.join('exports', 'cache')
+EXPORT_CACHE_BYTES = int(os.environ.get('EXPORT_CACHE_BYTES', 256 * 1024 * 1024))
+EVICTION_GRACE = 30
+# Temporary files older than this were left behind by a crashed writer.
+STALE_TMP_AGE = 3600
+# Formats laid out in the export worker pool rather than in the request thread.
+POOL_FORMATS = ('pdf',)
+
+# Changes to the page templates, Markdown plugins or code highlighting styles
+# invalidate every artifact.
+_STYLE = hashlib.sha256(repr((PLUGINS, SCREEN_PAGE, PRINT_PAGE, HIGHLIGHT_CSS)).encode('utf-8')).hexdigest()
+
+
+def artifact_key(digest, fmt, title):
+    """Return the cache key of ``fmt`` exports of content hashing to ``digest``."""
+    options = (_STYLE, title if fmt in TITLED_FORMATS else None)
+    return hashlib.sha256(repr((digest, fmt, options)).encode('utf-8')).hexdigest()
+
+
+class ArtifactCache:
+    """LRU cache of artifact files under ``root``, bounded to ``budget`` bytes."""
+
+    def __init__(self, root, budget):
+        self.root = os.path.abspath(root)
+        self.budget = budget
+        self._prune_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key, fmt):
+        return os.path.join(self.root, key[:2], f'{key}.{EXPORT_FORMATS[fmt][1]}')
+
+    def get(self, key, fmt):
+        """Return the path of the artifact stored under ``key``, or None."""
+        path = self.path(key, fmt)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, fmt, data):
+        """Store ``data`` under ``key`` and return its path."""
+        path = self.path(key, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.prune()
+        return path
+
+    def prune(self):
+        """Remove the least recently used artifacts until the cache fits its budget."""
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            entries = []
+            total = 0
+            for directory in os.scandir(self.root):
+                if not directory.is_dir():
+                    continue
+                for entry in os.scandir(directory.path):
+                    try:
+                        stat = entry.stat()
+                        if entry.name.endswith('.tmp'):
+                            if stat.st_mtime < now - STALE_TMP_AGE:
+                                os.remove(entry.path)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.budget:
+                return
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.budget or mtime > now - EVICTION_GRACE:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        finally:
+            self._prune_lock.release()
+
+
+cache = ArtifactCache(EXPORT_CACHE_DIR, EXPORT_CACHE_BYTES)
+
+
+def cached_export(fmt, content, title, digest=None):
+    """Return the path of a file holding ``content`` exported as ``fmt``.
+
+    The export is rendered only when no artifact for the same content,
+    format and options is cached. Raises ``ExportQueueFull`` when a PDF has
+    to be rendered and the export pool's queue is full.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    digest = digest or content_hash(content)
+    key = artifact_key(digest, fmt, title)
+    path = cache.get(key, fmt)
+    if path is not None:
+        return path
+    if fmt in POOL_FORMATS:
+        data = pool.submit(fmt, content, title, digest).result()
+    else:
+        data = render_export(fmt, content, title, digest)
+    return cache.put(key, fmt, data)
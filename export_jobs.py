@@ -0,0 +1,230 @@
+"""Export jobs rendered in a bounded pool of worker processes.
+
+Rendering (WeasyPrint layout above all) is CPU-bound and holds the GIL, so
+it runs in separate processes: ``ExportPool`` keeps up to
+``EXPORT_WORKERS`` long-lived workers, each fed by a dispatcher thread
+from a queue of at most ``EXPORT_QUEUE_DEPTH`` waiting jobs. A worker that
+overruns ``EXPORT_JOB_TIMEOUT`` is killed and replaced. Workers are fresh
+interpreters running this module as a script, so they neither import the
+app nor inherit locks held by request threads.
+
+Jobs submitted through ``submit_job`` record their status (and, once
+finished, their artifact) under ``EXPORT_JOBS_DIR``, so any app process
+can report on or serve a job whichever process accepted it.
+"""
+import json
+import os
+import pickle
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from renderer import EXPORT_FORMATS, render_export
+
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', min(os.cpu_count() or 1, 4)))
+EXPORT_QUEUE_DEPTH = int(os.environ.get('EXPORT_QUEUE_DEPTH', 32))
+EXPORT_JOB_TIMEOUT = float(os.environ.get('EXPORT_JOB_TIMEOUT', 300))
+EXPORT_JOB_TTL = float(os.environ.get('EXPORT_JOB_TTL', 3600))
+EXPORT_JOBS_DIR = os.path.join('exports', 'jobs')
+
+
+class ExportQueueFull(Exception):
+    """Raised by ``submit`` when ``EXPORT_QUEUE_DEPTH`` jobs are already waiting."""
+
+
+def _serve():
+    """Worker process loop: render each pickled request read from stdin."""
+    # Keep the protocol on the original stdout; stray prints go to stderr.
+    out = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    while True:
+        try:
+            args = pickle.load(sys.stdin.buffer)
+        except EOFError:
+            return
+        try:
+            response = (True, render_export(*args))
+        except Exception as e:
+            response = (False, f'{type(e).__name__}: {e}')
+        try:
+            pickle.dump(response, out)
+            out.flush()
+        except BrokenPipeError:
+            return
+
+
+class _Worker:
+    """A worker process and the pipes to it."""
+
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def render(self, args, timeout):
+        pickle.dump(args, self.process.stdin)
+        self.process.stdin.flush()
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError(f'Export did not finish within {timeout:g}s')
+        ok, result = pickle.load(self.process.stdout)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def stop(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class ExportPool:
+    """Bounded pool of export worker processes; started on first use."""
+
+    def __init__(self, workers=EXPORT_WORKERS, depth=EXPORT_QUEUE_DEPTH, timeout=EXPORT_JOB_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=depth)
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            for _ in range(self.workers):
+                threading.Thread(target=self._dispatch, daemon=True).start()
+            self._started = True
+
+    def submit(self, fmt, content, title, digest=None, on_start=None, block=False):
+        """Queue an export and return a ``Future`` of its bytes.
+
+        ``on_start`` is called from the dispatcher thread when a worker
+        picks the export up. With ``block`` a full queue is waited on
+        instead of raising ``ExportQueueFull``.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        if not self._started:
+            self._start()
+        future = Future()
+        try:
+            self.queue.put((future, (fmt, content, title, digest), on_start), block=block)
+        except queue.Full:
+            raise ExportQueueFull('Too many exports in progress, try again later')
+        return future
+
+    def _dispatch(self):
+        worker = None
+        while True:
+            future, args, on_start = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if on_start is not None:
+                    on_start()
+                if worker is None:
+                    worker = _Worker()
+                future.set_result(worker.render(args, self.timeout))
+            except (TimeoutError, EOFError, OSError, pickle.UnpicklingError) as e:
+                # The worker is stuck or gone; a fresh one takes the next job.
+                if worker is not None:
+                    worker.stop()
+                    worker = None
+                future.set_exception(e)
+            except Exception as e:
+                future.set_exception(e)
+
+
+pool = ExportPool()
+
+
+def _job_path(job_id, suffix):
+    return os.path.join(EXPORT_JOBS_DIR, f'{job_id}.{suffix}')
+
+
+def _write_status(job):
+    path = _job_path(job['id'], 'json')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+
+def _remove_expired_jobs():
+    cutoff = time.time() - EXPORT_JOB_TTL
+    for entry in os.scandir(EXPORT_JOBS_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+def submit_job(fmt, content, title, digest=None):
+    """Queue an export of ``content`` and return its job status dict.
+
+    Raises ``ExportQueueFull`` when the pool's queue is full.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    os.makedirs(EXPORT_JOBS_DIR, exist_ok=True)
+    _remove_expired_jobs()
+    job = {
+        'id': uuid.uuid4().hex,
+        'format': fmt,
+        'filename': f'{title}_export.{EXPORT_FORMATS[fmt][1]}',
+        'status': 'queued',
+        'error': None,
+        'created_at': time.time(),
+        'finished_at': None,
+    }
+    _write_status(job)
+
+    def started():
+        job['status'] = 'running'
+        _write_status(job)
+
+    def finished(future):
+        try:
+            data = future.result()
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        else:
+            with open(_job_path(job['id'], 'out'), 'wb') as f:
+                f.write(data)
+            job['status'] = 'done'
+        job['finished_at'] = time.time()
+        _write_status(job)
+
+    try:
+        future = pool.submit(fmt, content, title, digest, on_start=started)
+    except Exception:
+        os.remove(_job_path(job['id'], 'json'))
+        raise
+    future.add_done_callback(finished)
+    return dict(job)
+
+
+def get_job(job_id):
+    """Return the status dict of job ``job_id``, or None if it is unknown or expired."""
+    if not all(c in '0123456789abcdef' for c in job_id):
+        return None
+    try:
+        with open(_job_path(job_id, 'json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def job_artifact(job):
+    """Return the absolute path of a finished job's output file."""
+    return os.path.abspath(_job_path(job['id'], 'out'))
+
+
+if __name__ == '__main__':
+    _serve()
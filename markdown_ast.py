@@ -0,0 +1,120 @@
+"""Markdown parsed once into a mistune AST, shared by the export writers.
+
+``parse`` returns the block tokens of a document, with their inline
+children, and keeps them in a size-bounded LRU keyed by content hash, so
+exporting a document to several formats parses it once. The tokens are
+shared between callers and must be treated as read-only.
+
+Fenced code is highlighted with Pygments when it is installed, in the
+markup Python-Markdown's ``codehilite`` produces (``HIGHLIGHT_CSS`` styles
+it); without Pygments code blocks are left plain.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import mistune
+from mistune.core import BlockState
+from mistune.util import escape
+
+try:
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import TextLexer, get_lexer_by_name
+    from pygments.util import ClassNotFound
+except ImportError:
+    highlight = None
+
+# Counterparts of Python-Markdown's ``extra`` extension.
+PLUGINS = ('table', 'footnotes', 'def_list', 'abbr', 'strikethrough')
+# Budget of the AST cache, in characters of parsed Markdown.
+AST_CACHE_CHARS = int(os.environ.get('AST_CACHE_CHARS', 16 * 1024 * 1024))
+
+if highlight is not None:
+    _FORMATTER = HtmlFormatter(cssclass='codehilite', wrapcode=True)
+    HIGHLIGHT_CSS = _FORMATTER.get_style_defs('.codehilite')
+else:
+    HIGHLIGHT_CSS = ''
+
+_local = threading.local()
+_cache = OrderedDict()
+_cache_chars = 0
+_cache_lock = threading.Lock()
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class HTMLRenderer(mistune.HTMLRenderer):
+    """mistune's HTML renderer, with code blocks highlighted."""
+
+    def block_code(self, code, info=None):
+        language = info.split(None, 1)[0] if info and info.strip() else None
+        if highlight is None:
+            attribute = f' class="language-{escape(language)}"' if language else ''
+            return f'<pre class="codehilite"><code{attribute}>{escape(code)}</code></pre>\n'
+        try:
+            lexer = get_lexer_by_name(language) if language else TextLexer()
+        except ClassNotFound:
+            lexer = TextLexer()
+        return highlight(code, lexer, _FORMATTER)
+
+
+def create_markdown(renderer=None):
+    """Return a mistune instance with ``PLUGINS``; ``renderer`` None gives the AST."""
+    return mistune.create_markdown(escape=False, renderer=renderer, plugins=list(PLUGINS))
+
+
+def _markdown(renderer):
+    """Return this thread's mistune instance, ``renderer`` being 'ast' or 'html'."""
+    instances = getattr(_local, 'instances', None)
+    if instances is None:
+        instances = _local.instances = {}
+    md = instances.get(renderer)
+    if md is None:
+        md = instances[renderer] = create_markdown(None if renderer == 'ast' else HTMLRenderer(escape=False))
+    return md
+
+
+def parse(content, digest=None):
+    """Return the AST of the Markdown ``content``.
+
+    ``digest`` is the content's SHA-256 when the caller already has it.
+    """
+    global _cache_chars
+    key = digest or content_hash(content)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+            return entry[0]
+
+    tokens, _ = _markdown('ast').parse(content)
+    with _cache_lock:
+        if key not in _cache and len(content) <= AST_CACHE_CHARS:
+            _cache[key] = (tokens, len(content))
+            _cache_chars += len(content)
+            while _cache_chars > AST_CACHE_CHARS:
+                _, (_, size) = _cache.popitem(last=False)
+                _cache_chars -= size
+    return tokens
+
+
+def to_html(tokens, renderer=None):
+    """Return the HTML of ``tokens``; ``renderer`` defaults to ``HTMLRenderer``."""
+    return (renderer or _markdown('html').renderer)(tokens, BlockState())
+
+
+def plain_text(tokens):
+    """Return the text of inline ``tokens``, without markup."""
+    parts = []
+    for token in tokens:
+        if 'children' in token:
+            parts.append(plain_text(token['children']))
+        elif token['type'] in ('linebreak', 'softbreak'):
+            parts.append(' ')
+        else:
+            parts.append(token.get('raw', ''))
+    return ''.join(parts)
@@ -1,4 +1,139 @@
-import storage
+import os
+from contextvars import ContextVar
+from functools import wraps
+
+from quick_open import QuickOpenIndex
+from search_index import SearchIndex
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+
+if STORAGE_BACKEND == 'sqlite':
+    import sqlite_storage as storage
+elif STORAGE_BACKEND == 'postgres':
+    import postgres_storage as storage
+else:
+    import storage
+
+_folder_tree_cache = None
+_search_index = SearchIndex()
+_quick_open_index = QuickOpenIndex()
+_identity_map = ContextVar('identity_map', default=None)
+
+def group_commit():
+    """Flush the storage writes made inside the block with one durable sync per store."""
+    return storage.group_commit()
+
+def store_versions():
+    """Return ``{store name: version}``; a store's version changes whenever its data does."""
+    return storage.store_versions()
+
+def sync_search_index():
+    """Bring the full-text index up to date with the documents store.
+    
+    Cheap when nothing changed; the app also calls it once in the background
+    at startup so the first search does not pay for building the index.
+    """
+    _search_index.sync(storage.store_versions()['documents'],
+                       storage.get_all_documents, storage.get_document_content, _document_changes)
+
+def _document_changes(since):
+    """Return ``(ids, documents)`` for the documents changed since version
+    ``since`` of the documents store, or None if the store cannot tell."""
+    ids = storage.get_document_changes(since)
+    if ids is None:
+        return None
+    return ids, storage.get_documents_by_ids(ids)
+
+def paginate(items, key, limit=None, after=None):
+    """Return up to ``limit`` of ``items`` in descending ``key`` order,
+    starting below the key ``after``."""
+    if after is not None:
+        items = [item for item in items if key(item) < after]
+    items = sorted(items, key=key, reverse=True)
+    return items[:limit] if limit is not None else items
+
+class IdentityMap:
+    """Records referenced by ``to_dict`` calls, loaded once per request.
+    
+    Folders, tags, categories and the tag/category document counts are each
+    fetched with a single storage call the first time something needs them;
+    documents are cached by id once loaded. Model write methods clear the
+    map, so reads after a write see the new data.
+    """
+    
+    def __init__(self):
+        self.clear()
+    
+    def clear(self):
+        self._folders = None
+        self._tags = None
+        self._categories = None
+        self._tag_counts = None
+        self._category_counts = None
+        self._documents = {}
+    
+    def folder(self, folder_id):
+        if self._folders is None:
+            self._folders = {f['id']: f for f in storage.get_all_folders()}
+        return self._folders.get(folder_id)
+    
+    def tag(self, tag_id):
+        if self._tags is None:
+            self._tags = {t['id']: t for t in storage.get_all_tags()}
+        return self._tags.get(tag_id)
+    
+    def category(self, cat_id):
+        if self._categories is None:
+            self._categories = {c['id']: c for c in storage.get_all_categories()}
+        return self._categories.get(cat_id)
+    
+    def tag_count(self, tag_id):
+        if self._tag_counts is None:
+            self._tag_counts = storage.count_documents_by_tag()
+        return self._tag_counts.get(tag_id, 0)
+    
+    def category_count(self, cat_id):
+        if self._category_counts is None:
+            self._category_counts = storage.count_documents_by_category()
+        return self._category_counts.get(cat_id, 0)
+    
+    def documents(self, doc_ids):
+        missing = [doc_id for doc_id in doc_ids if doc_id not in self._documents]
+        if missing:
+            self._documents.update(dict.fromkeys(missing))
+            for doc in storage.get_documents_by_ids(missing):
+                self._documents[doc['id']] = doc
+        return [self._documents[doc_id] for doc_id in doc_ids]
+
+def start_unit_of_work():
+    """Serialize through a fresh IdentityMap until ``end_unit_of_work(token)``."""
+    return _identity_map.set(IdentityMap())
+
+def end_unit_of_work(token):
+    _identity_map.reset(token)
+
+def _writes(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            identity = _identity_map.get()
+            if identity is not None:
+                identity.clear()
+    return wrapper
+
+def _folder(folder_id):
+    identity = _identity_map.get()
+    return identity.folder(folder_id) if identity else storage.get_folder_by_id(folder_id)
+
+def _tag(tag_id):
+    identity = _identity_map.get()
+    return identity.tag(tag_id) if identity else storage.get_tag_by_id(tag_id)
+
+def _category(cat_id):
+    identity = _identity_map.get()
+    return identity.category(cat_id) if identity else storage.get_category_by_id(cat_id)
 
 class Folder:
     @staticmethod
@@ -14,38 +149,109 @@ class Folder:
         return storage.get_all_folders()
     
     @staticmethod
+    def get_subtree(folder_id):
+        return storage.get_folder_subtree(folder_id)
+    
+    @staticmethod
+    def count_documents_recursive(folder_id):
+        return storage.count_documents_in_folder_tree(folder_id)
+    
+    @staticmethod
+    @_writes
     def create(name, parent_id=None, color='#6366f1', icon='folder'):
         return storage.create_folder(name, parent_id, color, icon)
     
     @staticmethod
+    @_writes
     def update(folder_id, **kwargs):
         return storage.update_folder(folder_id, **kwargs)
     
     @staticmethod
+    @_writes
+    def move(folder_id, parent_id):
+        return storage.move_folder(folder_id, parent_id)
+    
+    @staticmethod
+    @_writes
     def delete(folder_id):
         storage.delete_folder(folder_id)
     
+    @staticmethod
+    def get_tree():
+        """Return ``(root nodes, nodes by id)`` for the whole folder tree.
+        
+        Built in one pass from all folders and the per-folder document
+        counts, and reused until the folder or document store changes.
+        """
+        global _folder_tree_cache
+        versions = storage.store_versions()
+        key = (versions['folders'], versions['documents']) if versions else None
+        cached = _folder_tree_cache
+        if key is not None and cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+        
+        folders = storage.get_all_folders()
+        counts = storage.count_documents_by_folder()
+        nodes = {}
+        for folder in folders:
+            nodes[folder['id']] = {
+                'id': folder['id'],
+                'name': folder['name'],
+                'parent_id': folder.get('parent_id'),
+                'created_at': folder.get('created_at'),
+                'updated_at': folder.get('updated_at'),
+                'color': folder.get('color', '#6366f1'),
+                'icon': folder.get('icon', 'folder'),
+                'position': folder.get('position', 0),
+                'children': [],
+                'document_count': counts.get(folder['id'], 0),
+                'total_document_count': 0
+            }
+        roots = []
+        for node in nodes.values():
+            if node['parent_id'] is None:
+                roots.append(node)
+            elif node['parent_id'] in nodes:
+                nodes[node['parent_id']]['children'].append(node)
+        
+        by_position = lambda x: x['position']
+        roots.sort(key=by_position)
+        # Depth-first order lists every parent before its children, so walking
+        # it backwards sums subtree counts bottom-up.
+        order = []
+        stack = list(roots)
+        while stack:
+            node = stack.pop()
+            node['children'].sort(key=by_position)
+            order.append(node)
+            stack.extend(node['children'])
+        for node in reversed(order):
+            node['total_document_count'] = node['document_count'] + sum(
+                child['total_document_count'] for child in node['children'])
+        
+        if key is not None:
+            _folder_tree_cache = (key, roots, nodes)
+        return roots, nodes
+    
+    @staticmethod
+    def get_paths():
+        """Return ``{folder_id: 'Parent/Child'}`` display paths for every folder."""
+        roots, nodes = Folder.get_tree()
+        paths = {}
+        stack = [(node, node['name']) for node in roots]
+        while stack:
+            node, path = stack.pop()
+            paths[node['id']] = path
+            stack.extend((child, f"{path}/{child['name']}") for child in node['children'])
+        return paths
+    
     @staticmethod
     def to_dict(folder_data):
         if not folder_data:
             return None
         
-        children = storage.get_folders_by_parent_id(folder_data['id'])
-        children_sorted = sorted(children, key=lambda x: x.get('position', 0))
-        documents = storage.get_documents_by_folder_id(folder_data['id'])
-        
-        return {
-            'id': folder_data['id'],
-            'name': folder_data['name'],
-            'parent_id': folder_data.get('parent_id'),
-            'created_at': folder_data.get('created_at'),
-            'updated_at': folder_data.get('updated_at'),
-            'color': folder_data.get('color', '#6366f1'),
-            'icon': folder_data.get('icon', 'folder'),
-            'position': folder_data.get('position', 0),
-            'children': [Folder.to_dict(child) for child in children_sorted],
-            'document_count': len(documents)
-        }
+        roots, nodes = Folder.get_tree()
+        return nodes.get(folder_data['id'])
 
 class Document:
     @staticmethod
@@ -56,47 +262,171 @@ class Document:
     def get_by_folder(folder_id):
         return storage.get_documents_by_folder_id(folder_id)
     
+    @staticmethod
+    def get_many(doc_ids):
+        """Return the documents for ``doc_ids`` in order, None for missing ids."""
+        identity = _identity_map.get()
+        if identity is not None:
+            return identity.documents(doc_ids)
+        found = {doc['id']: doc for doc in storage.get_documents_by_ids(doc_ids)}
+        return [found.get(doc_id) for doc_id in doc_ids]
+    
+    @staticmethod
+    def get_by_folder_tree(folder_id):
+        return storage.get_documents_in_folder_tree(folder_id)
+    
+    @staticmethod
+    def get_by_filename(filename, folder_id=None):
+        return storage.get_document_by_filename(filename, folder_id)
+    
+    @staticmethod
+    def find_by_filename(filename):
+        return storage.get_documents_by_filename(filename)
+    
+    @staticmethod
+    def get_by_tag(tag_id):
+        return storage.get_documents_by_tag_id(tag_id)
+    
+    @staticmethod
+    def get_by_category(cat_id):
+        return storage.get_documents_by_category_id(cat_id)
+    
     @staticmethod
     def get_all():
         return storage.get_all_documents()
     
     @staticmethod
+    def get_page(limit=None, after=None, folder_id=None):
+        return storage.get_documents_page(limit, after, folder_id)
+    
+    @staticmethod
+    def sort_key(doc_data):
+        """Key of the listing order (newest first) that page cursors refer to."""
+        return (doc_data.get('updated_at') or '', doc_data['id'])
+    
+    @staticmethod
+    def filter_ids(tag_ids=(), category_ids=(), folder_id=None, recursive=False):
+        """Return the ids of the documents with every tag in ``tag_ids`` and
+        every category in ``category_ids`` that are in ``folder_id`` (or its
+        subtree if ``recursive``); None when no filter is given."""
+        groups = [storage.get_documents_by_tag_id(tag_id) for tag_id in tag_ids]
+        groups += [storage.get_documents_by_category_id(cat_id) for cat_id in category_ids]
+        if folder_id is not None:
+            groups.append(storage.get_documents_in_folder_tree(folder_id) if recursive
+                          else storage.get_documents_by_folder_id(folder_id))
+        if not groups:
+            return None
+        ids = None
+        for group in sorted(groups, key=len):
+            group_ids = {doc['id'] for doc in group}
+            ids = group_ids if ids is None else ids & group_ids
+        return ids
+    
+    @staticmethod
+    def search(clauses, candidates=None):
+        """Return ``(doc_id, score)`` hits for the documents matching every
+        parsed query clause, limited to the ids in ``candidates`` if given."""
+        sync_search_index()
+        return list(_search_index.search(clauses, candidates).items())
+    
+    @staticmethod
+    def quick_open(query, limit=20):
+        """Return the ``limit`` documents whose ``folder/…/filename`` path
+        best matches ``query`` fuzzily (see ``QuickOpenIndex.search``)."""
+        versions = storage.store_versions()
+        version = (versions['folders'], versions['documents'])
+        _quick_open_index.sync(version, Document._quick_open_entries,
+                               lambda since: Document._quick_open_changes(since, version))
+        return _quick_open_index.search(query, limit)
+    
+    @staticmethod
+    def _quick_open_entries(documents=None):
+        paths = Folder.get_paths()
+        return [(doc['id'], paths.get(doc.get('folder_id'), ''), doc['filename'])
+                for doc in (storage.get_all_documents() if documents is None else documents)]
+    
+    @staticmethod
+    def _quick_open_changes(since, version):
+        # Renaming or moving a folder changes the paths of documents that
+        # were not written, so only document changes are followed.
+        if since[0] != version[0]:
+            return None
+        changes = _document_changes(since[1])
+        if changes is None:
+            return None
+        ids, documents = changes
+        return ids, Document._quick_open_entries(documents)
+    
+    @staticmethod
+    def search_key(hit):
+        """Key of the search result order (best first) that page cursors refer
+        to. The score is fixed-width text so cursors keep the listing shape."""
+        return ('%017.6f' % hit[1], hit[0])
+    
+    @staticmethod
+    def get_content(doc_data):
+        return storage.get_document_content(doc_data)
+    
+    @staticmethod
+    def open_content(doc_data):
+        return storage.open_document_content(doc_data)
+    
+    @staticmethod
+    def get_outline(doc_data):
+        return storage.get_document_outline(doc_data)
+    
+    @staticmethod
+    @_writes
     def create(filename, content='', folder_id=None):
         return storage.create_document(filename, content, folder_id)
     
     @staticmethod
+    @_writes
     def update(doc_id, **kwargs):
         return storage.update_document(doc_id, **kwargs)
     
     @staticmethod
+    @_writes
     def delete(doc_id):
         storage.delete_document(doc_id)
     
     @staticmethod
-    def to_dict(doc_data, include_content=False):
+    @_writes
+    def bulk_update(operations):
+        return storage.bulk_update_documents(operations)
+    
+    @staticmethod
+    def to_dict(doc_data, include_content=False, fields=None):
+        """Serialize ``doc_data``; ``fields`` (a set of keys, ``id`` always
+        included) limits the output and skips lookups for keys left out."""
         if not doc_data:
             return None
         
-        folder = storage.get_folder_by_id(doc_data.get('folder_id')) if doc_data.get('folder_id') else None
+        wanted = lambda key: fields is None or key in fields
+        
+        folder = None
+        if wanted('folder_name') and doc_data.get('folder_id'):
+            folder = _folder(doc_data.get('folder_id'))
         
         tags = []
-        for tag_id in doc_data.get('tag_ids', []):
-            tag = storage.get_tag_by_id(tag_id)
+        for tag_id in doc_data.get('tag_ids', []) if wanted('tags') else ():
+            tag = _tag(tag_id)
             if tag:
                 tags.append(Tag.to_dict(tag))
         
         categories = []
-        for cat_id in doc_data.get('category_ids', []):
-            cat = storage.get_category_by_id(cat_id)
+        for cat_id in doc_data.get('category_ids', []) if wanted('categories') else ():
+            cat = _category(cat_id)
             if cat:
                 categories.append(Category.to_dict(cat))
         
-        content = doc_data.get('content', '')
+        include_outline = wanted('outline') and (include_content or fields is not None)
+        include_content = include_content and wanted('content')
         
-        return {
+        result = {
             'id': doc_data['id'],
             'filename': doc_data['filename'],
-            'content': content if include_content else None,
+            'content': storage.get_document_content(doc_data) if include_content else None,
             'folder_id': doc_data.get('folder_id'),
             'folder_name': folder['name'] if folder else None,
             'created_at': doc_data.get('created_at'),
@@ -106,8 +436,16 @@ class Document:
             'last_opened_at': doc_data.get('last_opened_at'),
             'tags': tags,
             'categories': categories,
-            'size': len(content.encode('utf-8')) if content else 0
+            'content_hash': doc_data.get('content_hash'),
+            'size': doc_data.get('size', 0),
+            'line_count': doc_data.get('line_count', 0),
+            'word_count': doc_data.get('word_count', 0),
+            'char_count': doc_data.get('char_count', 0),
+            'outline': storage.get_document_outline(doc_data) if include_outline else None
         }
+        if fields is not None:
+            result = {key: value for key, value in result.items() if key == 'id' or key in fields}
+        return result
 
 class Tag:
     @staticmethod
@@ -119,18 +457,22 @@ class Tag:
         return storage.get_all_tags()
     
     @staticmethod
+    @_writes
     def create(name, color='#6366f1'):
         return storage.create_tag(name, color)
     
     @staticmethod
+    @_writes
     def delete(tag_id):
         storage.delete_tag(tag_id)
     
     @staticmethod
+    @_writes
     def add_to_document(doc_id, tag_id):
         return storage.add_tag_to_document(doc_id, tag_id)
     
     @staticmethod
+    @_writes
     def remove_from_document(doc_id, tag_id):
         return storage.remove_tag_from_document(doc_id, tag_id)
     
@@ -139,8 +481,11 @@ class Tag:
         if not tag_data:
             return None
         
-        documents = storage.get_all_documents()
-        document_count = sum(1 for doc in documents if tag_data['id'] in doc.get('tag_ids', []))
+        identity = _identity_map.get()
+        if identity is not None:
+            document_count = identity.tag_count(tag_data['id'])
+        else:
+            document_count = storage.count_documents_by_tag_id(tag_data['id'])
         
         return {
             'id': tag_data['id'],
@@ -160,18 +505,22 @@ class Category:
         return storage.get_all_categories()
     
     @staticmethod
+    @_writes
     def create(name, color='#ec4899', icon='bookmark'):
         return storage.create_category(name, color, icon)
     
     @staticmethod
+    @_writes
     def delete(cat_id):
         storage.delete_category(cat_id)
     
     @staticmethod
+    @_writes
     def add_to_document(doc_id, cat_id):
         return storage.add_category_to_document(doc_id, cat_id)
     
     @staticmethod
+    @_writes
     def remove_from_document(doc_id, cat_id):
         return storage.remove_category_from_document(doc_id, cat_id)
     
@@ -180,8 +529,11 @@ class Category:
         if not cat_data:
             return None
         
-        documents = storage.get_all_documents()
-        document_count = sum(1 for doc in documents if cat_data['id'] in doc.get('category_ids', []))
+        identity = _identity_map.get()
+        if identity is not None:
+            document_count = identity.category_count(cat_data['id'])
+        else:
+            document_count = storage.count_documents_by_category_id(cat_data['id'])
         
         return {
             'id': cat_data['id'],
@@ -198,18 +550,22 @@ class RecentFile:
         return storage.add_recent_file(doc_id)
     
     @staticmethod
-    def get_recent(limit=20):
-        return storage.get_recent_files(limit)
+    def get_recent(limit=20, after=None):
+        return storage.get_recent_files(limit, after)
+    
+    @staticmethod
+    def sort_key(recent_data):
+        return (recent_data.get('accessed_at') or '', recent_data['id'])
     
     @staticmethod
-    def to_dict(recent_data):
+    def to_dict(recent_data, fields=None):
         if not recent_data:
             return None
         
-        doc = storage.get_document_by_id(recent_data['document_id'])
+        doc = Document.get_many([recent_data['document_id']])[0]
         
         return {
             'id': recent_data['id'],
-            'document': Document.to_dict(doc) if doc else None,
+            'document': Document.to_dict(doc, fields=fields) if doc else None,
             'accessed_at': recent_data.get('accessed_at')
         }
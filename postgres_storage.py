@@ -0,0 +1,194 @@
+"""PostgreSQL storage engine (``STORAGE_BACKEND=postgres``).
+
+Implements the ``storage.py`` function API against a shared PostgreSQL
+database so several app nodes can serve one corpus. Connections come from
+a bounded pool shared by every gunicorn thread in the process, and
+statements are server-side prepared on first use (``prepare_threshold=0``)
+so the hot by-id and by-folder lookups skip re-planning.
+
+Requires ``psycopg`` and ``psycopg-pool`` (``pip install .[postgres]``).
+Import existing ``data/*.json`` files with::
+
+    python postgres_storage.py import-json
+"""
+import os
+import sys
+from contextlib import contextmanager
+
+from psycopg_pool import ConnectionPool
+
+from sql_storage import SQLStorage, STORAGE_API, VERSIONED_TABLES
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql:///mk')
+POSTGRES_POOL_MIN = int(os.environ.get('POSTGRES_POOL_MIN', 1))
+POSTGRES_POOL_MAX = int(os.environ.get('POSTGRES_POOL_MAX', 10))
+POSTGRES_POOL_TIMEOUT = float(os.environ.get('POSTGRES_POOL_TIMEOUT', 30))
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS folders (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        name TEXT NOT NULL,
+        parent_id BIGINT,
+        path TEXT COLLATE "C" NOT NULL DEFAULT '',
+        created_at TEXT,
+        updated_at TEXT,
+        color TEXT NOT NULL DEFAULT '#6366f1',
+        icon TEXT NOT NULL DEFAULT 'folder',
+        position INTEGER NOT NULL DEFAULT 0
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders (parent_id)',
+    """CREATE TABLE IF NOT EXISTS documents (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        filename TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        size INTEGER NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        word_count INTEGER NOT NULL DEFAULT 0,
+        char_count INTEGER NOT NULL DEFAULT 0,
+        outline TEXT NOT NULL DEFAULT '[]',
+        folder_id BIGINT,
+        created_at TEXT,
+        updated_at TEXT,
+        is_favorite BOOLEAN NOT NULL DEFAULT FALSE,
+        is_pinned BOOLEAN NOT NULL DEFAULT FALSE,
+        last_opened_at TEXT
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_documents_folder ON documents (folder_id)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents (filename, folder_id)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_updated ON documents (updated_at)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_updated_id ON documents (updated_at, id)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)',
+    """CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        content TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS tags (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        color TEXT NOT NULL DEFAULT '#6366f1',
+        created_at TEXT,
+        document_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        color TEXT NOT NULL DEFAULT '#ec4899',
+        icon TEXT NOT NULL DEFAULT 'bookmark',
+        created_at TEXT,
+        document_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS document_tags (
+        document_id BIGINT NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+        tag_id BIGINT NOT NULL REFERENCES tags (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (document_id, tag_id)
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_document_tags_tag ON document_tags (tag_id)',
+    """CREATE TABLE IF NOT EXISTS document_categories (
+        document_id BIGINT NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+        category_id BIGINT NOT NULL REFERENCES categories (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (document_id, category_id)
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_document_categories_category ON document_categories (category_id)',
+    """CREATE TABLE IF NOT EXISTS recent_files (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        document_id BIGINT NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+        accessed_at TEXT
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_recent_files_accessed ON recent_files (accessed_at)',
+    """CREATE TABLE IF NOT EXISTS store_versions (
+        name TEXT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    )""",
+)
+
+TRIGGERS = tuple(
+    statement
+    for table, links, column in (('tags', 'document_tags', 'tag_id'),
+                                 ('categories', 'document_categories', 'category_id'))
+    for statement in (
+        f"""CREATE OR REPLACE FUNCTION count_{links}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE {table} SET document_count = document_count + 1 WHERE id = NEW.{column};
+            ELSE
+                UPDATE {table} SET document_count = document_count - 1 WHERE id = OLD.{column};
+            END IF;
+            RETURN NULL;
+        END $$""",
+        f'CREATE OR REPLACE TRIGGER {links}_count AFTER INSERT OR DELETE ON {links} '
+        f'FOR EACH ROW EXECUTE FUNCTION count_{links}()',
+    )
+) + (
+    """CREATE OR REPLACE FUNCTION bump_store_version() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE store_versions SET version = version + 1 WHERE name = TG_ARGV[0];
+        RETURN NULL;
+    END $$""",
+) + tuple(
+    # Per statement, so bulk updates bump the version once rather than per row.
+    f'CREATE OR REPLACE TRIGGER {table}_version AFTER INSERT OR UPDATE OR DELETE ON {table} '
+    f"FOR EACH STATEMENT EXECUTE FUNCTION bump_store_version('{name}')"
+    for table, name in VERSIONED_TABLES.items()
+)
+
+IDENTITY_TABLES = ('folders', 'documents', 'tags', 'categories', 'recent_files')
+SCHEMA_LOCK_ID = 0x6d6b
+
+
+class PostgresStorage(SQLStorage):
+    placeholder = '%s'
+    schema = SCHEMA
+    triggers = TRIGGERS
+    path_column = "TEXT COLLATE \"C\" NOT NULL DEFAULT ''"
+
+    def __init__(self, conninfo, min_size=POSTGRES_POOL_MIN, max_size=POSTGRES_POOL_MAX,
+                 timeout=POSTGRES_POOL_TIMEOUT):
+        self.pool = ConnectionPool(
+            conninfo,
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
+            kwargs={'prepare_threshold': 0},
+            open=True,
+        )
+        self.init_schema()
+
+    @contextmanager
+    def connect(self):
+        with self.pool.connection() as conn:
+            yield conn
+
+    def lock_schema(self, conn):
+        # Serialize concurrent schema creation when several nodes boot at once.
+        self.execute(conn, 'SELECT pg_advisory_xact_lock(?)', (SCHEMA_LOCK_ID,))
+
+    def add_column(self, conn, table, column, definition):
+        exists = self.scalar(conn,
+            'SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() '
+            'AND table_name = ? AND column_name = ?', (table, column))
+        if exists:
+            return False
+        self.execute(conn, f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+
+    def after_import(self, conn):
+        for table in IDENTITY_TABLES:
+            self.execute(conn,
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+
+
+engine = PostgresStorage(DATABASE_URL)
+globals().update(engine.api())
+
+__all__ = list(STORAGE_API)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['import-json']:
+        sys.exit('usage: python postgres_storage.py import-json')
+    import storage
+    counts = engine.import_json(storage)
+    print(', '.join(f'{count} {name}' for name, count in counts.items()))
@@ -0,0 +1,211 @@
+"""Fuzzy quick-open matching over document paths.
+
+Every document is indexed under its display path (``Folder/Sub/name.md``).
+Per-character and per-letter-pair bitsets (Python ints, one bit per
+document slot) narrow a query down to the paths that can contain it before
+any string is looked at; the survivors are scored, those holding the
+query's letter pairs at a word start first, until ``SCAN_LIMIT`` paths have
+been scored.
+
+Like ``search_index``, the index lives in each process and follows the
+folder and document stores through ``sync()``. When the caller can list
+the documents changed since the indexed version, a sync only looks at
+those. Otherwise, for example after a folder was renamed or moved, it
+walks every document, re-indexing only those whose path changed.
+"""
+import heapq
+import threading
+
+SCAN_LIMIT = 1000
+SEPARATORS = '/-_. '
+# Prefix of the keys marking characters that start a word; never in a path.
+WORD_START = '\0'
+
+
+def _fold(text):
+    """Lower-case ``text`` without changing its length, so offsets carry over."""
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def _bits(slots):
+    """Return an int with the bits of ``slots`` set."""
+    if not slots:
+        return 0
+    buffer = bytearray(max(slots) // 8 + 1)
+    for slot in slots:
+        buffer[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def _slots(mask):
+    """Yield the set bits of ``mask``, lowest first."""
+    digits = bin(mask)[:1:-1]
+    index = digits.find('1')
+    while index != -1:
+        yield index
+        index = digits.find('1', index + 1)
+
+
+def _keys(path):
+    """Return the character, letter-pair and word-start keys of a folded path."""
+    keys = set(path)
+    keys.update(path[i:i + 2] for i in range(len(path) - 1))
+    keys.update(WORD_START + c for i, c in enumerate(path) if i == 0 or path[i - 1] in SEPARATORS)
+    return keys
+
+
+def _subsequence(path, query, start):
+    """Return the ``[start, end]`` ranges matching ``query`` as a subsequence of ``path[start:]``."""
+    ranges = []
+    position = start
+    for char in query:
+        position = path.find(char, position)
+        if position == -1:
+            return None
+        if ranges and ranges[-1][1] == position:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([position, position + 1])
+        position += 1
+    return ranges
+
+
+def _score(path, name_start, query):
+    """Return ``(score, ranges)`` for ``query`` against the folded ``path``, or None."""
+    index = path.find(query, name_start)
+    if index != -1:
+        if index == name_start:
+            score = 4000
+        else:
+            score = 3000 if path[index - 1] in SEPARATORS else 2000
+        return score - (len(path) - name_start), [[index, index + len(query)]]
+    index = path.find(query)
+    if index != -1:
+        score = 1500 if index == 0 or path[index - 1] in SEPARATORS else 1000
+        return score - len(path), [[index, index + len(query)]]
+    ranges = _subsequence(path, query, name_start)
+    score = 500
+    if ranges is None:
+        ranges = _subsequence(path, query, 0)
+        score = 0
+        if ranges is None:
+            return None
+    boundaries = sum(1 for start, _ in ranges if start == 0 or path[start - 1] in SEPARATORS)
+    return score + 20 * boundaries - 10 * len(ranges) - len(path) // 4, ranges
+
+
+class QuickOpenIndex:
+    """Bitset index of document paths for fuzzy, as-you-type matching."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self._entries = {}    # doc_id -> (slot, path, folded path, name start, keys)
+        self._slots = []      # slot -> doc_id, None for free slots
+        self._free = []
+        self._masks = {}      # key -> bitset of slots
+
+    def sync(self, version, entries, list_changes=None):
+        """Bring the index up to date at ``version``.
+
+        Nothing is done unless ``version`` differs from the last sync. Then
+        ``list_changes(since)``, if given, returns ``(ids, changed)``: the
+        ids of the documents changed since the indexed version and the
+        entries of those still present; or None, and ``entries()`` must
+        return the entries of every document instead. An entry is
+        ``(doc_id, folder path, filename)``; documents whose path is
+        unchanged are left alone.
+        """
+        with self.lock:
+            if version == self.version:
+                return
+            changes = list_changes(self.version) if list_changes and self.version is not None else None
+            if changes is None:
+                ids, changed = self._entries.keys(), entries()
+            else:
+                ids, changed = changes
+            added = {}
+            removed = {}
+            seen = set()
+            for doc_id, folder_path, filename in changed:
+                seen.add(doc_id)
+                path = f'{folder_path}/{filename}' if folder_path else filename
+                entry = self._entries.get(doc_id)
+                if entry is not None and entry[1] == path:
+                    continue
+                if entry is not None:
+                    self._remove(doc_id, removed)
+                self._add(doc_id, path, len(path) - len(filename), added)
+            for doc_id in set(ids) - seen:
+                if doc_id in self._entries:
+                    self._remove(doc_id, removed)
+            for key in added.keys() | removed.keys():
+                mask = (self._masks.get(key, 0) & ~_bits(removed.get(key))) | _bits(added.get(key))
+                if mask:
+                    self._masks[key] = mask
+                else:
+                    self._masks.pop(key, None)
+            self.version = version
+
+    def _add(self, doc_id, path, name_start, added):
+        slot = self._free.pop() if self._free else len(self._slots)
+        if slot == len(self._slots):
+            self._slots.append(doc_id)
+        else:
+            self._slots[slot] = doc_id
+        folded = _fold(path)
+        keys = _keys(folded)
+        for key in keys:
+            added.setdefault(key, []).append(slot)
+        self._entries[doc_id] = (slot, path, folded, name_start, keys)
+
+    def _remove(self, doc_id, removed):
+        slot, _, _, _, keys = self._entries.pop(doc_id)
+        for key in keys:
+            removed.setdefault(key, []).append(slot)
+        self._slots[slot] = None
+        self._free.append(slot)
+
+    def search(self, query, limit=20):
+        """Return up to ``limit`` best matches for ``query``, best first, as
+        ``{'document_id', 'path', 'score', 'highlights'}`` dicts where
+        ``highlights`` are ``[start, end]`` ranges of ``path``."""
+        query = ''.join(_fold(query).split())
+        if not query:
+            return []
+        with self.lock:
+            masks = self._masks
+            mask = -1
+            for char in set(query):
+                mask &= masks.get(char, 0)
+            if not mask:
+                return []
+            strong = mask
+            for i in range(len(query) - 1):
+                strong &= masks.get(query[i:i + 2], 0)
+            initial = strong & masks.get(WORD_START + query[0], 0)
+
+            best = []
+            scanned = 0
+            for tier in (initial, strong & ~initial, mask & ~strong):
+                for slot in _slots(tier):
+                    doc_id = self._slots[slot]
+                    _, path, folded, name_start, _ = self._entries[doc_id]
+                    match = _score(folded, name_start, query)
+                    if match is not None:
+                        item = (match[0], -doc_id, path, match[1])
+                        if len(best) < limit:
+                            heapq.heappush(best, item)
+                        elif item > best[0]:
+                            heapq.heapreplace(best, item)
+                    scanned += 1
+                    if scanned >= SCAN_LIMIT:
+                        break
+                else:
+                    continue
+                break
+        return [{'document_id': -doc_id, 'path': path, 'score': score, 'highlights': ranges}
+                for score, doc_id, path, ranges in sorted(best, reverse=True)]
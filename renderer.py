@@ -0,0 +1,240 @@
+"""Markdown rendering shared by the export and preview endpoints.
+
+Everything starts from the mistune AST cached by ``markdown_ast``, so
+previewing a document and exporting it to several formats parses it once.
+``render_html`` turns the AST into the HTML fragment used by previews and
+by the HTML and PDF pages, and keeps it in a size-bounded LRU keyed by
+content hash, so previewing or exporting an unchanged document renders it
+once too.
+
+Exports go through ``render_export``, which dispatches to the writer
+registered for the format.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from weasyprint import HTML
+
+import document_writers
+from markdown_ast import HIGHLIGHT_CSS, content_hash, parse, to_html
+
+# format -> (mimetype, file extension), filled in by register_writer()
+EXPORT_FORMATS = {}
+# Formats whose output depends on the title passed to the writer.
+TITLED_FORMATS = set()
+# Budget of the rendered-HTML cache, in characters.
+RENDER_CACHE_CHARS = int(os.environ.get('RENDER_CACHE_CHARS', 32 * 1024 * 1024))
+
+SCREEN_PAGE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <style>
+        body {{
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 2rem;
+            line-height: 1.6;
+            color: #333;
+        }}
+        h1, h2, h3, h4, h5, h6 {{
+            margin-top: 1.5em;
+            margin-bottom: 0.5em;
+        }}
+        code {{
+            background: #f4f4f4;
+            padding: 0.2em 0.4em;
+            border-radius: 3px;
+            font-family: 'Courier New', monospace;
+        }}
+        pre {{
+            background: #f4f4f4;
+            padding: 1em;
+            border-radius: 5px;
+            overflow-x: auto;
+        }}
+        pre code {{
+            background: none;
+            padding: 0;
+        }}
+        blockquote {{
+            border-left: 4px solid #ddd;
+            margin-left: 0;
+            padding-left: 1em;
+            color: #666;
+        }}
+        table {{
+            border-collapse: collapse;
+            width: 100%;
+            margin: 1em 0;
+        }}
+        th, td {{
+            border: 1px solid #ddd;
+            padding: 0.5em;
+            text-align: left;
+        }}
+        th {{
+            background: #f4f4f4;
+        }}
+{highlight_css}
+    </style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+PRINT_PAGE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <style>
+        @page {{
+            size: A4;
+            margin: 2cm;
+        }}
+        body {{
+            font-family: 'DejaVu Sans', Arial, sans-serif;
+            line-height: 1.6;
+            color: #333;
+        }}
+        h1, h2, h3, h4, h5, h6 {{
+            margin-top: 1.5em;
+            margin-bottom: 0.5em;
+            page-break-after: avoid;
+        }}
+        code {{
+            background: #f4f4f4;
+            padding: 0.2em 0.4em;
+            border-radius: 3px;
+            font-family: 'Courier New', monospace;
+        }}
+        pre {{
+            background: #f4f4f4;
+            padding: 1em;
+            border-radius: 5px;
+            overflow-x: auto;
+            page-break-inside: avoid;
+        }}
+        pre code {{
+            background: none;
+            padding: 0;
+        }}
+        blockquote {{
+            border-left: 4px solid #ddd;
+            margin-left: 0;
+            padding-left: 1em;
+            color: #666;
+        }}
+        table {{
+            border-collapse: collapse;
+            width: 100%;
+            margin: 1em 0;
+            page-break-inside: avoid;
+        }}
+        th, td {{
+            border: 1px solid #ddd;
+            padding: 0.5em;
+            text-align: left;
+        }}
+        th {{
+            background: #f4f4f4;
+        }}
+{highlight_css}
+    </style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+_cache = OrderedDict()
+_cache_chars = 0
+_cache_lock = threading.Lock()
+_writers = {}
+
+
+def render_html(content, digest=None):
+    """Return the HTML fragment for the Markdown ``content``.
+    
+    ``digest`` is the content's SHA-256 when the caller already has it
+    (documents store it as ``content_hash``).
+    """
+    global _cache_chars
+    key = digest or content_hash(content)
+    with _cache_lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+            return html
+    
+    html = to_html(parse(content, key))
+    with _cache_lock:
+        if key not in _cache and len(html) <= RENDER_CACHE_CHARS:
+            _cache[key] = html
+            _cache_chars += len(html)
+            while _cache_chars > RENDER_CACHE_CHARS:
+                _, evicted = _cache.popitem(last=False)
+                _cache_chars -= len(evicted)
+    return html
+
+
+def screen_page(content, title, digest=None):
+    """Return a standalone HTML page for ``content``, styled for browsers."""
+    return SCREEN_PAGE.format(title=title, body=render_html(content, digest), highlight_css=HIGHLIGHT_CSS)
+
+
+def print_page(content, digest=None):
+    """Return a standalone HTML page for ``content``, styled for A4 printing."""
+    return PRINT_PAGE.format(body=render_html(content, digest), highlight_css=HIGHLIGHT_CSS)
+
+
+def register_writer(fmt, mimetype, extension, write, titled=False):
+    """Export ``fmt`` files with ``write(content, title, digest)``, which returns bytes.
+    
+    ``titled`` tells whether the output depends on the title.
+    """
+    EXPORT_FORMATS[fmt] = (mimetype, extension)
+    _writers[fmt] = write
+    if titled:
+        TITLED_FORMATS.add(fmt)
+    else:
+        TITLED_FORMATS.discard(fmt)
+
+
+def render_export(fmt, content, title, digest=None):
+    """Return ``content`` exported as ``fmt`` (a key of ``EXPORT_FORMATS``), as bytes."""
+    write = _writers.get(fmt)
+    if write is None:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return write(content, title, digest)
+
+
+def _write_html(content, title, digest=None):
+    return screen_page(content, title, digest).encode('utf-8')
+
+
+def _write_pdf(content, title, digest=None):
+    return HTML(string=print_page(content, digest)).write_pdf()
+
+
+def _write_text(content, title, digest=None):
+    return content.encode('utf-8')
+
+
+register_writer('html', 'text/html', 'html', _write_html, titled=True)
+register_writer('pdf', 'application/pdf', 'pdf', _write_pdf)
+register_writer('txt', 'text/plain', 'txt', _write_text)
+register_writer('md', 'text/markdown', 'md', _write_text)
+register_writer('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx',
+                document_writers.write_docx, titled=True)
+register_writer('odt', 'application/vnd.oasis.opendocument.text', 'odt', document_writers.write_odt, titled=True)
+register_writer('epub', 'application/epub+zip', 'epub', document_writers.write_epub, titled=True)
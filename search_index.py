@@ -0,0 +1,270 @@
+"""In-memory inverted index for full-text search over documents.
+
+Words are folded so that searches ignore case, Latin accents, Arabic
+diacritics and tatweel, Hebrew points, the common Arabic letter variants
+(hamza-carrying alefs, alef maqsura, ta marbuta) and the Arabic definite
+article. Postings keep word positions for phrase queries, and results are
+ranked with BM25.
+
+The index lives in each process and follows the documents store through
+``sync()``. When the store can list the documents changed since the
+indexed version (the JSON store can, for its recent commits), a sync only
+looks at those. Otherwise it walks every document record, re-tokenizing
+only those whose filename or content hash changed. Searching costs the
+postings it reads, not the size of the corpus.
+"""
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+from itertools import chain
+
+# Combining marks that may sit inside a word; they are dropped by normalize().
+_MARKS = '\u0300-\u036f\u0591-\u05c7\u0610-\u061a\u0640\u064b-\u065f\u0670\u06d6-\u06ed'
+# Underscores are blanked out before matching (see words()).
+_WORD = re.compile(rf'[\w{_MARKS}]+')
+_QUERY = re.compile(r'"([^"]*)"?|(\S+)')
+_FOLD = str.maketrans({'\u0640': None, '\u0649': '\u064a', '\u0629': '\u0647'})
+# Arabic definite article, with the conjunctions and prepositions fused to it.
+_ARTICLES = ('\u0648\u0627\u0644', '\u0628\u0627\u0644', '\u0643\u0627\u0644', '\u0641\u0627\u0644', '\u0644\u0644', '\u0627\u0644')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_MIN_LENGTH = 2
+PREFIX_EXPANSIONS = 64
+SNIPPET_WIDTH = 160
+
+
+@lru_cache(maxsize=1 << 16)
+def normalize(word):
+    """Return the index term for ``word``."""
+    if word.isascii():
+        return word.lower()
+    word = unicodedata.normalize('NFD', unicodedata.normalize('NFKC', word).casefold())
+    word = ''.join(c for c in word if unicodedata.category(c) != 'Mn')
+    word = unicodedata.normalize('NFC', word).translate(_FOLD)
+    for article in _ARTICLES:
+        if word.startswith(article) and len(word) - len(article) >= 2:
+            return word[len(article):]
+    return word
+
+
+def index_terms(text):
+    """Return the terms of ``text`` in order."""
+    return [term for term in map(normalize, _WORD.findall(text.replace('_', ' '))) if term]
+
+
+def tokenize(text):
+    """Yield ``(term, start, end)`` for every word of ``text``."""
+    for match in _WORD.finditer(text.replace('_', ' ')):
+        term = normalize(match.group())
+        if term:
+            yield term, match.start(), match.end()
+
+
+def parse_query(query):
+    """Split ``query`` into clauses, each a ``(terms, prefix)`` pair.
+
+    Quoted text and words joined by punctuation (``foo-bar``) become
+    phrases. The last bare word also matches as a prefix unless the query
+    ends with whitespace, so results follow the user while typing.
+    """
+    clauses = []
+    for match in _QUERY.finditer(query):
+        words = tuple(index_terms(match.group(1) if match.group(1) is not None else match.group(2)))
+        if words:
+            clauses.append((words, False))
+    if clauses and not query[-1:].isspace() and not query.rstrip().endswith('"'):
+        terms, _ = clauses[-1]
+        if len(terms) == 1 and len(terms[0]) >= PREFIX_MIN_LENGTH:
+            clauses[-1] = (terms, True)
+    return clauses
+
+
+def snippet(content, clauses, width=SNIPPET_WIDTH):
+    """Return the passage of ``content`` around the first query match.
+
+    The result is ``{'text', 'offset', 'matches'}`` where ``offset`` is the
+    position of ``text`` in ``content`` and ``matches`` lists the
+    ``[start, end]`` ranges of matched words within ``text``.
+    """
+    exact = set()
+    prefixes = []
+    for terms, prefix in clauses:
+        if prefix:
+            prefixes.append(terms[0])
+        else:
+            exact.update(terms)
+    spans = [(start, end) for term, start, end in tokenize(content)
+             if term in exact or any(term.startswith(p) for p in prefixes)]
+
+    start = max(spans[0][0] - width // 4, 0) if spans else 0
+    if start:
+        space = content.find(' ', start, spans[0][0])
+        start = space + 1 if space != -1 else start
+    end = min(start + width, len(content))
+    if end < len(content):
+        space = content.rfind(' ', start, end)
+        end = space if space > start else end
+    return {
+        'text': content[start:end],
+        'offset': start,
+        'matches': [[s - start, e - start] for s, e in spans if s >= start and e <= end],
+    }
+
+
+class SearchIndex:
+    """Positional inverted index over document filenames and contents."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self._postings = {}   # term -> {doc_id: [positions]}
+        self._terms = []      # sorted vocabulary, for prefix lookups
+        self._docs = {}       # doc_id -> (fingerprint, length, terms)
+        self._total_length = 0
+
+    def sync(self, version, list_documents, get_content, list_changes=None):
+        """Bring the index up to date with the documents store at ``version``.
+
+        Nothing is done unless ``version`` differs from the last sync. Then
+        ``list_changes(since)``, if given, returns ``(ids, documents)``: the
+        ids of the documents changed since the indexed version and the
+        records of those still present; or None, and ``list_documents()``
+        must return every document record instead. ``get_content(doc)`` is
+        called for the documents that changed since they were indexed.
+        """
+        with self.lock:
+            if version == self.version:
+                return
+            changes = list_changes(self.version) if list_changes and self.version is not None else None
+            if changes is None:
+                ids, documents = self._docs.keys(), list_documents()
+            else:
+                ids, documents = changes
+            seen = set()
+            for doc in documents:
+                seen.add(doc['id'])
+                fingerprint = (doc['filename'], doc.get('content_hash'))
+                entry = self._docs.get(doc['id'])
+                if entry is None or entry[0] != fingerprint:
+                    self._remove(doc['id'])
+                    self._add(doc['id'], fingerprint, doc['filename'], get_content(doc))
+            for doc_id in set(ids) - seen:
+                self._remove(doc_id)
+            self.version = version
+
+    def _add(self, doc_id, fingerprint, filename, content):
+        # The filename is indexed ahead of the content, one position apart so
+        # that phrases cannot span the two.
+        title = index_terms(filename)
+        body = index_terms(content)
+        positions = {}
+        for position, term in chain(enumerate(title), enumerate(body, len(title) + 1)):
+            term_positions = positions.get(term)
+            if term_positions is None:
+                positions[term] = [position]
+            else:
+                term_positions.append(position)
+        length = len(title) + len(body)
+        for term, term_positions in positions.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                bisect.insort(self._terms, term)
+            postings[doc_id] = term_positions
+        self._docs[doc_id] = (fingerprint, length, tuple(positions))
+        self._total_length += length
+
+    def _remove(self, doc_id):
+        entry = self._docs.pop(doc_id, None)
+        if entry is None:
+            return
+        _, length, terms = entry
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        self._total_length -= length
+
+    def _expand(self, prefix):
+        """Return the most frequent indexed terms starting with ``prefix``."""
+        index = bisect.bisect_left(self._terms, prefix)
+        terms = []
+        while index < len(self._terms) and self._terms[index].startswith(prefix):
+            terms.append(self._terms[index])
+            index += 1
+        if len(terms) > PREFIX_EXPANSIONS:
+            terms.sort(key=lambda term: len(self._postings[term]), reverse=True)
+            del terms[PREFIX_EXPANSIONS:]
+        return terms
+
+    def _bm25(self, frequency, document_frequency, doc_id):
+        count = len(self._docs)
+        idf = math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+        norm = 1 - BM25_B + BM25_B * self._docs[doc_id][1] / (self._total_length / count)
+        return idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+
+    def _match(self, terms, prefix, candidates):
+        """Return ``{doc_id: score}`` for the documents matching one clause."""
+        if prefix:
+            scores = {}
+            for term in self._expand(terms[0]):
+                postings = self._postings[term]
+                for doc_id, positions in postings.items():
+                    if candidates is None or doc_id in candidates:
+                        scores[doc_id] = scores.get(doc_id, 0) + self._bm25(len(positions), len(postings), doc_id)
+            return scores
+
+        postings = [self._postings.get(term) for term in terms]
+        if not all(postings):
+            return {}
+        rarest = min(postings, key=len)
+        scores = {}
+        for doc_id in rarest:
+            if candidates is not None and doc_id not in candidates:
+                continue
+            if len(terms) == 1:
+                frequency = len(rarest[doc_id])
+            else:
+                if not all(doc_id in p for p in postings):
+                    continue
+                following = [set(p[doc_id]) for p in postings[1:]]
+                frequency = sum(1 for start in postings[0][doc_id]
+                                if all(start + i in positions for i, positions in enumerate(following, 1)))
+                if not frequency:
+                    continue
+            scores[doc_id] = sum(self._bm25(frequency, len(p), doc_id) for p in postings)
+        return scores
+
+    def search(self, clauses, candidates=None):
+        """Return ``{doc_id: score}`` for the documents matching every clause.
+
+        ``candidates``, a set of document ids, restricts the search (tag,
+        category and folder filters).
+        """
+        if not clauses:
+            return {}
+        with self.lock:
+            if not self._docs:
+                return {}
+            scores = None
+            # Rare clauses first, so later ones only look at their survivors.
+            for terms, prefix in sorted(clauses, key=lambda clause: self._estimate(*clause)):
+                matched = self._match(terms, prefix, candidates if scores is None else scores.keys())
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {doc_id: score + matched[doc_id] for doc_id, score in scores.items() if doc_id in matched}
+                if not scores:
+                    return {}
+            return scores
+
+    def _estimate(self, terms, prefix):
+        if prefix:
+            return len(self._docs)
+        return min(len(self._postings.get(term, ())) for term in terms)
@@ -0,0 +1,745 @@
+"""Relational storage engines exposing the same function API as storage.py.
+
+``SQLStorage`` holds the SQL shared by every engine and is written against
+DB-API connections with ``?`` placeholders; subclasses supply the schema,
+connection handling and placeholder style. Each engine module binds the
+methods listed in ``STORAGE_API`` as module-level functions so it can be
+swapped in for ``storage`` (see ``models.py``).
+"""
+import json
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from io import BytesIO
+
+from blob_store import content_metadata
+from bulk_operations import check_bulk_operations
+
+STORAGE_API = (
+    'get_folder_by_id', 'get_folders_by_parent_id', 'get_all_folders',
+    'get_folder_subtree', 'get_documents_in_folder_tree', 'count_documents_in_folder_tree',
+    'create_folder', 'update_folder', 'move_folder', 'delete_folder',
+    'count_documents_by_folder', 'store_versions', 'get_document_changes',
+    'get_document_by_id', 'get_documents_by_ids', 'get_documents_page', 'get_documents_by_folder_id',
+    'get_document_by_filename', 'get_documents_by_filename', 'get_documents_by_tag_id',
+    'get_documents_by_category_id', 'get_all_documents', 'get_document_content', 'open_document_content',
+    'get_document_outline',
+    'create_document', 'update_document', 'delete_document',
+    'get_tag_by_id', 'get_all_tags', 'count_documents_by_tag_id', 'count_documents_by_tag',
+    'create_tag', 'delete_tag', 'add_tag_to_document', 'remove_tag_from_document',
+    'get_category_by_id', 'get_all_categories', 'count_documents_by_category_id',
+    'count_documents_by_category', 'create_category', 'delete_category',
+    'add_category_to_document', 'remove_category_from_document',
+    'bulk_update_documents',
+    'add_recent_file', 'get_recent_files', 'group_commit',
+)
+
+FOLDER_FIELDS = ('name', 'parent_id', 'color', 'icon', 'position')
+DOCUMENT_FIELDS = ('filename', 'content', 'folder_id', 'is_favorite', 'is_pinned', 'last_opened_at')
+# ``outline`` is stored as JSON and only read by get_document_outline().
+DOCUMENT_COLUMNS = ('id', 'filename', 'content_hash', 'size', 'line_count', 'word_count', 'char_count',
+                    'folder_id', 'created_at', 'updated_at', 'is_favorite', 'is_pinned', 'last_opened_at')
+STAT_COLUMNS = ('content_hash', 'size', 'line_count', 'word_count', 'char_count', 'outline')
+RECENT_FILES_LIMIT = 50
+# table -> the store_versions row bumped when it changes; link tables belong
+# to the documents they annotate.
+VERSIONED_TABLES = {
+    'folders': 'folders',
+    'documents': 'documents',
+    'document_tags': 'documents',
+    'document_categories': 'documents',
+    'tags': 'tags',
+    'categories': 'categories',
+    'recent_files': 'recent_files',
+}
+
+# bulk operation argument -> the table it refers to
+_BULK_TABLES = {'folder_id': 'folders', 'tag_id': 'tags', 'category_id': 'categories'}
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def _marks(values):
+    return ', '.join('?' * len(values))
+
+
+def _folder_path(parent, folder_id):
+    return f"{parent['path'] if parent else '/'}{folder_id}/"
+
+
+def _subtree_range(path):
+    """Bounds of every path starting with ``path`` ('0' sorts right after '/')."""
+    return path, path[:-1] + '0'
+
+
+class SQLStorage:
+    placeholder = '?'
+    schema = ()
+    # Statements keeping tags/categories.document_count in step with the link
+    # tables; run after migrations so the counter columns exist.
+    triggers = ()
+    # Folder paths are compared bytewise by subtree range queries.
+    path_column = "TEXT NOT NULL DEFAULT ''"
+
+    # -- connection handling ------------------------------------------------
+
+    def connect(self):
+        """Return a context manager yielding a DB-API connection."""
+        raise NotImplementedError
+
+    def begin(self, conn, write):
+        pass
+
+    @contextmanager
+    def transaction(self, write=True):
+        with self.connect() as conn:
+            self.begin(conn, write)
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def execute(self, conn, sql, params=()):
+        if self.placeholder != '?':
+            sql = sql.replace('?', self.placeholder)
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur
+
+    def executemany(self, conn, sql, seq_of_params):
+        if self.placeholder != '?':
+            sql = sql.replace('?', self.placeholder)
+        seq_of_params = list(seq_of_params)
+        if seq_of_params:
+            conn.cursor().executemany(sql, seq_of_params)
+
+    def rows(self, conn, sql, params=()):
+        cur = self.execute(conn, sql, params)
+        columns = [col[0] for col in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def row(self, conn, sql, params=()):
+        rows = self.rows(conn, sql, params)
+        return rows[0] if rows else None
+
+    def scalar(self, conn, sql, params=()):
+        row = self.execute(conn, sql, params).fetchone()
+        return row[0] if row else None
+
+    def init_schema(self):
+        with self.transaction() as conn:
+            self.lock_schema(conn)
+            for statement in self.schema:
+                self.execute(conn, statement)
+            self.migrate_schema(conn)
+
+    def lock_schema(self, conn):
+        """Hook for engines that must serialize concurrent schema creation."""
+
+    def add_column(self, conn, table, column, definition):
+        """Add ``column`` unless it exists; return True if it was added."""
+        raise NotImplementedError
+
+    def migrate_schema(self, conn):
+        """Bring databases created by older versions up to the current schema."""
+        self.add_column(conn, 'folders', 'path', self.path_column)
+        self.execute(conn, 'CREATE INDEX IF NOT EXISTS idx_folders_path ON folders (path)')
+        if self.scalar(conn, "SELECT 1 FROM folders WHERE path = '' LIMIT 1") is not None:
+            self._rebuild_folder_paths(conn)
+        for table, links, column in (('tags', 'document_tags', 'tag_id'),
+                                     ('categories', 'document_categories', 'category_id')):
+            if self.add_column(conn, table, 'document_count', 'INTEGER NOT NULL DEFAULT 0'):
+                self.execute(conn,
+                    f'UPDATE {table} SET document_count = '
+                    f'(SELECT COUNT(*) FROM {links} WHERE {links}.{column} = {table}.id)')
+        added = [self.add_column(conn, 'documents', column, definition)
+                 for column, definition in (('word_count', 'INTEGER NOT NULL DEFAULT 0'),
+                                            ('char_count', 'INTEGER NOT NULL DEFAULT 0'),
+                                            ('outline', "TEXT NOT NULL DEFAULT '[]'"))]
+        if any(added):
+            self._rebuild_document_stats(conn)
+        for name in sorted(set(VERSIONED_TABLES.values())):
+            self.execute(conn,
+                'INSERT INTO store_versions (name, version) SELECT ?, 1 '
+                'WHERE NOT EXISTS (SELECT 1 FROM store_versions WHERE name = ?)', (name, name))
+        for statement in self.triggers:
+            self.execute(conn, statement)
+
+    def _rebuild_document_stats(self, conn):
+        rows = self.execute(conn, 'SELECT hash, content FROM blobs').fetchall()
+        self.executemany(conn,
+            'UPDATE documents SET word_count = ?, char_count = ?, outline = ? WHERE content_hash = ?',
+            [(stats['word_count'], stats['char_count'], stats['outline'], content_hash)
+             for content_hash, stats in ((h, self._stats(c)) for h, c in rows)])
+
+    def _rebuild_folder_paths(self, conn):
+        # Orphans (left by the old non-cascading delete) and cycles go to the root.
+        folders = {f['id']: f for f in self.rows(conn, 'SELECT id, parent_id, path FROM folders')}
+        paths = {}
+
+        def path_of(folder, seen=()):
+            if folder['id'] not in paths:
+                parent = folders.get(folder['parent_id'])
+                if parent is None or parent['id'] in seen or parent['id'] == folder['id']:
+                    paths[folder['id']] = (None, _folder_path(None, folder['id']))
+                else:
+                    parent_path = path_of(parent, seen + (folder['id'],))
+                    paths[folder['id']] = (parent['id'], f"{parent_path}{folder['id']}/")
+            return paths[folder['id']][1]
+
+        for folder in folders.values():
+            path_of(folder)
+        self.executemany(conn, 'UPDATE folders SET parent_id = ?, path = ? WHERE id = ?',
+                         [(parent_id, path, folder_id) for folder_id, (parent_id, path) in paths.items()
+                          if (parent_id, path) != (folders[folder_id]['parent_id'], folders[folder_id]['path'])])
+
+    def api(self):
+        return {name: getattr(self, name) for name in STORAGE_API}
+
+    def group_commit(self):
+        # Each statement group already commits once per transaction.
+        return nullcontext()
+
+    # -- folders ------------------------------------------------------------
+
+    def get_folder_by_id(self, folder_id):
+        with self.transaction(write=False) as conn:
+            return self.row(conn, 'SELECT * FROM folders WHERE id = ?', (folder_id,))
+
+    def get_folders_by_parent_id(self, parent_id):
+        with self.transaction(write=False) as conn:
+            if parent_id is None:
+                return self.rows(conn, 'SELECT * FROM folders WHERE parent_id IS NULL ORDER BY id')
+            return self.rows(conn, 'SELECT * FROM folders WHERE parent_id = ? ORDER BY id', (parent_id,))
+
+    def get_all_folders(self):
+        with self.transaction(write=False) as conn:
+            return self.rows(conn, 'SELECT * FROM folders ORDER BY id')
+
+    def count_documents_by_folder(self):
+        with self.transaction(write=False) as conn:
+            rows = self.execute(conn, 'SELECT folder_id, COUNT(*) FROM documents GROUP BY folder_id').fetchall()
+            return {folder_id: count for folder_id, count in rows}
+
+    def store_versions(self):
+        """Return a version per store, bumped by triggers whenever the store's tables change."""
+        with self.transaction(write=False) as conn:
+            return dict(self.execute(conn, 'SELECT name, version FROM store_versions').fetchall())
+
+    def get_document_changes(self, since):
+        # Rows carry no change history; callers rescan the documents.
+        return None
+
+    def get_folder_subtree(self, folder_id):
+        with self.transaction(write=False) as conn:
+            path = self.scalar(conn, 'SELECT path FROM folders WHERE id = ?', (folder_id,))
+            if path is None:
+                return []
+            return self.rows(conn, 'SELECT * FROM folders WHERE path >= ? AND path < ? ORDER BY path',
+                             _subtree_range(path))
+
+    def get_documents_in_folder_tree(self, folder_id):
+        with self.transaction(write=False) as conn:
+            path = self.scalar(conn, 'SELECT path FROM folders WHERE id = ?', (folder_id,))
+            if path is None:
+                return []
+            return self._documents(conn,
+                'WHERE folder_id IN (SELECT id FROM folders WHERE path >= ? AND path < ?)',
+                _subtree_range(path))
+
+    def count_documents_in_folder_tree(self, folder_id):
+        with self.transaction(write=False) as conn:
+            path = self.scalar(conn, 'SELECT path FROM folders WHERE id = ?', (folder_id,))
+            if path is None:
+                return 0
+            return self.scalar(conn,
+                'SELECT COUNT(*) FROM documents WHERE folder_id IN '
+                '(SELECT id FROM folders WHERE path >= ? AND path < ?)', _subtree_range(path))
+
+    def _parent(self, conn, parent_id):
+        if parent_id is None:
+            return None
+        parent = self.row(conn, 'SELECT id, path FROM folders WHERE id = ?', (parent_id,))
+        if parent is None:
+            raise ValueError('Parent folder not found')
+        return parent
+
+    def create_folder(self, name, parent_id=None, color='#6366f1', icon='folder'):
+        now = _now()
+        with self.transaction() as conn:
+            parent = self._parent(conn, parent_id)
+            position = self.scalar(conn, 'SELECT COUNT(*) FROM folders')
+            folder_id = self.scalar(conn,
+                'INSERT INTO folders (name, parent_id, created_at, updated_at, color, icon, position) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id',
+                (name, parent_id, now, now, color, icon, position))
+            return self.row(conn, 'UPDATE folders SET path = ? WHERE id = ? RETURNING *',
+                            (_folder_path(parent, folder_id), folder_id))
+
+    def _move_folder(self, conn, folder, parent_id):
+        """Re-parent ``folder`` and rewrite the paths of its whole subtree."""
+        parent = self._parent(conn, parent_id)
+        if parent is not None and parent['path'].startswith(folder['path']):
+            raise ValueError('Cannot move a folder into its own subtree')
+        new_path = _folder_path(parent, folder['id'])
+        self.execute(conn,
+            'UPDATE folders SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?',
+            (new_path, len(folder['path']) + 1) + _subtree_range(folder['path']))
+
+    def update_folder(self, folder_id, **kwargs):
+        unknown = set(kwargs) - set(FOLDER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown folder fields: {', '.join(sorted(unknown))}")
+        with self.transaction() as conn:
+            folder = self.row(conn, 'SELECT id, parent_id, path FROM folders WHERE id = ?', (folder_id,))
+            if folder is None:
+                return None
+            if 'parent_id' in kwargs and kwargs['parent_id'] != folder['parent_id']:
+                self._move_folder(conn, folder, kwargs['parent_id'])
+            assignments = [f'{key} = ?' for key in kwargs] + ['updated_at = ?']
+            params = list(kwargs.values()) + [_now(), folder_id]
+            return self.row(conn,
+                f"UPDATE folders SET {', '.join(assignments)} WHERE id = ? RETURNING *", params)
+
+    def move_folder(self, folder_id, parent_id):
+        return self.update_folder(folder_id, parent_id=parent_id)
+
+    def delete_folder(self, folder_id):
+        with self.transaction() as conn:
+            path = self.scalar(conn, 'SELECT path FROM folders WHERE id = ?', (folder_id,))
+            if path is None:
+                return
+            bounds = _subtree_range(path)
+            self.execute(conn,
+                'UPDATE documents SET folder_id = NULL WHERE folder_id IN '
+                '(SELECT id FROM folders WHERE path >= ? AND path < ?)', bounds)
+            self.execute(conn, 'DELETE FROM folders WHERE path >= ? AND path < ?', bounds)
+
+    # -- documents ----------------------------------------------------------
+
+    def _documents(self, conn, where='', params=(), order='id', limit=None):
+        where = f'{where} ORDER BY {order}'
+        if limit is not None:
+            where += ' LIMIT ?'
+            params = tuple(params) + (limit,)
+        docs = self.rows(conn, f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents {where}", params)
+        if not docs:
+            return []
+        by_id = {}
+        for doc in docs:
+            doc['is_favorite'] = bool(doc['is_favorite'])
+            doc['is_pinned'] = bool(doc['is_pinned'])
+            doc['tag_ids'] = []
+            doc['category_ids'] = []
+            by_id[doc['id']] = doc
+        for table, column, key in (('document_tags', 'tag_id', 'tag_ids'),
+                                   ('document_categories', 'category_id', 'category_ids')):
+            links = self.rows(conn,
+                f'SELECT l.document_id, l.{column} FROM {table} l '
+                f'WHERE l.document_id IN (SELECT id FROM documents {where}) '
+                f'ORDER BY l.document_id, l.position', params)
+            for link in links:
+                by_id[link['document_id']][key].append(link[column])
+        return docs
+
+    def _document(self, conn, doc_id):
+        docs = self._documents(conn, 'WHERE id = ?', (doc_id,))
+        return docs[0] if docs else None
+
+    def _insert_links(self, conn, table, column, links):
+        """Insert ``(document_id, link_id, position)`` rows in one batch."""
+        self.executemany(conn,
+            f'INSERT INTO {table} (document_id, {column}, position) VALUES (?, ?, ?)', links)
+
+    def _set_links(self, conn, table, column, doc_id, ids):
+        self.execute(conn, f'DELETE FROM {table} WHERE document_id = ?', (doc_id,))
+        self._insert_links(conn, table, column,
+                           [(doc_id, link_id, position) for position, link_id in enumerate(dict.fromkeys(ids))])
+
+    def _add_link(self, conn, table, column, doc_id, link_id):
+        if self.scalar(conn, 'SELECT 1 FROM documents WHERE id = ?', (doc_id,)) is None:
+            return False
+        exists = self.scalar(conn,
+            f'SELECT 1 FROM {table} WHERE document_id = ? AND {column} = ?', (doc_id, link_id))
+        if exists is None:
+            position = self.scalar(conn,
+                f'SELECT COALESCE(MAX(position), -1) + 1 FROM {table} WHERE document_id = ?', (doc_id,))
+            self.execute(conn,
+                f'INSERT INTO {table} (document_id, {column}, position) VALUES (?, ?, ?)',
+                (doc_id, link_id, position))
+        return True
+
+    def _remove_link(self, conn, table, column, doc_id, link_id):
+        if self.scalar(conn, 'SELECT 1 FROM documents WHERE id = ?', (doc_id,)) is None:
+            return False
+        self.execute(conn, f'DELETE FROM {table} WHERE document_id = ? AND {column} = ?', (doc_id, link_id))
+        return True
+
+    def get_document_by_id(self, doc_id):
+        with self.transaction(write=False) as conn:
+            return self._document(conn, doc_id)
+
+    def get_documents_by_ids(self, doc_ids):
+        doc_ids = list(dict.fromkeys(doc_ids))
+        if not doc_ids:
+            return []
+        with self.transaction(write=False) as conn:
+            return self._documents(conn, f'WHERE id IN ({_marks(doc_ids)})', doc_ids)
+
+    def get_documents_page(self, limit=None, after=None, folder_id=None):
+        clauses, params = [], []
+        if folder_id is not None:
+            clauses.append('folder_id = ?')
+            params.append(folder_id)
+        if after is not None:
+            clauses.append('(updated_at < ? OR (updated_at = ? AND id < ?))')
+            params += [after[0], after[0], after[1]]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self.transaction(write=False) as conn:
+            return self._documents(conn, where, params, order='updated_at DESC, id DESC', limit=limit)
+
+    def get_documents_by_folder_id(self, folder_id):
+        with self.transaction(write=False) as conn:
+            if folder_id is None:
+                return self._documents(conn, 'WHERE folder_id IS NULL')
+            return self._documents(conn, 'WHERE folder_id = ?', (folder_id,))
+
+    def get_document_by_filename(self, filename, folder_id=None):
+        with self.transaction(write=False) as conn:
+            if folder_id is None:
+                docs = self._documents(conn, 'WHERE filename = ? AND folder_id IS NULL', (filename,))
+            else:
+                docs = self._documents(conn, 'WHERE filename = ? AND folder_id = ?', (filename, folder_id))
+            return docs[0] if docs else None
+
+    def get_documents_by_filename(self, filename):
+        with self.transaction(write=False) as conn:
+            return self._documents(conn, 'WHERE filename = ?', (filename,))
+
+    def get_documents_by_tag_id(self, tag_id):
+        with self.transaction(write=False) as conn:
+            return self._documents(conn,
+                'WHERE id IN (SELECT document_id FROM document_tags WHERE tag_id = ?)', (tag_id,))
+
+    def get_documents_by_category_id(self, cat_id):
+        with self.transaction(write=False) as conn:
+            return self._documents(conn,
+                'WHERE id IN (SELECT document_id FROM document_categories WHERE category_id = ?)', (cat_id,))
+
+    def get_all_documents(self):
+        with self.transaction(write=False) as conn:
+            return self._documents(conn)
+
+    def _stats(self, content):
+        """``content_metadata`` with the outline encoded for the outline column."""
+        metadata = content_metadata(content)
+        metadata['outline'] = json.dumps(metadata['outline'], ensure_ascii=False)
+        return metadata
+
+    def _put_blob(self, conn, content):
+        metadata = self._stats(content)
+        self.execute(conn, 'INSERT INTO blobs (hash, content) VALUES (?, ?) ON CONFLICT (hash) DO NOTHING',
+                     (metadata['content_hash'], content))
+        return metadata
+
+    def _release_blob(self, conn, content_hash):
+        self.execute(conn,
+            'DELETE FROM blobs WHERE hash = ? AND NOT EXISTS '
+            '(SELECT 1 FROM documents WHERE content_hash = ?)', (content_hash, content_hash))
+
+    def get_document_content(self, doc):
+        with self.transaction(write=False) as conn:
+            content = self.scalar(conn, 'SELECT content FROM blobs WHERE hash = ?', (doc.get('content_hash'),))
+            return content or ''
+
+    def open_document_content(self, doc):
+        return BytesIO(self.get_document_content(doc).encode('utf-8'))
+
+    def get_document_outline(self, doc):
+        with self.transaction(write=False) as conn:
+            outline = self.scalar(conn, 'SELECT outline FROM documents WHERE id = ?', (doc['id'],))
+            return json.loads(outline) if outline else []
+
+    def create_document(self, filename, content='', folder_id=None):
+        now = _now()
+        with self.transaction() as conn:
+            metadata = self._put_blob(conn, content)
+            doc_id = self.scalar(conn,
+                f"INSERT INTO documents (filename, {', '.join(STAT_COLUMNS)}, folder_id, created_at, "
+                'updated_at, is_favorite, is_pinned, last_opened_at) '
+                f'VALUES (?, {_marks(STAT_COLUMNS)}, ?, ?, ?, ?, ?, ?) RETURNING id',
+                (filename, *(metadata[column] for column in STAT_COLUMNS), folder_id,
+                 now, now, False, False, None))
+            return self._document(conn, doc_id)
+
+    def update_document(self, doc_id, **kwargs):
+        tag_ids = kwargs.pop('tag_ids', None)
+        category_ids = kwargs.pop('category_ids', None)
+        unknown = set(kwargs) - set(DOCUMENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown document fields: {', '.join(sorted(unknown))}")
+        content = kwargs.pop('content', None)
+        with self.transaction() as conn:
+            old_hash = self.scalar(conn, 'SELECT content_hash FROM documents WHERE id = ?', (doc_id,))
+            if old_hash is None:
+                return None
+            if content is not None:
+                kwargs.update(self._put_blob(conn, content))
+            assignments = [f'{key} = ?' for key in kwargs] + ['updated_at = ?']
+            params = list(kwargs.values()) + [_now(), doc_id]
+            self.execute(conn, f"UPDATE documents SET {', '.join(assignments)} WHERE id = ?", params)
+            if content is not None and kwargs['content_hash'] != old_hash:
+                self._release_blob(conn, old_hash)
+            if tag_ids is not None:
+                self._set_links(conn, 'document_tags', 'tag_id', doc_id, tag_ids)
+            if category_ids is not None:
+                self._set_links(conn, 'document_categories', 'category_id', doc_id, category_ids)
+            return self._document(conn, doc_id)
+
+    def delete_document(self, doc_id):
+        with self.transaction() as conn:
+            self.execute(conn, 'DELETE FROM document_tags WHERE document_id = ?', (doc_id,))
+            self.execute(conn, 'DELETE FROM document_categories WHERE document_id = ?', (doc_id,))
+            self.execute(conn, 'DELETE FROM recent_files WHERE document_id = ?', (doc_id,))
+            old_hash = self.scalar(conn, 'DELETE FROM documents WHERE id = ? RETURNING content_hash', (doc_id,))
+            if old_hash is not None:
+                self._release_blob(conn, old_hash)
+
+    # -- tags ---------------------------------------------------------------
+
+    def get_tag_by_id(self, tag_id):
+        with self.transaction(write=False) as conn:
+            return self.row(conn, 'SELECT * FROM tags WHERE id = ?', (tag_id,))
+
+    def get_all_tags(self):
+        with self.transaction(write=False) as conn:
+            return self.rows(conn, 'SELECT * FROM tags ORDER BY id')
+
+    def count_documents_by_tag_id(self, tag_id):
+        with self.transaction(write=False) as conn:
+            return self.scalar(conn, 'SELECT document_count FROM tags WHERE id = ?', (tag_id,)) or 0
+
+    def count_documents_by_tag(self):
+        with self.transaction(write=False) as conn:
+            return dict(self.execute(conn, 'SELECT id, document_count FROM tags').fetchall())
+
+    def create_tag(self, name, color='#6366f1'):
+        with self.transaction() as conn:
+            existing = self.row(conn, 'SELECT * FROM tags WHERE name = ?', (name,))
+            if existing:
+                return existing
+            return self.row(conn,
+                'INSERT INTO tags (name, color, created_at) VALUES (?, ?, ?) RETURNING *',
+                (name, color, _now()))
+
+    def delete_tag(self, tag_id):
+        with self.transaction() as conn:
+            self.execute(conn, 'DELETE FROM document_tags WHERE tag_id = ?', (tag_id,))
+            self.execute(conn, 'DELETE FROM tags WHERE id = ?', (tag_id,))
+
+    def add_tag_to_document(self, doc_id, tag_id):
+        with self.transaction() as conn:
+            return self._add_link(conn, 'document_tags', 'tag_id', doc_id, tag_id)
+
+    def remove_tag_from_document(self, doc_id, tag_id):
+        with self.transaction() as conn:
+            return self._remove_link(conn, 'document_tags', 'tag_id', doc_id, tag_id)
+
+    # -- categories ---------------------------------------------------------
+
+    def get_category_by_id(self, cat_id):
+        with self.transaction(write=False) as conn:
+            return self.row(conn, 'SELECT * FROM categories WHERE id = ?', (cat_id,))
+
+    def get_all_categories(self):
+        with self.transaction(write=False) as conn:
+            return self.rows(conn, 'SELECT * FROM categories ORDER BY id')
+
+    def count_documents_by_category_id(self, cat_id):
+        with self.transaction(write=False) as conn:
+            return self.scalar(conn, 'SELECT document_count FROM categories WHERE id = ?', (cat_id,)) or 0
+
+    def count_documents_by_category(self):
+        with self.transaction(write=False) as conn:
+            return dict(self.execute(conn, 'SELECT id, document_count FROM categories').fetchall())
+
+    def create_category(self, name, color='#ec4899', icon='bookmark'):
+        with self.transaction() as conn:
+            existing = self.row(conn, 'SELECT * FROM categories WHERE name = ?', (name,))
+            if existing:
+                return existing
+            return self.row(conn,
+                'INSERT INTO categories (name, color, icon, created_at) VALUES (?, ?, ?, ?) RETURNING *',
+                (name, color, icon, _now()))
+
+    def delete_category(self, cat_id):
+        with self.transaction() as conn:
+            self.execute(conn, 'DELETE FROM document_categories WHERE category_id = ?', (cat_id,))
+            self.execute(conn, 'DELETE FROM categories WHERE id = ?', (cat_id,))
+
+    def add_category_to_document(self, doc_id, cat_id):
+        with self.transaction() as conn:
+            return self._add_link(conn, 'document_categories', 'category_id', doc_id, cat_id)
+
+    def remove_category_from_document(self, doc_id, cat_id):
+        with self.transaction() as conn:
+            return self._remove_link(conn, 'document_categories', 'category_id', doc_id, cat_id)
+
+    # -- bulk operations ----------------------------------------------------
+
+    def bulk_update_documents(self, operations):
+        """Apply ``operations`` to many documents in one transaction (see storage.py)."""
+        now = _now()
+        updated = set()
+        deleted = set()
+        with self.transaction() as conn:
+            check_bulk_operations(operations, lambda argument, value: self.row(conn,
+                f'SELECT 1 FROM {_BULK_TABLES[argument]} WHERE id = ?', (value,)) is not None)
+            for operation in operations:
+                requested = list(dict.fromkeys(operation['document_ids']))
+                if not requested:
+                    continue
+                ids = [row['id'] for row in self.rows(conn,
+                    f'SELECT id FROM documents WHERE id IN ({_marks(requested)})', requested)]
+                if not ids:
+                    continue
+                op = operation['op']
+                marks = _marks(ids)
+                if op == 'delete':
+                    for table in ('document_tags', 'document_categories', 'recent_files'):
+                        self.execute(conn, f'DELETE FROM {table} WHERE document_id IN ({marks})', ids)
+                    hashes = {row['content_hash'] for row in self.rows(conn,
+                        f'DELETE FROM documents WHERE id IN ({marks}) RETURNING content_hash', ids)}
+                    for content_hash in hashes:
+                        self._release_blob(conn, content_hash)
+                    deleted.update(ids)
+                    updated.difference_update(ids)
+                    continue
+                if op in ('move', 'favorite', 'pin'):
+                    if op == 'move':
+                        column, value = 'folder_id', operation['folder_id']
+                    else:
+                        column = 'is_favorite' if op == 'favorite' else 'is_pinned'
+                        value = bool(operation.get('value', True))
+                    self.execute(conn, f'UPDATE documents SET {column} = ?, updated_at = ? WHERE id IN ({marks})',
+                                 [value, now] + ids)
+                else:
+                    if op.endswith('_tag'):
+                        table, column, argument = 'document_tags', 'tag_id', 'tag_id'
+                    else:
+                        table, column, argument = 'document_categories', 'category_id', 'category_id'
+                    link_id = operation[argument]
+                    if op.startswith('remove_'):
+                        self.execute(conn, f'DELETE FROM {table} WHERE {column} = ? AND document_id IN ({marks})',
+                                     [link_id] + ids)
+                    else:
+                        linked = {row['document_id'] for row in self.rows(conn,
+                            f'SELECT document_id FROM {table} WHERE {column} = ? AND document_id IN ({marks})',
+                            [link_id] + ids)}
+                        positions = {row['document_id']: row['position'] for row in self.rows(conn,
+                            f'SELECT document_id, MAX(position) + 1 AS position FROM {table} '
+                            f'WHERE document_id IN ({marks}) GROUP BY document_id', ids)}
+                        self._insert_links(conn, table, column,
+                            [(doc_id, link_id, positions.get(doc_id, 0)) for doc_id in ids if doc_id not in linked])
+                updated.update(ids)
+        return {'updated': len(updated), 'deleted': len(deleted)}
+
+    # -- recent files -------------------------------------------------------
+
+    def add_recent_file(self, doc_id):
+        with self.transaction() as conn:
+            recent = self.row(conn,
+                'INSERT INTO recent_files (document_id, accessed_at) VALUES (?, ?) RETURNING *',
+                (doc_id, _now()))
+            self.execute(conn,
+                'DELETE FROM recent_files WHERE id NOT IN '
+                '(SELECT id FROM recent_files ORDER BY id DESC LIMIT ?)', (RECENT_FILES_LIMIT,))
+            return recent
+
+    def get_recent_files(self, limit=20, after=None):
+        where, params = '', []
+        if after is not None:
+            where = 'WHERE accessed_at < ? OR (accessed_at = ? AND id < ?)'
+            params = [after[0], after[0], after[1]]
+        if limit is not None:
+            params.append(limit)
+        with self.transaction(write=False) as conn:
+            return self.rows(conn,
+                f"SELECT * FROM recent_files {where} ORDER BY accessed_at DESC, id DESC"
+                f"{' LIMIT ?' if limit is not None else ''}", params)
+
+    # -- migration ----------------------------------------------------------
+
+    def import_json(self, source):
+        """Copy every record from the JSON store module ``source`` (normally ``storage``).
+
+        Ids are preserved. References to folders, tags, categories or
+        documents that no longer exist are dropped rather than imported.
+        """
+        folders = list(source.get_all_folders())
+        documents = list(source.get_all_documents())
+        tags = list(source.get_all_tags())
+        categories = list(source.get_all_categories())
+        recent_files = list(source.recent_files_storage.load())
+
+        folder_ids = {f['id'] for f in folders}
+        tag_ids = {t['id'] for t in tags}
+        category_ids = {c['id'] for c in categories}
+        document_ids = {d['id'] for d in documents}
+
+        with self.transaction() as conn:
+            self.executemany(conn,
+                'INSERT INTO folders (id, name, parent_id, path, created_at, updated_at, color, icon, position) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(f['id'], f['name'], f.get('parent_id'), f.get('path', ''), f.get('created_at'),
+                  f.get('updated_at'), f.get('color', '#6366f1'), f.get('icon', 'folder'), f.get('position', 0))
+                 for f in folders])
+            self.executemany(conn, 'INSERT INTO tags (id, name, color, created_at) VALUES (?, ?, ?, ?)',
+                [(t['id'], t['name'], t.get('color', '#6366f1'), t.get('created_at')) for t in tags])
+            self.executemany(conn,
+                'INSERT INTO categories (id, name, color, icon, created_at) VALUES (?, ?, ?, ?, ?)',
+                [(c['id'], c['name'], c.get('color', '#ec4899'), c.get('icon', 'bookmark'), c.get('created_at'))
+                 for c in categories])
+            contents = {}
+            rows = []
+            for d in documents:
+                content = source.get_document_content(d)
+                metadata = self._stats(content)
+                contents[metadata['content_hash']] = content
+                rows.append((d['id'], d['filename'], *(metadata[column] for column in STAT_COLUMNS),
+                             d.get('folder_id') if d.get('folder_id') in folder_ids else None,
+                             d.get('created_at'), d.get('updated_at'), bool(d.get('is_favorite')),
+                             bool(d.get('is_pinned')), d.get('last_opened_at')))
+            self.executemany(conn, 'INSERT INTO blobs (hash, content) VALUES (?, ?) ON CONFLICT (hash) DO NOTHING',
+                             list(contents.items()))
+            self.executemany(conn,
+                f"INSERT INTO documents (id, filename, {', '.join(STAT_COLUMNS)}, folder_id, created_at, "
+                f'updated_at, is_favorite, is_pinned, last_opened_at) '
+                f'VALUES (?, ?, {_marks(STAT_COLUMNS)}, ?, ?, ?, ?, ?, ?)',
+                rows)
+            self._insert_links(conn, 'document_tags', 'tag_id',
+                [(d['id'], t, position) for d in documents
+                 for position, t in enumerate(dict.fromkeys(d.get('tag_ids', ()))) if t in tag_ids])
+            self._insert_links(conn, 'document_categories', 'category_id',
+                [(d['id'], c, position) for d in documents
+                 for position, c in enumerate(dict.fromkeys(d.get('category_ids', ()))) if c in category_ids])
+            self.executemany(conn, 'INSERT INTO recent_files (id, document_id, accessed_at) VALUES (?, ?, ?)',
+                [(r['id'], r['document_id'], r.get('accessed_at')) for r in recent_files
+                 if r['document_id'] in document_ids])
+            if any(not f.get('path') for f in folders):
+                self._rebuild_folder_paths(conn)
+            self.after_import(conn)
+
+        return {
+            'folders': len(folders),
+            'documents': len(documents),
+            'tags': len(tags),
+            'categories': len(categories),
+            'recent_files': len(recent_files),
+        }
+
+    def after_import(self, conn):
+        """Hook for engines that must resync id sequences after explicit-id inserts."""
@@ -0,0 +1,163 @@
+"""SQLite storage engine (``STORAGE_BACKEND=sqlite``).
+
+Implements the ``storage.py`` function API on top of a single SQLite
+database in WAL mode. Import existing ``data/*.json`` files with::
+
+    python sqlite_storage.py import-json
+"""
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+from sql_storage import SQLStorage, STORAGE_API, VERSIONED_TABLES
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join('data', 'storage.sqlite3'))
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS folders (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        parent_id INTEGER,
+        path TEXT NOT NULL DEFAULT '',
+        created_at TEXT,
+        updated_at TEXT,
+        color TEXT NOT NULL DEFAULT '#6366f1',
+        icon TEXT NOT NULL DEFAULT 'folder',
+        position INTEGER NOT NULL DEFAULT 0
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders (parent_id)',
+    """CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY,
+        filename TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        size INTEGER NOT NULL DEFAULT 0,
+        line_count INTEGER NOT NULL DEFAULT 0,
+        word_count INTEGER NOT NULL DEFAULT 0,
+        char_count INTEGER NOT NULL DEFAULT 0,
+        outline TEXT NOT NULL DEFAULT '[]',
+        folder_id INTEGER,
+        created_at TEXT,
+        updated_at TEXT,
+        is_favorite BOOLEAN NOT NULL DEFAULT 0,
+        is_pinned BOOLEAN NOT NULL DEFAULT 0,
+        last_opened_at TEXT
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_documents_folder ON documents (folder_id)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents (filename, folder_id)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_updated ON documents (updated_at)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)',
+    """CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        content TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        color TEXT NOT NULL DEFAULT '#6366f1',
+        created_at TEXT,
+        document_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        color TEXT NOT NULL DEFAULT '#ec4899',
+        icon TEXT NOT NULL DEFAULT 'bookmark',
+        created_at TEXT,
+        document_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS document_tags (
+        document_id INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+        tag_id INTEGER NOT NULL REFERENCES tags (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (document_id, tag_id)
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_document_tags_tag ON document_tags (tag_id)',
+    """CREATE TABLE IF NOT EXISTS document_categories (
+        document_id INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+        category_id INTEGER NOT NULL REFERENCES categories (id) ON DELETE CASCADE,
+        position INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (document_id, category_id)
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_document_categories_category ON document_categories (category_id)',
+    """CREATE TABLE IF NOT EXISTS recent_files (
+        id INTEGER PRIMARY KEY,
+        document_id INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+        accessed_at TEXT
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_recent_files_accessed ON recent_files (accessed_at)',
+    """CREATE TABLE IF NOT EXISTS store_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )""",
+)
+
+
+TRIGGERS = tuple(
+    f"""CREATE TRIGGER IF NOT EXISTS {links}_count_{event.lower()} AFTER {event} ON {links}
+    BEGIN
+        UPDATE {table} SET document_count = document_count {sign} 1 WHERE id = {row}.{column};
+    END"""
+    for table, links, column in (('tags', 'document_tags', 'tag_id'),
+                                 ('categories', 'document_categories', 'category_id'))
+    for event, sign, row in (('INSERT', '+', 'NEW'), ('DELETE', '-', 'OLD'))
+) + tuple(
+    f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+    BEGIN
+        UPDATE store_versions SET version = version + 1 WHERE name = '{name}';
+    END"""
+    for table, name in VERSIONED_TABLES.items()
+    for event in ('INSERT', 'UPDATE', 'DELETE')
+)
+
+
+class SQLiteStorage(SQLStorage):
+    schema = SCHEMA
+    triggers = TRIGGERS
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.init_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def connect(self):
+        yield self._connection()
+
+    def begin(self, conn, write):
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+
+    def add_column(self, conn, table, column, definition):
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column in columns:
+            return False
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+
+
+engine = SQLiteStorage(SQLITE_PATH)
+globals().update(engine.api())
+
+__all__ = list(STORAGE_API)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['import-json']:
+        sys.exit('usage: python sqlite_storage.py import-json')
+    import storage
+    counts = engine.import_json(storage)
+    print(', '.join(f'{count} {name}' for name, count in counts.items()))
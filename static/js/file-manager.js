@@ -424,7 +424,7 @@ class FileManager {
             const response = await fetch(`/api/search?tags=${tagId}`);
             const result = await response.json();
             if (result.success) {
-                this.documents = result.documents;
+                this.documents = result.results;
                 this.renderDocumentList();
             }
         } catch (error) {
@@ -437,7 +437,7 @@ class FileManager {
             const response = await fetch(`/api/search?categories=${catId}`);
             const result = await response.json();
             if (result.success) {
-                this.documents = result.documents;
+                this.documents = result.results;
                 this.renderDocumentList();
             }
         } catch (error) {
@@ -512,6 +512,24 @@ class FileManager {
         }
     }
 
+    async bulkUpdateDocuments(operations) {
+        try {
+            const response = await fetch('/api/documents/bulk', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ operations })
+            });
+            
+            const result = await response.json();
+            if (result.success) {
+                await this.loadDocuments(this.currentFolder);
+            }
+            return result;
+        } catch (error) {
+            console.error('Error updating documents:', error);
+        }
+    }
+
     setupEventListeners() {
         const searchInput = document.getElementById('searchInput');
         if (searchInput) {
@@ -535,7 +553,7 @@ class FileManager {
             const response = await fetch(`/api/search?q=${encodeURIComponent(query)}`);
             const result = await response.json();
             if (result.success) {
-                this.documents = result.documents;
+                this.documents = result.results;
                 this.renderDocumentList();
             }
         } catch (error) {
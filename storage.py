@@ -1,144 +1,1007 @@
+import fcntl
 import json
 import os
+import struct
+import sys
+import time
+from bisect import bisect_left
 from datetime import datetime
-from threading import Lock
+from threading import Condition, Lock, Thread, local
 from contextlib import contextmanager
+from io import BytesIO
+from types import MappingProxyType
+
+from blob_store import BlobStore, content_metadata
+from bulk_operations import check_bulk_operations
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 DATA_DIR = 'data'
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Append-only journal mode: each committed transaction is appended to
+# ``<file>.journal`` as a single line instead of rewriting the whole file.
+# The journal is folded back into the snapshot once it grows past
+# JOURNAL_COMPACT_BYTES.
+JOURNAL_ENABLED = os.environ.get('STORAGE_JOURNAL', '1') != '0'
+JOURNAL_COMPACT_BYTES = int(os.environ.get('STORAGE_JOURNAL_COMPACT_BYTES', 8 * 1024 * 1024))
+
+# Group commit: journal entries are written under the store lock but fsynced
+# outside it, one fsync covering every entry written so far. The syncing
+# thread first waits GROUP_COMMIT_WINDOW seconds to let more writers join.
+GROUP_COMMIT_WINDOW = float(os.environ.get('STORAGE_GROUP_COMMIT_WINDOW_MS', 0)) / 1000
+
+_group_commit_state = local()
+
+# Snapshot format written by compaction/saves: 'json' (indented, the
+# default), 'records' or 'msgpack'. Loads detect the format from the file
+# itself, so switching formats needs no migration step; existing files can
+# be rewritten eagerly with ``python storage.py convert <format>``.
+# STORAGE_JSON_EXPORT=1 also keeps a readable ``<name>.export.json`` next
+# to binary snapshots. Every format stores the store's version alongside
+# the records; snapshots from before that load as version 0.
+STORAGE_FORMAT = os.environ.get('STORAGE_FORMAT', 'json')
+STORAGE_JSON_EXPORT = os.environ.get('STORAGE_JSON_EXPORT', '0') == '1'
+
+# Commits remembered per store for ``changed_since()``; callers further behind
+# than this must rescan the whole store.
+CHANGE_HISTORY = 1024
+# Commits touching more records than this drop the sort orders built for the
+# previous snapshot instead of moving each record within them.
+ORDER_REPLAY_LIMIT = 256
+
+class JournalCorrupt(Exception):
+    """Raised when a complete journal entry cannot be decoded."""
+
+def _freeze(value):
+    """Return a read-only view of a JSON value (dicts -> mappingproxy, lists -> tuple)."""
+    if isinstance(value, MappingProxyType):
+        return value
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _json_default(value):
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def _versioned(value):
+    """Split a decoded ``{"version": n, "records": [...]}`` snapshot (or a
+    bare record list written before versions were stored) into its parts."""
+    if isinstance(value, dict):
+        return value['records'], value['version']
+    return value, 0
+
+class JSONSerializer:
+    name = 'json'
+    magic = b''
+    
+    def dumps(self, data, version=0):
+        return json.dumps({'version': version, 'records': data}, ensure_ascii=False, indent=2,
+                          default=_json_default).encode('utf-8')
+    
+    def loads(self, raw):
+        return _versioned(json.loads(raw)) if raw.strip() else ([], 0)
+
+class RecordSerializer:
+    """Length-prefixed records: a magic line and the version as an 8-byte
+    big-endian integer, then for each record a 4-byte big-endian length
+    followed by the record as compact JSON. ``MKREC1`` files have no version."""
+    name = 'records'
+    magic = b'MKREC2\n'
+    legacy_magic = b'MKREC1\n'
+    
+    def dumps(self, data, version=0):
+        parts = [self.magic, struct.pack('>Q', version)]
+        for record in data:
+            payload = json.dumps(record, ensure_ascii=False, separators=(',', ':'),
+                                 default=_json_default).encode('utf-8')
+            parts.append(struct.pack('>I', len(payload)))
+            parts.append(payload)
+        return b''.join(parts)
+    
+    def loads(self, raw):
+        view = memoryview(raw)
+        offset = len(self.magic)
+        version = 0
+        if raw.startswith(self.magic):
+            (version,) = struct.unpack_from('>Q', raw, offset)
+            offset += 8
+        records = []
+        while offset < len(raw):
+            (length,) = struct.unpack_from('>I', raw, offset)
+            offset += 4
+            records.append(json.loads(view[offset:offset + length].tobytes()))
+            offset += length
+        return records, version
+
+class MsgpackSerializer:
+    name = 'msgpack'
+    magic = b'MKMSGPACK1\n'
+    
+    def dumps(self, data, version=0):
+        return self.magic + msgpack.packb({'version': version, 'records': data}, default=_json_default,
+                                          use_bin_type=True)
+    
+    def loads(self, raw):
+        return _versioned(msgpack.unpackb(memoryview(raw)[len(self.magic):], raw=False))
+
+SERIALIZERS = {serializer.name: serializer for serializer in (JSONSerializer(), RecordSerializer())}
+if msgpack is not None:
+    SERIALIZERS['msgpack'] = MsgpackSerializer()
+
+def _detect_serializer(raw):
+    if raw.startswith(MsgpackSerializer.magic):
+        if msgpack is None:
+            raise RuntimeError('msgpack snapshot found but the msgpack package is not installed')
+        return SERIALIZERS['msgpack']
+    if raw.startswith((RecordSerializer.magic, RecordSerializer.legacy_magic)):
+        return SERIALIZERS['records']
+    return SERIALIZERS['json']
+
+class _Snapshot:
+    """One published version of a store. Never modified after publishing.
+    
+    ``by_id`` maps record id -> frozen record, in store order; ``indexes``
+    maps index name -> key -> dict of record ids, kept in ascending order so
+    lookups give the same order however the snapshot was built. ``max_id``
+    is the highest id in use. ``history`` is ``(floor, entries)``: the
+    ``(version, record ids)`` of the commits after version ``floor``, oldest
+    first. The record tuple and sort orders are built on first use and
+    memoized for this version.
+    """
+    __slots__ = ('by_id', 'indexes', 'signature', 'version', 'max_id', 'history', 'orders', '_records')
+    
+    def __init__(self, by_id, indexes, signature, version, max_id, history, orders=None):
+        self.by_id = by_id
+        self.indexes = indexes
+        self.signature = signature
+        self.version = version
+        self.max_id = max_id
+        self.history = history
+        self.orders = orders if orders is not None else {}
+        self._records = None
+    
+    @property
+    def records(self):
+        records = self._records
+        if records is None:
+            records = self._records = tuple(self.by_id.values())
+        return records
+    
+    def find(self, index, key):
+        by_id = self.by_id
+        return [by_id[record_id] for record_id in self.indexes[index].get(key, ())]
+    
+    def changed_since(self, version):
+        """Return the ids of the records put or deleted after ``version``, or
+        None if ``version`` is not covered by the history."""
+        floor, entries = self.history
+        if version is None or not floor <= version <= self.version:
+            return None
+        ids = set()
+        for entry_version, entry_ids in reversed(entries):
+            if entry_version <= version:
+                break
+            ids.update(entry_ids)
+        return ids
+    
+    def ordered(self, name, key_func):
+        """Return ``(keys, records)`` sorted ascending by ``key_func``."""
+        order = self.orders.get(name)
+        if order is None:
+            records = sorted(self.records, key=key_func)
+            order = self.orders[name] = ([key_func(record) for record in records], records)
+        return order
+
 class JSONStorage:
-    def __init__(self, filename):
+    """A list of JSON records persisted to ``DATA_DIR/<filename>``.
+    
+    Parsed data is cached in memory as an immutable ``_Snapshot`` and only
+    re-read when the stat signature (mtime, size, inode) of the snapshot or
+    journal changes. Readers (``load()``, ``get()``, ``find()``) take no
+    lock: they use whichever snapshot is published. Mutations go through
+    ``transaction()``, whose callers read the snapshot it was opened on and
+    record their changes as ops with ``_log_put``/``_log_delete``; on commit
+    the next snapshot is derived from those ops and published with a single
+    attribute assignment.
+    
+    Records are indexed by ``id`` and by any secondary ``indexes`` given as
+    ``{name: key_func}``, where ``key_func(record)`` returns the keys the
+    record should be filed under. Indexes are rebuilt when the files change
+    underneath us and derived copy-on-write from each transaction's ops.
+    """
+    
+    def __init__(self, filename, journal=JOURNAL_ENABLED, indexes=None, orders=None, format=STORAGE_FORMAT):
         self.filename = os.path.join(DATA_DIR, filename)
+        self.export_filename = os.path.splitext(self.filename)[0] + '.export.json'
+        self.serializer = SERIALIZERS[format]
+        self.journal_filename = self.filename + '.journal' if journal else None
+        self.lock_filename = self.filename + '.lock'
         self.lock = Lock()
-        self._ensure_file_exists()
+        self._snapshot = None
+        self._index_keys = indexes or {}
+        self._order_keys = orders or {}
+        self._compacting = False
+        self._sync_cond = Condition()
+        self._written_seq = 0
+        self._synced_seq = 0
+        self._syncing = False
+        with self._file_lock():
+            self._ensure_file_exists()
+            if self.journal_filename:
+                self._recover_journal()
+    
+    @contextmanager
+    def _file_lock(self, shared=False):
+        """Hold an advisory ``flock`` on ``<file>.lock`` across processes.
+        
+        ``self.lock`` only serializes threads of this process; this lock
+        serializes writers (and readers refreshing the cache) across every
+        gunicorn worker sharing the data directory.
+        """
+        fd = os.open(self.lock_filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
     
     def _ensure_file_exists(self):
-        if not os.path.exists(self.filename):
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump([], f)
+        try:
+            with open(self.filename, 'xb') as f:
+                f.write(self.serializer.dumps([]))
+        except FileExistsError:
+            pass
+    
+    def _recover_journal(self):
+        """Drop a torn trailing entry left behind by a crash mid-append."""
+        try:
+            with open(self.journal_filename, 'r+b') as f:
+                self._repair_journal_tail(f)
+        except FileNotFoundError:
+            pass
+    
+    @staticmethod
+    def _repair_journal_tail(f):
+        """Truncate the open journal ``f`` after its last newline; return its new size.
+        
+        Entries are written as one line each, so bytes after the last
+        newline are a torn entry from a writer that crashed mid-append.
+        """
+        size = end = f.seek(0, os.SEEK_END)
+        while end:
+            start = max(0, end - 65536)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+        return end
+    
+    def _signature(self):
+        signature = []
+        for path in (self.filename, self.journal_filename):
+            try:
+                st = os.stat(path) if path else None
+            except FileNotFoundError:
+                st = None
+            signature.append((st.st_mtime_ns, st.st_size, st.st_ino) if st else None)
+        return tuple(signature)
+    
+    def _publish_unsafe(self, data, version, history=None, *, signature):
+        """Build the next snapshot from the records ``data`` and make it the published one."""
+        by_id, indexes = self._build_indexes(data)
+        return self._publish_snapshot_unsafe(by_id, indexes, version, signature, max(by_id, default=0), history)
+    
+    def _publish_snapshot_unsafe(self, by_id, indexes, version, signature, max_id, history=None, orders=None):
+        self._snapshot = _Snapshot(by_id, indexes, signature, version, max_id, history or (version, ()), orders)
+        return self._snapshot
+    
+    def _build_indexes(self, data):
+        by_id = {}
+        indexes = {name: {} for name in self._index_keys}
+        for record in data:
+            record = by_id[record['id']] = _freeze(record)
+            for name, key_func in self._index_keys.items():
+                index = indexes[name]
+                for key in key_func(record):
+                    index.setdefault(key, {})[record['id']] = None
+        for index in indexes.values():
+            for key, ids in index.items():
+                index[key] = dict.fromkeys(sorted(ids))
+        return by_id, indexes
+    
+    def _apply_ops(self, base, ops):
+        """Derive the id map, indexes and sort orders of ``base`` with ``ops`` applied.
+        
+        Copy-on-write: the records are shared with ``base`` and only the
+        index dicts and buckets the ops touch are copied. The id map is one
+        flat dict copy. Sort orders ``base`` has built are carried over by
+        moving the changed records within a copy of the sorted lists.
+        """
+        by_id = dict(base.by_id)
+        indexes = dict(base.indexes)
+        copied = {}
+        
+        def bucket(name, key):
+            keys = copied.get(name)
+            if keys is None:
+                keys = copied[name] = set()
+                indexes[name] = dict(indexes[name])
+            index = indexes[name]
+            if key not in keys:
+                keys.add(key)
+                index[key] = dict(index.get(key, {}))
+            return index[key]
+        
+        for op in ops:
+            if op['op'] == 'put':
+                record = op['record']
+                record_id = record['id']
+                old = by_id.get(record_id)
+                by_id[record_id] = record
+            else:
+                record = None
+                record_id = op['id']
+                old = by_id.pop(record_id, None)
+            for name, key_func in self._index_keys.items():
+                old_keys = list(key_func(old)) if old is not None else []
+                new_keys = list(key_func(record)) if record is not None else []
+                for key in old_keys:
+                    if key not in new_keys:
+                        bucket(name, key).pop(record_id, None)
+                for key in new_keys:
+                    if key not in old_keys:
+                        bucket(name, key)[record_id] = None
+        
+        for name, keys in copied.items():
+            index = indexes[name]
+            for key in keys:
+                if index[key]:
+                    index[key] = dict.fromkeys(sorted(index[key]))
+                else:
+                    del index[key]
+        return by_id, indexes, self._apply_orders(base, by_id, ops)
+    
+    def _apply_orders(self, base, by_id, ops):
+        changed = {op['record']['id'] if op['op'] == 'put' else op['id'] for op in ops}
+        orders = {}
+        for name, (keys, records) in base.orders.items():
+            if len(changed) > ORDER_REPLAY_LIMIT:
+                # Sorting afresh on first use is cheaper than this many moves.
+                break
+            key_func = self._order_keys[name]
+            keys, records = list(keys), list(records)
+            for record_id in changed:
+                old = base.by_id.get(record_id)
+                if old is not None:
+                    position = bisect_left(keys, key_func(old))
+                    del keys[position], records[position]
+                new = by_id.get(record_id)
+                if new is not None:
+                    key = key_func(new)
+                    position = bisect_left(keys, key)
+                    keys.insert(position, key)
+                    records.insert(position, new)
+            orders[name] = (keys, records)
+        return orders
+    
+    def _load_unsafe(self, file_locked=False):
+        signature = self._signature()
+        snapshot = self._snapshot
+        if snapshot is not None and signature == snapshot.signature:
+            return snapshot
+        if file_locked:
+            return self._publish_unsafe(*self._read_unsafe(), signature=signature)
+        # Another process may be mid-compaction (snapshot replaced, journal
+        # not yet truncated); read both files under a shared lock.
+        with self._file_lock(shared=True):
+            return self._publish_unsafe(*self._read_unsafe(), signature=self._signature())
     
-    def _load_unsafe(self):
+    def _resign_unsafe(self):
+        """Re-stamp the published snapshot after rewriting files without changing data."""
+        snapshot = self._snapshot
+        self._snapshot = _Snapshot(snapshot.by_id, snapshot.indexes, self._signature(), snapshot.version,
+                                   snapshot.max_id, snapshot.history, snapshot.orders)
+    
+    def _current(self):
+        """Return the published snapshot, refreshed if the files changed.
+        
+        Readers never wait for a writer of this process: while one holds
+        ``self.lock`` its changes are not committed yet, so the snapshot
+        published before it is still the current version.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.signature == self._signature():
+            return snapshot
+        if not self.lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            return self._load_unsafe()
+        finally:
+            self.lock.release()
+    
+    def _read_unsafe(self):
+        """Return the records on disk, the version they were committed as and
+        the history of the commits still in the journal."""
         try:
-            with open(self.filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+            with open(self.filename, 'rb') as f:
+                raw = f.read()
+            data, version = _detect_serializer(raw).loads(raw)
+        except (ValueError, KeyError, struct.error, FileNotFoundError):
+            data, version = [], 0
+        if self.journal_filename:
+            return self._replay_journal_unsafe(data, version)
+        return data, version, None
+    
+    def _replay_journal_unsafe(self, data, version):
+        try:
+            with open(self.journal_filename, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return data, version, None
+        if not lines:
+            return data, version, None
+        
+        records = {record['id']: record for record in data}
+        floor = None
+        entries = []
+        for number, line in enumerate(lines, 1):
+            if not line.endswith('\n'):
+                # A torn entry; the next append (or restart) truncates it.
+                break
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise JournalCorrupt(f'{self.journal_filename}: entry {number} is not valid JSON') from e
+            version = max(version, entry.get('version', 0))
+            ops = entry.get('ops', [])
+            if floor is None:
+                # The first entry is either the marker left by compaction,
+                # carrying the snapshot file's version, or the first commit
+                # after it.
+                floor = version - 1 if ops else version
+            if ops:
+                entries.append((version, frozenset(op['record']['id'] if op['op'] == 'put' else op['id']
+                                                   for op in ops)))
+            for op in ops:
+                if op['op'] == 'put':
+                    record = op['record']
+                    records[record['id']] = record
+                elif op['op'] == 'delete':
+                    records.pop(op['id'], None)
+        if len(entries) > CHANGE_HISTORY:
+            floor = entries[-CHANGE_HISTORY - 1][0]
+            del entries[:-CHANGE_HISTORY]
+        return list(records.values()), version, (floor if floor is not None else version, tuple(entries))
+    
+    def _save_unsafe(self, data, version):
+        self._write_snapshot_unsafe(data, version)
+        if self.journal_filename:
+            self._truncate_journal_unsafe(version)
     
-    def _save_unsafe(self, data):
-        with open(self.filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def _write_snapshot_unsafe(self, data, version):
+        self._atomic_write(self.filename, self.serializer.dumps(data, version))
+        if STORAGE_JSON_EXPORT and self.serializer.name != 'json':
+            self._atomic_write(self.export_filename, SERIALIZERS['json'].dumps(data, version))
+    
+    def _atomic_write(self, path, payload):
+        tmp_filename = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, path)
+        dir_fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    
+    def _truncate_journal_unsafe(self, version):
+        """Empty the journal, keeping only a marker entry that carries ``version`` forward."""
+        line = json.dumps({'version': version, 'ops': []}) + '\n'
+        self._atomic_write(self.journal_filename, line.encode('utf-8'))
+    
+    def _append_journal_unsafe(self, ops, version):
+        """Write one journal entry (not yet fsynced); return its sequence number and the journal size."""
+        line = json.dumps({'version': version, 'ops': ops}, ensure_ascii=False, default=_json_default) + '\n'
+        with open(self.journal_filename, 'a+b') as f:
+            # A process that crashed mid-append may have left a torn entry;
+            # appending onto it would corrupt this entry too.
+            self._repair_journal_tail(f)
+            f.write(line.encode('utf-8'))
+            f.flush()
+            size = f.tell()
+        with self._sync_cond:
+            self._written_seq += 1
+            return self._written_seq, size
+    
+    def sync(self, seq=None):
+        """Block until journal entries up to ``seq`` (default: all written) are on disk.
+        
+        Only one thread fsyncs at a time; threads arriving meanwhile wait for
+        it and are then covered together by the next fsync.
+        """
+        if not self.journal_filename:
+            return
+        with self._sync_cond:
+            if seq is None:
+                seq = self._written_seq
+            while self._synced_seq < seq:
+                if not self._syncing:
+                    self._syncing = True
+                    break
+                self._sync_cond.wait()
+            else:
+                return
+        synced = False
+        try:
+            if GROUP_COMMIT_WINDOW:
+                time.sleep(GROUP_COMMIT_WINDOW)
+            with self._sync_cond:
+                target = self._written_seq
+            fd = os.open(self.journal_filename, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            synced = True
+        finally:
+            with self._sync_cond:
+                self._syncing = False
+                if synced:
+                    self._synced_seq = max(self._synced_seq, target)
+                self._sync_cond.notify_all()
     
     @contextmanager
     def transaction(self):
-        with self.lock:
-            data = self._load_unsafe()
-            result = {'data': data, 'modified': False}
+        """Open a write transaction on the current snapshot.
+        
+        Yields a dict holding the ``base`` snapshot; changes are made with
+        ``_log_put``/``_log_delete``, read back with ``_txn_get`` and
+        applied on exit. Nothing is copied up front, so a transaction costs
+        what its ops touch rather than the size of the store.
+        """
+        journal_seq = journal_size = 0
+        with self.lock, self._file_lock():
+            base = self._load_unsafe(file_locked=True)
+            result = {'base': base, 'changes': {}, 'modified': False, 'ops': [], 'on_commit': []}
             yield result
             if result['modified']:
-                self._save_unsafe(result['data'])
+                version = base.version + 1
+                by_id, indexes, orders = self._apply_ops(base, result['ops'])
+                if self.journal_filename:
+                    journal_seq, journal_size = self._append_journal_unsafe(result['ops'], version)
+                else:
+                    self._save_unsafe(list(by_id.values()), version)
+                max_id = max([base.max_id] + [record_id for record_id, record in result['changes'].items()
+                                              if record is not None])
+                if max_id and max_id not in by_id:
+                    max_id = max(by_id, default=0)
+                floor, entries = base.history
+                if len(entries) >= CHANGE_HISTORY:
+                    floor = entries[-CHANGE_HISTORY][0]
+                    entries = entries[-CHANGE_HISTORY + 1:]
+                history = (floor, entries + ((version, frozenset(result['changes'])),))
+                self._publish_snapshot_unsafe(by_id, indexes, version, self._signature(), max_id, history, orders)
+                for callback in result['on_commit']:
+                    callback()
+        if journal_seq:
+            pending = getattr(_group_commit_state, 'pending', None)
+            if pending is not None:
+                pending[self] = max(pending.get(self, 0), journal_seq)
+            else:
+                self.sync(journal_seq)
+        if journal_size > JOURNAL_COMPACT_BYTES:
+            self._compact_in_background()
     
     def load(self):
-        with self.lock:
-            return self._load_unsafe()
+        return self._current().records
+    
+    @property
+    def version(self):
+        """Version of the store's data, increasing with every commit.
+        
+        It is persisted with each journal entry and in the snapshot file, so
+        every process reports the same version for the same data and it
+        never goes backwards across restarts.
+        """
+        return self._current().version
+    
+    def changed_since(self, version):
+        """Return the ids of the records put or deleted since the store was at
+        ``version``, or None when that is too far back to tell."""
+        return self._current().changed_since(version)
+    
+    def get(self, record_id):
+        """Return the record with ``id == record_id``, or None."""
+        return self._current().by_id.get(record_id)
+    
+    def find(self, index, key):
+        """Return the records filed under ``key`` in the secondary ``index``."""
+        return self._current().find(index, key)
+    
+    def page(self, order, limit=None, after=None, records=None):
+        """Return up to ``limit`` records in descending ``order``, starting below the key ``after``.
+        
+        ``order`` names one of the store's ``orders``. Pass ``records`` to page
+        through a subset (e.g. one index bucket) instead of the whole store.
+        """
+        key_func = self._order_keys[order]
+        if records is None:
+            keys, records = self._current().ordered(order, key_func)
+        else:
+            records = sorted(records, key=key_func)
+            keys = [key_func(record) for record in records]
+        end = bisect_left(keys, after) if after is not None else len(records)
+        start = max(end - limit, 0) if limit is not None else 0
+        return records[start:end][::-1]
+    
+    def count(self, index, key):
+        """Return the number of records filed under ``key`` in the secondary ``index``."""
+        return len(self._current().indexes[index].get(key, ()))
+    
+    def counts(self, index):
+        """Return ``{key: number of records}`` for the secondary ``index``."""
+        return {key: len(ids) for key, ids in self._current().indexes[index].items()}
+    
+    def _find_unsafe(self, index, key):
+        return self._snapshot.find(index, key)
     
     def save(self, data):
+        with self.lock, self._file_lock():
+            version = self._load_unsafe(file_locked=True).version + 1
+            self._save_unsafe(data, version)
+            self._publish_unsafe(data, version, signature=self._signature())
+    
+    def compact(self):
+        """Fold the journal into the snapshot file and empty the journal.
+        
+        The snapshot is replaced atomically before the journal is truncated,
+        and replaying journal entries is idempotent, so a crash at any point
+        leaves the store readable with no committed change lost.
+        """
+        if not self.journal_filename:
+            return
+        with self.lock, self._file_lock():
+            try:
+                snapshot = self._load_unsafe(file_locked=True)
+                self._save_unsafe(snapshot.records, snapshot.version)
+                self._resign_unsafe()
+            finally:
+                self._compacting = False
+    
+    def convert(self, format):
+        """Rewrite the snapshot (journal folded in) using serializer ``format``."""
+        with self.lock, self._file_lock():
+            self.serializer = SERIALIZERS[format]
+            snapshot = self._load_unsafe(file_locked=True)
+            self._save_unsafe(snapshot.records, snapshot.version)
+            self._resign_unsafe()
+    
+    def _compact_in_background(self):
         with self.lock:
-            self._save_unsafe(data)
+            if self._compacting:
+                return
+            self._compacting = True
+        Thread(target=self.compact, daemon=True).start()
 
-folders_storage = JSONStorage('folders.json')
-documents_storage = JSONStorage('documents.json')
+@contextmanager
+def group_commit():
+    """Defer journal fsyncs of the enclosed transactions to one sync per store at exit.
+    
+    Used by request handlers that perform several writes, so callers still
+    return only after everything they changed is durable.
+    """
+    if getattr(_group_commit_state, 'pending', None) is not None:
+        yield
+        return
+    _group_commit_state.pending = {}
+    try:
+        yield
+    finally:
+        pending, _group_commit_state.pending = _group_commit_state.pending, None
+        for store, seq in pending.items():
+            store.sync(seq)
+
+folders_storage = JSONStorage('folders.json', indexes={
+    'parent_id': lambda f: [f.get('parent_id')],
+    'ancestors': lambda f: _path_ids(f.get('path')),
+})
+documents_storage = JSONStorage('documents.json', indexes={
+    'folder_id': lambda d: [d.get('folder_id')],
+    'tag_ids': lambda d: d.get('tag_ids', ()),
+    'category_ids': lambda d: d.get('category_ids', ()),
+    'filename': lambda d: [d['filename']],
+    'filename_folder': lambda d: [(d['filename'], d.get('folder_id'))],
+    'content_hash': lambda d: [d['content_hash']] if d.get('content_hash') else [],
+}, orders={
+    'updated': lambda d: (d.get('updated_at') or '', d['id']),
+})
 tags_storage = JSONStorage('tags.json')
 categories_storage = JSONStorage('categories.json')
-recent_files_storage = JSONStorage('recent_files.json')
+recent_files_storage = JSONStorage('recent_files.json', orders={
+    'accessed': lambda r: (r.get('accessed_at') or '', r['id']),
+})
+blobs = BlobStore(os.path.join(DATA_DIR, 'blobs'))
+
+def _txn_get(txn, record_id):
+    """Return record ``record_id`` as ``txn`` sees it, or None."""
+    changes = txn['changes']
+    if record_id in changes:
+        return changes[record_id]
+    return txn['base'].by_id.get(record_id)
+
+def _txn_next_id(txn):
+    """Return one past the highest id in use as ``txn`` sees the store."""
+    base, changes = txn['base'], txn['changes']
+    max_id = base.max_id
+    if max_id in changes and changes[max_id] is None:
+        max_id = max((record_id for record_id in base.by_id if record_id not in changes), default=0)
+    return max([max_id] + [record_id for record_id, record in changes.items() if record is not None]) + 1
+
+def _log_put(txn, record):
+    """Record an insert/replace in ``txn`` and return the frozen record to store."""
+    record = _freeze(record)
+    txn['ops'].append({'op': 'put', 'record': record})
+    txn['changes'][record['id']] = record
+    txn['modified'] = True
+    return record
 
-def get_next_id(items):
-    if not items:
-        return 1
-    return max(item.get('id', 0) for item in items) + 1
+def _log_delete(txn, record_id):
+    txn['ops'].append({'op': 'delete', 'id': record_id})
+    txn['changes'][record_id] = None
+    txn['modified'] = True
 
 def get_folder_by_id(folder_id):
-    folders = folders_storage.load()
-    for folder in folders:
-        if folder['id'] == folder_id:
-            return folder
-    return None
+    return folders_storage.get(folder_id)
 
 def get_folders_by_parent_id(parent_id):
-    folders = folders_storage.load()
-    return [f for f in folders if f.get('parent_id') == parent_id]
+    return folders_storage.find('parent_id', parent_id)
 
 def get_all_folders():
     return folders_storage.load()
 
+def _path_ids(path):
+    """Folder ids along a materialized path such as ``/1/5/9/``, root first."""
+    return [int(part) for part in path.strip('/').split('/')] if path else []
+
+def _folder_path(parent, folder_id):
+    return f"{parent['path'] if parent else '/'}{folder_id}/"
+
+def get_folder_subtree(folder_id):
+    """Return the folder ``folder_id`` and all folders below it."""
+    return folders_storage.find('ancestors', folder_id)
+
+def get_documents_in_folder_tree(folder_id):
+    documents = []
+    for folder in get_folder_subtree(folder_id):
+        documents.extend(documents_storage.find('folder_id', folder['id']))
+    return documents
+
+def count_documents_in_folder_tree(folder_id):
+    return sum(len(documents_storage.find('folder_id', folder['id']))
+               for folder in get_folder_subtree(folder_id))
+
 def create_folder(name, parent_id=None, color='#6366f1', icon='folder'):
     with folders_storage.transaction() as txn:
-        folders = txn['data']
-        folder_id = get_next_id(folders)
+        parent = None
+        if parent_id is not None:
+            parent = _txn_get(txn, parent_id)
+            if parent is None:
+                raise ValueError('Parent folder not found')
+        folder_id = _txn_next_id(txn)
         folder = {
             'id': folder_id,
             'name': name,
             'parent_id': parent_id,
+            'path': _folder_path(parent, folder_id),
             'created_at': datetime.utcnow().isoformat(),
             'updated_at': datetime.utcnow().isoformat(),
             'color': color,
             'icon': icon,
-            'position': len(folders)
+            'position': len(txn['base'].by_id)
         }
-        folders.append(folder)
-        txn['modified'] = True
-        return folder
+        return _log_put(txn, folder)
+
+def _move_folder_unsafe(txn, folder, parent_id):
+    """Re-parent ``folder`` and rewrite the paths of its whole subtree."""
+    parent = None
+    if parent_id is not None:
+        parent = _txn_get(txn, parent_id)
+        if parent is None:
+            raise ValueError('Parent folder not found')
+        if folder['id'] in _path_ids(parent['path']):
+            raise ValueError('Cannot move a folder into its own subtree')
+    old_prefix = folder['path']
+    new_prefix = _folder_path(parent, folder['id'])
+    folder['parent_id'] = parent_id
+    folder['path'] = new_prefix
+    if new_prefix == old_prefix:
+        return
+    for descendant in txn['base'].find('ancestors', folder['id']):
+        if descendant['id'] != folder['id']:
+            path = new_prefix + descendant['path'][len(old_prefix):]
+            _log_put(txn, dict(descendant, path=path))
 
 def update_folder(folder_id, **kwargs):
     with folders_storage.transaction() as txn:
-        folders = txn['data']
-        for folder in folders:
-            if folder['id'] == folder_id:
-                for key, value in kwargs.items():
-                    folder[key] = value
-                folder['updated_at'] = datetime.utcnow().isoformat()
-                txn['modified'] = True
-                return folder
-        return None
+        folder = _txn_get(txn, folder_id)
+        if folder is None:
+            return None
+        parent_id = kwargs.pop('parent_id', folder.get('parent_id'))
+        folder = dict(folder, **kwargs)
+        if parent_id != folder.get('parent_id') or not folder.get('path'):
+            _move_folder_unsafe(txn, folder, parent_id)
+        folder['updated_at'] = datetime.utcnow().isoformat()
+        return _log_put(txn, folder)
+
+def move_folder(folder_id, parent_id):
+    """Move ``folder_id`` (with everything below it) under ``parent_id``; None moves it to the root."""
+    return update_folder(folder_id, parent_id=parent_id)
 
 def delete_folder(folder_id):
+    """Delete ``folder_id`` and every folder below it; their documents move to the root."""
     with folders_storage.transaction() as txn_f:
-        folders = txn_f['data']
-        original_len = len(folders)
-        folders[:] = [f for f in folders if f['id'] != folder_id]
-        txn_f['modified'] = len(folders) != original_len
+        subtree_ids = {f['id'] for f in txn_f['base'].find('ancestors', folder_id)}
+        if _txn_get(txn_f, folder_id) is not None:
+            subtree_ids.add(folder_id)
+        for subtree_id in subtree_ids:
+            _log_delete(txn_f, subtree_id)
     
     with documents_storage.transaction() as txn_d:
-        documents = txn_d['data']
-        modified = False
-        for doc in documents:
-            if doc.get('folder_id') == folder_id:
-                doc['folder_id'] = None
-                modified = True
-        txn_d['modified'] = modified
+        for subtree_id in subtree_ids:
+            for doc in txn_d['base'].find('folder_id', subtree_id):
+                _log_put(txn_d, dict(doc, folder_id=None))
+
+def _migrate_folder_paths():
+    """Give folders written before materialized paths their ``path``.
+    
+    Folders whose parent no longer exists (left behind by the old,
+    non-cascading ``delete_folder``) or that sit in a parent cycle are
+    re-attached to the root.
+    """
+    if all(f.get('path') for f in folders_storage.load()):
+        return
+    with folders_storage.transaction() as txn:
+        folders = txn['base'].records
+        by_id = txn['base'].by_id
+        paths = {}
+        
+        def path_of(folder, seen=()):
+            if folder['id'] not in paths:
+                parent = by_id.get(folder.get('parent_id'))
+                if parent is None or parent['id'] in seen or parent['id'] == folder['id']:
+                    paths[folder['id']] = (None, _folder_path(None, folder['id']))
+                else:
+                    parent_path = path_of(parent, seen + (folder['id'],))
+                    paths[folder['id']] = (parent['id'], f"{parent_path}{folder['id']}/")
+            return paths[folder['id']][1]
+        
+        for folder in folders:
+            path_of(folder)
+            parent_id, path = paths[folder['id']]
+            if folder.get('path') != path or folder.get('parent_id') != parent_id:
+                _log_put(txn, dict(folder, parent_id=parent_id, path=path))
+
+def count_documents_by_folder():
+    """Return ``{folder_id: number of documents directly in it}`` (None for the root)."""
+    return documents_storage.counts('folder_id')
+
+def store_versions():
+    """Return a version per store that changes whenever the store does."""
+    return {
+        'folders': folders_storage.version,
+        'documents': documents_storage.version,
+        'tags': tags_storage.version,
+        'categories': categories_storage.version,
+        'recent_files': recent_files_storage.version,
+    }
+
+def get_document_changes(since):
+    """Return the ids of the documents created, changed or deleted since the
+    documents store was at version ``since``; None when the store cannot
+    tell, and the caller must look at every document."""
+    return documents_storage.changed_since(since)
 
 def get_document_by_id(doc_id):
-    documents = documents_storage.load()
-    for doc in documents:
-        if doc['id'] == doc_id:
-            return doc
-    return None
+    return documents_storage.get(doc_id)
+
+def get_documents_by_ids(doc_ids):
+    """Return the documents with the given ids, skipping missing ones."""
+    documents = (documents_storage.get(doc_id) for doc_id in doc_ids)
+    return [doc for doc in documents if doc is not None]
+
+def get_documents_page(limit=None, after=None, folder_id=None):
+    """Return documents newest first by ``(updated_at, id)``, starting after the key ``after``.
+    
+    ``folder_id`` restricts the page to one folder; None means all folders.
+    """
+    records = documents_storage.find('folder_id', folder_id) if folder_id is not None else None
+    return documents_storage.page('updated', limit, after, records)
 
 def get_documents_by_folder_id(folder_id):
-    documents = documents_storage.load()
-    return [d for d in documents if d.get('folder_id') == folder_id]
+    return documents_storage.find('folder_id', folder_id)
+
+def get_document_by_filename(filename, folder_id=None):
+    matches = documents_storage.find('filename_folder', (filename, folder_id))
+    return matches[0] if matches else None
+
+def get_documents_by_filename(filename):
+    return documents_storage.find('filename', filename)
+
+def get_documents_by_tag_id(tag_id):
+    return documents_storage.find('tag_ids', tag_id)
+
+def get_documents_by_category_id(cat_id):
+    return documents_storage.find('category_ids', cat_id)
 
 def get_all_documents():
     return documents_storage.load()
 
+def get_document_content(doc):
+    """Return the text of ``doc``, read from its content blob."""
+    if 'content' in doc:
+        return doc['content']
+    content_hash = doc.get('content_hash')
+    return blobs.get(content_hash) if content_hash else ''
+
+def open_document_content(doc):
+    """Return a binary file object over the UTF-8 text of ``doc``."""
+    if 'content' in doc or not doc.get('content_hash'):
+        return BytesIO(doc.get('content', '').encode('utf-8'))
+    return blobs.open(doc['content_hash'])
+
+def _release_blob(txn, content_hash):
+    """Delete the blob once the transaction commits if no document still uses it."""
+    def release():
+        if not documents_storage._find_unsafe('content_hash', content_hash):
+            blobs.delete(content_hash)
+    if content_hash:
+        txn['on_commit'].append(release)
+
+def _migrate_inline_content():
+    """Move content still stored inline in documents.json into blobs."""
+    if not any('content' in doc for doc in documents_storage.load()):
+        return
+    with documents_storage.transaction() as txn:
+        for doc in txn['base'].records:
+            if 'content' in doc:
+                doc = dict(doc, **blobs.put(doc['content']))
+                del doc['content']
+                _log_put(txn, doc)
+
+def _migrate_document_stats():
+    """Add the statistics and outline introduced after a document was last saved."""
+    if all('outline' in doc for doc in documents_storage.load()):
+        return
+    with documents_storage.transaction() as txn:
+        for doc in txn['base'].records:
+            if 'outline' not in doc:
+                _log_put(txn, dict(doc, **content_metadata(get_document_content(doc))))
+
+def get_document_outline(doc):
+    """Return the heading outline recorded for ``doc`` at its last save."""
+    return [dict(heading) for heading in doc.get('outline', ())]
+
 def create_document(filename, content='', folder_id=None):
     with documents_storage.transaction() as txn:
-        documents = txn['data']
-        doc_id = get_next_id(documents)
+        doc_id = _txn_next_id(txn)
         document = {
             'id': doc_id,
             'filename': filename,
-            'content': content,
+            **blobs.put(content),
             'folder_id': folder_id,
             'created_at': datetime.utcnow().isoformat(),
             'updated_at': datetime.utcnow().isoformat(),
@@ -148,121 +1011,113 @@ def create_document(filename, content='', folder_id=None):
             'tag_ids': [],
             'category_ids': []
         }
-        documents.append(document)
-        txn['modified'] = True
-        return document
+        return _log_put(txn, document)
 
 def update_document(doc_id, **kwargs):
     with documents_storage.transaction() as txn:
-        documents = txn['data']
-        for doc in documents:
-            if doc['id'] == doc_id:
-                for key, value in kwargs.items():
-                    doc[key] = value
-                doc['updated_at'] = datetime.utcnow().isoformat()
-                txn['modified'] = True
-                return doc
-        return None
+        doc = _txn_get(txn, doc_id)
+        if doc is None:
+            return None
+        old_hash = doc.get('content_hash')
+        # None leaves the content as it is, as in the SQL engines.
+        content = kwargs.pop('content', None)
+        doc = dict(doc, **kwargs)
+        if content is not None:
+            doc.update(blobs.put(content))
+            if old_hash != doc['content_hash']:
+                _release_blob(txn, old_hash)
+        doc['updated_at'] = datetime.utcnow().isoformat()
+        return _log_put(txn, doc)
 
 def delete_document(doc_id):
     with documents_storage.transaction() as txn_d:
-        documents = txn_d['data']
-        original_len = len(documents)
-        documents[:] = [d for d in documents if d['id'] != doc_id]
-        txn_d['modified'] = len(documents) != original_len
+        doc = _txn_get(txn_d, doc_id)
+        if doc is not None:
+            _log_delete(txn_d, doc_id)
+            _release_blob(txn_d, doc.get('content_hash'))
     
     with recent_files_storage.transaction() as txn_r:
-        recent_files = txn_r['data']
-        original_len = len(recent_files)
-        recent_files[:] = [r for r in recent_files if r['document_id'] != doc_id]
-        txn_r['modified'] = len(recent_files) != original_len
+        for r in txn_r['base'].records:
+            if r['document_id'] == doc_id:
+                _log_delete(txn_r, r['id'])
 
 def get_tag_by_id(tag_id):
-    tags = tags_storage.load()
-    for tag in tags:
-        if tag['id'] == tag_id:
-            return tag
-    return None
+    return tags_storage.get(tag_id)
 
 def get_all_tags():
     return tags_storage.load()
 
+def count_documents_by_tag_id(tag_id):
+    return documents_storage.count('tag_ids', tag_id)
+
+def count_documents_by_tag():
+    return documents_storage.counts('tag_ids')
+
 def create_tag(name, color='#6366f1'):
     with tags_storage.transaction() as txn:
-        tags = txn['data']
-        for tag in tags:
+        for tag in txn['base'].records:
             if tag['name'] == name:
                 return tag
         
-        tag_id = get_next_id(tags)
+        tag_id = _txn_next_id(txn)
         tag = {
             'id': tag_id,
             'name': name,
             'color': color,
             'created_at': datetime.utcnow().isoformat()
         }
-        tags.append(tag)
-        txn['modified'] = True
-        return tag
+        return _log_put(txn, tag)
 
 def delete_tag(tag_id):
     with tags_storage.transaction() as txn_t:
-        tags = txn_t['data']
-        original_len = len(tags)
-        tags[:] = [t for t in tags if t['id'] != tag_id]
-        txn_t['modified'] = len(tags) != original_len
+        if _txn_get(txn_t, tag_id) is not None:
+            _log_delete(txn_t, tag_id)
     
     with documents_storage.transaction() as txn_d:
-        documents = txn_d['data']
-        modified = False
-        for doc in documents:
-            if tag_id in doc.get('tag_ids', []):
-                doc['tag_ids'].remove(tag_id)
-                modified = True
-        txn_d['modified'] = modified
+        for doc in txn_d['base'].find('tag_ids', tag_id):
+            tag_ids = [t for t in doc['tag_ids'] if t != tag_id]
+            _log_put(txn_d, dict(doc, tag_ids=tag_ids))
 
 def add_tag_to_document(doc_id, tag_id):
     with documents_storage.transaction() as txn:
-        documents = txn['data']
-        for doc in documents:
-            if doc['id'] == doc_id:
-                if 'tag_ids' not in doc:
-                    doc['tag_ids'] = []
-                if tag_id not in doc['tag_ids']:
-                    doc['tag_ids'].append(tag_id)
-                    txn['modified'] = True
-                return True
-        return False
+        doc = _txn_get(txn, doc_id)
+        if doc is None:
+            return False
+        tag_ids = list(doc.get('tag_ids', ()))
+        if tag_id not in tag_ids:
+            tag_ids.append(tag_id)
+            _log_put(txn, dict(doc, tag_ids=tag_ids))
+        return True
 
 def remove_tag_from_document(doc_id, tag_id):
     with documents_storage.transaction() as txn:
-        documents = txn['data']
-        for doc in documents:
-            if doc['id'] == doc_id:
-                if 'tag_ids' in doc and tag_id in doc['tag_ids']:
-                    doc['tag_ids'].remove(tag_id)
-                    txn['modified'] = True
-                return True
-        return False
+        doc = _txn_get(txn, doc_id)
+        if doc is None:
+            return False
+        if tag_id in doc.get('tag_ids', ()):
+            tag_ids = [t for t in doc['tag_ids'] if t != tag_id]
+            _log_put(txn, dict(doc, tag_ids=tag_ids))
+        return True
 
 def get_category_by_id(cat_id):
-    categories = categories_storage.load()
-    for cat in categories:
-        if cat['id'] == cat_id:
-            return cat
-    return None
+    return categories_storage.get(cat_id)
 
 def get_all_categories():
     return categories_storage.load()
 
+def count_documents_by_category_id(cat_id):
+    return documents_storage.count('category_ids', cat_id)
+
+def count_documents_by_category():
+    return documents_storage.counts('category_ids')
+
 def create_category(name, color='#ec4899', icon='bookmark'):
     with categories_storage.transaction() as txn:
-        categories = txn['data']
-        for cat in categories:
+        for cat in txn['base'].records:
             if cat['name'] == name:
                 return cat
         
-        cat_id = get_next_id(categories)
+        cat_id = _txn_next_id(txn)
         category = {
             'id': cat_id,
             'name': name,
@@ -270,68 +1125,138 @@ def create_category(name, color='#ec4899', icon='bookmark'):
             'icon': icon,
             'created_at': datetime.utcnow().isoformat()
         }
-        categories.append(category)
-        txn['modified'] = True
-        return category
+        return _log_put(txn, category)
 
 def delete_category(cat_id):
     with categories_storage.transaction() as txn_c:
-        categories = txn_c['data']
-        original_len = len(categories)
-        categories[:] = [c for c in categories if c['id'] != cat_id]
-        txn_c['modified'] = len(categories) != original_len
+        if _txn_get(txn_c, cat_id) is not None:
+            _log_delete(txn_c, cat_id)
     
     with documents_storage.transaction() as txn_d:
-        documents = txn_d['data']
-        modified = False
-        for doc in documents:
-            if cat_id in doc.get('category_ids', []):
-                doc['category_ids'].remove(cat_id)
-                modified = True
-        txn_d['modified'] = modified
+        for doc in txn_d['base'].find('category_ids', cat_id):
+            category_ids = [c for c in doc['category_ids'] if c != cat_id]
+            _log_put(txn_d, dict(doc, category_ids=category_ids))
 
 def add_category_to_document(doc_id, cat_id):
     with documents_storage.transaction() as txn:
-        documents = txn['data']
-        for doc in documents:
-            if doc['id'] == doc_id:
-                if 'category_ids' not in doc:
-                    doc['category_ids'] = []
-                if cat_id not in doc['category_ids']:
-                    doc['category_ids'].append(cat_id)
-                    txn['modified'] = True
-                return True
-        return False
+        doc = _txn_get(txn, doc_id)
+        if doc is None:
+            return False
+        category_ids = list(doc.get('category_ids', ()))
+        if cat_id not in category_ids:
+            category_ids.append(cat_id)
+            _log_put(txn, dict(doc, category_ids=category_ids))
+        return True
 
 def remove_category_from_document(doc_id, cat_id):
     with documents_storage.transaction() as txn:
-        documents = txn['data']
-        for doc in documents:
-            if doc['id'] == doc_id:
-                if 'category_ids' in doc and cat_id in doc['category_ids']:
-                    doc['category_ids'].remove(cat_id)
-                    txn['modified'] = True
-                return True
-        return False
+        doc = _txn_get(txn, doc_id)
+        if doc is None:
+            return False
+        if cat_id in doc.get('category_ids', ()):
+            category_ids = [c for c in doc['category_ids'] if c != cat_id]
+            _log_put(txn, dict(doc, category_ids=category_ids))
+        return True
+
+# bulk operation argument -> the lookup of the record it refers to
+_BULK_LOOKUPS = {
+    'folder_id': get_folder_by_id,
+    'tag_id': get_tag_by_id,
+    'category_id': get_category_by_id,
+}
+
+def _apply_bulk_operation(doc, operation, now):
+    op = operation['op']
+    if op == 'move':
+        doc['folder_id'] = operation['folder_id']
+        doc['updated_at'] = now
+    elif op in ('favorite', 'pin'):
+        doc['is_favorite' if op == 'favorite' else 'is_pinned'] = bool(operation.get('value', True))
+        doc['updated_at'] = now
+    else:
+        field, argument = ('tag_ids', 'tag_id') if op.endswith('_tag') else ('category_ids', 'category_id')
+        link_id = operation[argument]
+        ids = list(doc.get(field, ()))
+        if op.startswith('add_'):
+            if link_id not in ids:
+                ids.append(link_id)
+        else:
+            ids = [i for i in ids if i != link_id]
+        doc[field] = ids
+
+def bulk_update_documents(operations):
+    """Apply ``operations`` to many documents in a single transaction.
+    
+    Each operation is a dict with an ``op`` from
+    ``bulk_operations.BULK_DOCUMENT_OPS``, the ``document_ids`` it applies
+    to and the argument the op requires; ``favorite`` and ``pin`` take an
+    optional ``value`` (default True).
+    Operations run in order and unknown document ids are skipped; malformed
+    operations and unknown folders, tags or categories raise ValueError
+    before anything changes. Returns the number of documents updated and
+    deleted.
+    """
+    check_bulk_operations(operations, lambda argument, value: _BULK_LOOKUPS[argument](value) is not None)
+    now = datetime.utcnow().isoformat()
+    changed = {}
+    deleted = set()
+    with documents_storage.transaction() as txn_d:
+        by_id = txn_d['base'].by_id
+        for operation in operations:
+            for doc_id in operation['document_ids']:
+                if doc_id not in by_id or doc_id in deleted:
+                    continue
+                if operation['op'] == 'delete':
+                    deleted.add(doc_id)
+                    changed.pop(doc_id, None)
+                    continue
+                doc = changed.get(doc_id)
+                if doc is None:
+                    doc = changed[doc_id] = dict(by_id[doc_id])
+                _apply_bulk_operation(doc, operation, now)
+        
+        for doc in changed.values():
+            _log_put(txn_d, doc)
+        for doc_id in deleted:
+            _log_delete(txn_d, doc_id)
+            _release_blob(txn_d, by_id[doc_id].get('content_hash'))
+    
+    if deleted:
+        with recent_files_storage.transaction() as txn_r:
+            for r in txn_r['base'].records:
+                if r['document_id'] in deleted:
+                    _log_delete(txn_r, r['id'])
+    
+    return {'updated': len(changed), 'deleted': len(deleted)}
 
 def add_recent_file(doc_id):
     with recent_files_storage.transaction() as txn:
-        recent_files = txn['data']
-        recent_id = get_next_id(recent_files)
+        recent_files = txn['base'].records
+        recent_id = _txn_next_id(txn)
         recent = {
             'id': recent_id,
             'document_id': doc_id,
             'accessed_at': datetime.utcnow().isoformat()
         }
-        recent_files.append(recent)
+        recent = _log_put(txn, recent)
         
-        if len(recent_files) > 50:
-            recent_files[:] = recent_files[-50:]
+        if len(recent_files) >= 50:
+            for stale in recent_files[:-49]:
+                _log_delete(txn, stale['id'])
         
-        txn['modified'] = True
         return recent
 
-def get_recent_files(limit=20):
-    recent_files = recent_files_storage.load()
-    recent_files = sorted(recent_files, key=lambda x: x['accessed_at'], reverse=True)
-    return recent_files[:limit]
+def get_recent_files(limit=20, after=None):
+    """Return recent-file entries newest first, starting after the ``(accessed_at, id)`` key ``after``."""
+    return recent_files_storage.page('accessed', limit, after)
+
+_migrate_folder_paths()
+_migrate_inline_content()
+_migrate_document_stats()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'convert' or sys.argv[2] not in SERIALIZERS:
+        sys.exit(f"usage: python storage.py convert {{{'|'.join(SERIALIZERS)}}}")
+    for store in (folders_storage, documents_storage, tags_storage, categories_storage, recent_files_storage):
+        store.convert(sys.argv[2])
+        print(f'{store.filename}: {sys.argv[2]}')
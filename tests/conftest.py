@@ -0,0 +1,41 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+# storage creates its module-level stores under ./data when imported; keep
+# them away from the working tree's data directory.
+os.chdir(tempfile.mkdtemp(prefix='markdown-manager-tests-'))
+
+import storage
+from blob_store import BlobStore
+from sqlite_storage import SQLiteStorage
+
+STORES = ('folders_storage', 'documents_storage', 'tags_storage', 'categories_storage', 'recent_files_storage')
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Point new ``JSONStorage`` instances at an empty directory."""
+    monkeypatch.setattr(storage, 'DATA_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def json_api(data_dir, monkeypatch):
+    """The ``storage`` module with its stores swapped for empty ones under ``data_dir``."""
+    for name in STORES:
+        store = getattr(storage, name)
+        monkeypatch.setattr(storage, name, storage.JSONStorage(
+            os.path.basename(store.filename), indexes=store._index_keys, orders=store._order_keys))
+    monkeypatch.setattr(storage, 'blobs', BlobStore(str(data_dir / 'blobs')))
+    return storage
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def api(request, tmp_path):
+    """The storage function API of each engine, on empty stores."""
+    if request.param == 'json':
+        return request.getfixturevalue('json_api')
+    return SimpleNamespace(**SQLiteStorage(str(tmp_path / 'storage.sqlite3')).api())
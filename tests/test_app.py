@@ -0,0 +1,115 @@
+import pytest
+
+import models
+import storage
+from quick_open import QuickOpenIndex
+from search_index import SearchIndex
+
+try:
+    import app
+except (ImportError, OSError) as e:
+    # The renderer needs WeasyPrint and its system libraries.
+    pytest.skip(f'app cannot be imported: {e}', allow_module_level=True)
+
+
+@pytest.fixture
+def client(json_api, monkeypatch):
+    monkeypatch.setattr(models, '_search_index', SearchIndex())
+    monkeypatch.setattr(models, '_quick_open_index', QuickOpenIndex())
+    return app.app.test_client()
+
+
+def walk(client, url, key, **params):
+    """Follow ``next_cursor`` through every page of ``url``; return the pages."""
+    pages, cursor = [], None
+    while True:
+        query = dict(params, cursor=cursor) if cursor else params
+        body = client.get(url, query_string=query).get_json()
+        assert body['success'], body
+        pages.append(body[key])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def test_document_listing_cursors_round_trip(client, json_api):
+    docs = [json_api.create_document(f'{i}.md') for i in range(5)]
+    pages = walk(client, '/api/documents', 'documents', limit=2)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [doc['id'] for page in pages for doc in page] == [doc['id'] for doc in reversed(docs)]
+
+
+def test_search_pages_past_the_default_limit(client, json_api, monkeypatch):
+    monkeypatch.setattr(app, 'SEARCH_LIMIT', 3)
+    docs = [json_api.create_document(f'{i}.md', 'report ' * (i + 1)) for i in range(7)]
+    json_api.create_document('other.md', 'unrelated')
+    pages = walk(client, '/api/search', 'results', q='report ')
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [result['id'] for page in pages for result in page]
+    assert sorted(ids) == sorted(doc['id'] for doc in docs)
+    scores = [result['score'] for page in pages for result in page]
+    assert scores == sorted(scores, reverse=True)
+
+    pages = walk(client, '/api/search', 'results', q='report ', limit=5)
+    assert [len(page) for page in pages] == [5, 2]
+
+
+def test_bad_cursors_are_rejected(client):
+    response = client.get('/api/search', query_string={'q': 'x', 'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+    assert client.get('/api/documents', query_string={'limit': 0}).status_code == 400
+
+
+def test_fields_limit_the_serialized_keys(client, json_api):
+    tag = json_api.create_tag('work')
+    doc = json_api.create_document('a.md', 'report body')
+    json_api.add_tag_to_document(doc['id'], tag['id'])
+
+    body = client.get('/api/documents', query_string={'fields': 'filename,tags'}).get_json()
+    [result] = body['documents']
+    assert set(result) == {'id', 'filename', 'tags'}
+    assert (result['filename'], [t['name'] for t in result['tags']]) == ('a.md', ['work'])
+
+    body = client.get('/api/search', query_string={'q': 'report ', 'fields': 'filename'}).get_json()
+    assert [set(result) for result in body['results']] == [{'id', 'filename', 'score'}]
+    body = client.get('/api/search', query_string={'q': 'report ', 'fields': 'snippet'}).get_json()
+    assert set(body['results'][0]) == {'id', 'score', 'snippet'}
+
+
+@pytest.mark.parametrize('journal', [True, False])
+def test_etags_answer_304_until_the_next_write(client, json_api, monkeypatch, journal):
+    store = json_api.documents_storage
+    monkeypatch.setattr(storage, 'documents_storage', storage.JSONStorage(
+        'documents.json', journal=journal, indexes=store._index_keys, orders=store._order_keys))
+    doc = json_api.create_document('a.md', 'first')
+    response = client.get('/api/documents')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get('/api/documents', headers={'If-None-Match': etag})
+    assert (response.status_code, response.headers['ETag'], response.data) == (304, etag, b'')
+
+    seen = {etag}
+    for content in ('second', 'third'):
+        json_api.update_document(doc['id'], content=content)
+        response = client.get('/api/documents', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        etag = response.headers['ETag']
+        assert etag not in seen
+        seen.add(etag)
+    # Other stores' writes leave ETags of views not built from them alone.
+    files_etag = client.get('/api/files').headers['ETag']
+    json_api.create_tag('work')
+    assert client.get('/api/files', headers={'If-None-Match': files_etag}).status_code == 304
+    assert client.get('/api/documents', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_updating_content_to_null_leaves_it_unchanged(client, json_api):
+    doc = json_api.create_document('a.md', 'body')
+    response = client.put(f'/api/documents/{doc["id"]}', json={'content': None, 'is_pinned': True})
+    assert response.status_code == 200
+    document = response.get_json()['document']
+    assert (document['content'], document['is_pinned']) == ('body', True)
+
+    response = client.put(f'/api/documents/{doc["id"]}', json={'content': 5})
+    assert (response.status_code, response.get_json()['error']) == (400, 'content must be a string')
@@ -0,0 +1,28 @@
+import io
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+from document_writers import write_docx, write_epub, write_odt
+
+CONTENT = '# Tit\x00le\n\nPage one\x0cpage two \x01[link](https://example.com/\x02)\n\n```\ncode\x1b[0m\n```\n'
+
+
+def xml_parts(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return {name: ElementTree.fromstring(archive.read(name)) for name in archive.namelist()
+                if name.endswith(('.xml', '.xhtml', '.opf', '.ncx'))}
+
+
+@pytest.mark.parametrize('write', [write_docx, write_odt, write_epub])
+def test_control_characters_are_stripped(write):
+    parts = xml_parts(write(CONTENT, 'Bad\x0btitle', 'digest'))
+    text = ''.join(''.join(root.itertext()) for root in parts.values())
+    assert 'Title' in text and 'Page onepage two' in text and 'code[0m' in text
+    assert 'Badtitle' in text
+
+
+def test_clean_content_is_written_unchanged():
+    parts = xml_parts(write_odt('Über, é and 😀\n', 'Title'))
+    assert 'Über, é and 😀' in ''.join(parts['content.xml'].itertext())
@@ -0,0 +1,79 @@
+import models
+from quick_open import QuickOpenIndex, _bits, _slots
+
+
+def build(entries, version=1):
+    index = QuickOpenIndex()
+    index.sync(version, lambda: entries)
+    return index
+
+
+def paths(results):
+    return [result['path'] for result in results]
+
+
+def test_bitset_helpers_round_trip():
+    assert _bits([]) == 0
+    assert _bits([0, 3, 64]) == 1 | 8 | 1 << 64
+    assert list(_slots(_bits([0, 3, 64, 200]))) == [0, 3, 64, 200]
+    assert list(_slots(0)) == []
+
+
+def test_name_matches_rank_above_path_and_fuzzy_matches():
+    index = build([
+        (1, 'Projects', 'readme.md'),
+        (2, 'Readme drafts', 'notes.md'),
+        (3, '', 'my-readme.md'),
+        (4, '', 'r-e-a-d-m-e.md'),
+        (5, '', 'unrelated.md'),
+    ])
+    results = index.search('readme')
+    assert paths(results) == ['Projects/readme.md', 'my-readme.md', 'Readme drafts/notes.md', 'r-e-a-d-m-e.md']
+    assert results[0]['highlights'] == [[9, 15]]
+    assert results[3]['highlights'] == [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9], [10, 11]]
+    assert index.search('zzz') == []
+    assert index.search('   ') == []
+
+
+def test_queries_ignore_case_and_whitespace():
+    index = build([(1, 'Work', 'Quarterly Report.md')])
+    assert paths(index.search('quarterly report')) == ['Work/Quarterly Report.md']
+    assert paths(index.search('QR')) == ['Work/Quarterly Report.md']
+    assert paths(index.search('work/q')) == ['Work/Quarterly Report.md']
+
+
+def test_sync_reuses_the_slots_of_removed_documents():
+    entries = [(1, '', 'alpha.md'), (2, '', 'beta.md'), (3, '', 'gamma.md')]
+    index = build(entries)
+    entries = [entries[0], entries[2], (4, '', 'delta.md')]
+    index.sync(2, lambda: entries)
+    assert index._slots == [1, None, 3, 4]
+    assert paths(index.search('beta')) == []
+    assert paths(index.search('delta')) == ['delta.md']
+    assert 'b' not in index._masks
+    index.sync(3, lambda: entries + [(5, '', 'epsilon.md')])
+    assert index._slots == [1, 5, 3, 4]
+    assert paths(index.search('eps')) == ['epsilon.md']
+
+
+def test_sync_follows_only_changed_documents(json_api, monkeypatch):
+    monkeypatch.setattr(models, '_quick_open_index', QuickOpenIndex())
+    folder = json_api.create_folder('Notes')
+    first = json_api.create_document('first.md', folder_id=folder['id'])
+    second = json_api.create_document('second.md')
+    assert paths(models.Document.quick_open('first')) == ['Notes/first.md']
+
+    json_api.update_document(first['id'], filename='renamed.md')
+    json_api.delete_document(second['id'])
+    json_api.create_document('third.md')
+    listed = []
+    entries = models.Document._quick_open_entries
+    monkeypatch.setattr(models.Document, '_quick_open_entries',
+                        staticmethod(lambda documents=None: listed.append(documents is None) or entries(documents)))
+    assert paths(models.Document.quick_open('md')) == ['third.md', 'Notes/renamed.md']
+    assert listed == [False]
+
+    # A folder rename changes paths of documents that were not written.
+    json_api.update_folder(folder['id'], name='Archive')
+    assert paths(models.Document.quick_open('renamed')) == ['Archive/renamed.md']
+    assert listed == [False, True]
@@ -0,0 +1,133 @@
+import pytest
+
+import models
+from search_index import SearchIndex, normalize, parse_query
+
+
+def build(documents):
+    """Return an index over ``{doc_id: (filename, content)}``."""
+    index = SearchIndex()
+    records = [{'id': doc_id, 'filename': filename, 'content_hash': content}
+               for doc_id, (filename, content) in documents.items()]
+    index.sync(1, lambda: records, lambda doc: doc['content_hash'])
+    return index
+
+
+def ranked(index, query, candidates=None):
+    scores = index.search(parse_query(query), candidates)
+    return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+
+def test_bm25_ranks_by_frequency_length_and_rarity():
+    index = build({
+        1: ('a.md', 'python python python and some other words'),
+        2: ('b.md', 'python and some other words here too'),
+        3: ('c.md', 'python'),
+        4: ('d.md', 'rust and python'),
+    })
+    scores = index.search(parse_query('python '))
+    # More occurrences in a document of the same length rank higher...
+    assert scores[1] > scores[2]
+    # ...and so do shorter documents with as many occurrences.
+    assert scores[3] > scores[4] > scores[2]
+    # A rare term outweighs a common one.
+    assert ranked(index, 'rust ')[0] == 4
+    scores = index.search(parse_query('rust python '))
+    assert list(scores) == [4]
+    assert scores[4] > index.search(parse_query('python '))[4]
+
+
+def test_phrases_match_consecutive_words_only():
+    index = build({
+        1: ('a.md', 'the quick brown fox'),
+        2: ('b.md', 'brown quick fox'),
+        3: ('quick.md', 'brown bear'),
+    })
+    assert ranked(index, '"quick brown"') == [1]
+    assert ranked(index, 'quick-brown') == [1]
+    # A phrase never spans the filename and the content.
+    assert ranked(index, '"md brown"') == []
+    assert set(ranked(index, 'quick brown ')) == {1, 2, 3}
+
+
+def test_last_word_matches_as_a_prefix_while_typing():
+    index = build({1: ('a.md', 'indexing text'), 2: ('b.md', 'an index'), 3: ('c.md', 'indigo')})
+    assert parse_query('inde') == [(('inde',), True)]
+    assert set(ranked(index, 'inde')) == {1, 2}
+    assert ranked(index, 'inde ') == []
+    assert ranked(index, '"inde"') == []
+    assert set(ranked(index, 'text ind')) == {1}
+    # Single letters are too short to expand.
+    assert parse_query('i') == [(('i',), False)]
+
+
+def test_arabic_text_is_folded():
+    index = build({
+        1: ('a.md', 'قرأتُ الكِتَابَ في المدرسة'),
+        2: ('b.md', 'كـتـاب جديد'),
+        3: ('c.md', 'مستشفى إسلامي'),
+    })
+    assert normalize('الكِتَابَ') == normalize('كتاب') == normalize('كـتـاب')
+    assert set(ranked(index, 'كتاب ')) == {1, 2}
+    assert ranked(index, 'مدرسه ') == [1]
+    assert ranked(index, 'مستشفي اسلامي ') == [3]
+    assert ranked(index, 'قرات ') == [1]
+
+
+def test_candidates_restrict_results():
+    index = build({1: ('a.md', 'shared'), 2: ('b.md', 'shared'), 3: ('c.md', 'shared')})
+    assert ranked(index, 'shared ', {2, 3, 9}) == [2, 3]
+    assert ranked(index, 'shared ', set()) == []
+
+
+def test_tag_and_category_filters(json_api):
+    work = json_api.create_tag('work')
+    urgent = json_api.create_tag('urgent')
+    reference = json_api.create_category('Reference')
+    docs = [json_api.create_document(f'{i}.md', f'report number {i}') for i in range(4)]
+    for doc in docs[:3]:
+        json_api.add_tag_to_document(doc['id'], work['id'])
+    json_api.add_tag_to_document(docs[1]['id'], urgent['id'])
+    json_api.add_tag_to_document(docs[2]['id'], urgent['id'])
+    json_api.add_category_to_document(docs[2]['id'], reference['id'])
+
+    index = SearchIndex()
+    index.sync(json_api.store_versions()['documents'], json_api.get_all_documents, json_api.get_document_content)
+    candidates = models.Document.filter_ids(tag_ids=[work['id'], urgent['id']])
+    assert ranked(index, 'report ', candidates) == [docs[1]['id'], docs[2]['id']]
+    candidates = models.Document.filter_ids(tag_ids=[work['id']], category_ids=[reference['id']])
+    assert ranked(index, 'report ', candidates) == [docs[2]['id']]
+    assert models.Document.filter_ids() is None
+
+
+def test_sync_only_reads_documents_changed_since_the_indexed_version(json_api):
+    first = json_api.create_document('first.md', 'alpha')
+    second = json_api.create_document('second.md', 'beta')
+    index = SearchIndex()
+
+    def sync(list_documents=json_api.get_all_documents):
+        index.sync(json_api.store_versions()['documents'], list_documents, json_api.get_document_content,
+                   models._document_changes)
+
+    sync()
+    json_api.update_document(first['id'], content='gamma')
+    json_api.delete_document(second['id'])
+    third = json_api.create_document('third.md', 'alpha')
+
+    def rescan():
+        raise AssertionError('the whole store was listed')
+
+    sync(rescan)
+    assert ranked(index, 'gamma ') == [first['id']]
+    assert ranked(index, 'alpha ') == [third['id']]
+    assert ranked(index, 'beta ') == []
+
+
+@pytest.mark.parametrize('since', [None, -1])
+def test_sync_rescans_when_changes_are_unknown(json_api, since):
+    doc = json_api.create_document('a.md', 'alpha')
+    index = SearchIndex()
+    index.version = since
+    index.sync(json_api.store_versions()['documents'], json_api.get_all_documents, json_api.get_document_content,
+               models._document_changes)
+    assert ranked(index, 'alpha ') == [doc['id']]
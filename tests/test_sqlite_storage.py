@@ -0,0 +1,134 @@
+import os
+import shutil
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from sqlite_storage import SQLiteStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DATA = os.path.join(ROOT, 'tests', 'fixtures', 'json_data')
+
+
+@pytest.fixture
+def db(tmp_path):
+    """The storage.py function API bound to a fresh SQLite database."""
+    return SimpleNamespace(**SQLiteStorage(str(tmp_path / 'storage.sqlite3')).api())
+
+
+def test_document_crud(db):
+    folder = db.create_folder('Notes')
+    doc = db.create_document('a.md', '# Title\n\nbody text', folder['id'])
+    assert doc['folder_id'] == folder['id']
+    assert doc['word_count'] == 4
+    assert db.get_document_content(doc) == '# Title\n\nbody text'
+    assert db.get_document_outline(doc) == [{'level': 1, 'text': 'Title', 'line': 1}]
+    assert db.get_document_by_filename('a.md', folder['id'])['id'] == doc['id']
+
+    updated = db.update_document(doc['id'], content='changed', is_favorite=True)
+    assert updated['is_favorite'] is True
+    assert db.get_document_content(updated) == 'changed'
+    assert db.update_document(999, content='x') is None
+    with pytest.raises(ValueError):
+        db.update_document(doc['id'], owner='someone')
+
+    db.add_recent_file(doc['id'])
+    db.delete_document(doc['id'])
+    assert db.get_document_by_id(doc['id']) is None
+    assert db.get_recent_files() == []
+    assert db.get_documents_by_folder_id(folder['id']) == []
+
+
+def test_link_counters_follow_links(db):
+    tag = db.create_tag('work')
+    assert db.create_tag('work')['id'] == tag['id']
+    category = db.create_category('Reference')
+    docs = [db.create_document(f'{i}.md', str(i)) for i in range(3)]
+    for doc in docs:
+        assert db.add_tag_to_document(doc['id'], tag['id'])
+    db.add_tag_to_document(docs[0]['id'], tag['id'])
+    db.add_category_to_document(docs[0]['id'], category['id'])
+    assert db.count_documents_by_tag_id(tag['id']) == 3
+    assert db.count_documents_by_category() == {category['id']: 1}
+
+    db.remove_tag_from_document(docs[1]['id'], tag['id'])
+    db.delete_document(docs[2]['id'])
+    assert db.count_documents_by_tag() == {tag['id']: 1}
+    db.bulk_update_documents([{'op': 'delete', 'document_ids': [docs[0]['id']]}])
+    assert db.count_documents_by_tag_id(tag['id']) == 0
+    assert db.count_documents_by_category_id(category['id']) == 0
+
+
+def test_store_versions_bump_on_writes_to_their_tables(db):
+    before = db.store_versions()
+    doc = db.create_document('a.md')
+    after_create = db.store_versions()
+    assert after_create['documents'] > before['documents']
+    assert after_create['folders'] == before['folders']
+
+    tag = db.create_tag('work')
+    after_tag = db.store_versions()
+    assert after_tag['tags'] > after_create['tags']
+    assert after_tag['documents'] == after_create['documents']
+
+    # Link tables belong to the documents store.
+    db.add_tag_to_document(doc['id'], tag['id'])
+    assert db.store_versions()['documents'] > after_tag['documents']
+
+
+def test_deletes_cascade(db):
+    root = db.create_folder('root')
+    child = db.create_folder('child', root['id'])
+    grandchild = db.create_folder('grandchild', child['id'])
+    other = db.create_folder('other')
+    inside = db.create_document('inside.md', folder_id=grandchild['id'])
+    outside = db.create_document('outside.md', folder_id=other['id'])
+    tag = db.create_tag('work')
+    category = db.create_category('Reference')
+    db.add_tag_to_document(outside['id'], tag['id'])
+    db.add_category_to_document(outside['id'], category['id'])
+
+    db.delete_folder(child['id'])
+    assert [f['id'] for f in db.get_all_folders()] == [root['id'], other['id']]
+    assert db.get_document_by_id(inside['id'])['folder_id'] is None
+    assert db.get_document_by_id(outside['id'])['folder_id'] == other['id']
+
+    db.delete_tag(tag['id'])
+    db.delete_category(category['id'])
+    doc = db.get_document_by_id(outside['id'])
+    assert doc['tag_ids'] == [] and doc['category_ids'] == []
+
+
+def test_bulk_update_rejects_unknown_references_before_writing(db):
+    doc = db.create_document('a.md')
+    with pytest.raises(ValueError, match='Tag 5 not found'):
+        db.bulk_update_documents([{'op': 'favorite', 'document_ids': [doc['id']]},
+                                  {'op': 'add_tag', 'document_ids': [doc['id']], 'tag_id': 5}])
+    assert db.get_document_by_id(doc['id'])['is_favorite'] is False
+
+
+def test_import_json_data_directory(tmp_path):
+    shutil.copytree(FIXTURE_DATA, tmp_path / 'data')
+    database = tmp_path / 'imported.sqlite3'
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'sqlite_storage.py'), 'import-json'],
+                            cwd=tmp_path, env=dict(os.environ, SQLITE_PATH=str(database)),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '3 folders, 3 documents, 2 tags, 1 categories, 2 recent_files'
+
+    db = SimpleNamespace(**SQLiteStorage(str(database)).api())
+    folders = {f['id']: f for f in db.get_all_folders()}
+    assert {folder_id: (f['parent_id'], f['path']) for folder_id, f in folders.items()} == {
+        1: (None, '/1/'), 2: (1, '/1/2/'), 4: (None, '/4/'),
+    }
+    readme, plan, lost = db.get_all_documents()
+    assert db.get_document_content(readme) == '# Readme\n\nHello world.\n'
+    assert (readme['is_favorite'], readme['tag_ids'], readme['category_ids']) == (True, [1, 2], [1])
+    assert (plan['id'], plan['folder_id'], plan['is_pinned']) == (3, 2, True)
+    assert (lost['id'], lost['folder_id']) == (7, None)
+    assert db.count_documents_by_tag() == {1: 2, 2: 1}
+    assert [r['document_id'] for r in db.get_recent_files()] == [3]
+
+    # Ids continue after the imported ones.
+    assert db.create_document('new.md')['id'] == 8
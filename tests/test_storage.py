@@ -0,0 +1,366 @@
+import json
+import os
+import random
+import subprocess
+import sys
+from threading import Thread
+
+import pytest
+
+import storage
+from storage import JournalCorrupt, JSONStorage, _log_delete, _log_put, _txn_get, _txn_next_id, group_commit
+
+INDEXES = {
+    'folder_id': lambda d: [d.get('folder_id')],
+    'tag_ids': lambda d: d.get('tag_ids', ()),
+}
+
+
+def put(store, *records):
+    with store.transaction() as txn:
+        for record in records:
+            _log_put(txn, record)
+
+
+def run_in_other_process(data_dir, code):
+    """Run ``code`` in a fresh interpreter with ``store`` open on ``docs.json``; return its stdout as JSON."""
+    script = (
+        'import json, storage\n'
+        f'storage.DATA_DIR = {str(data_dir)!r}\n'
+        "store = storage.JSONStorage('docs.json')\n"
+        f'{code}\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', script], cwd=data_dir, env=dict(os.environ, PYTHONPATH=root),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def delete(store, *record_ids):
+    with store.transaction() as txn:
+        for record_id in record_ids:
+            _log_delete(txn, record_id)
+
+
+def test_replay_drops_truncated_journal_line(data_dir):
+    store = JSONStorage('docs.json')
+    put(store, {'id': 1, 'name': 'a'})
+    put(store, {'id': 2, 'name': 'b'})
+    with open(store.journal_filename, 'a', encoding='utf-8') as f:
+        f.write('{"version": 3, "ops": [{"op": "put", "record": {"id": 3')
+    
+    reopened = JSONStorage('docs.json')
+    assert [r['name'] for r in reopened.load()] == ['a', 'b']
+    assert reopened.version == 2
+    
+    put(reopened, {'id': 3, 'name': 'c'})
+    with open(store.journal_filename, encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry['version'] for entry in entries] == [1, 2, 3]
+    assert [r['name'] for r in JSONStorage('docs.json').load()] == ['a', 'b', 'c']
+
+
+def test_appends_after_a_torn_tail_survive_reload(data_dir):
+    store = JSONStorage('docs.json')
+    put(store, {'id': 1})
+    # A peer process crashing mid-append leaves a torn entry behind.
+    with open(store.journal_filename, 'a', encoding='utf-8') as f:
+        f.write('{"version": 2, "ops": [{"op": "put", "record": {"id": 9')
+    put(store, {'id': 2})
+    put(store, {'id': 3})
+    assert [r['id'] for r in store.load()] == [1, 2, 3]
+    
+    with open(store.journal_filename, encoding='utf-8') as f:
+        assert [json.loads(line)['version'] for line in f] == [1, 2, 3]
+    assert [r['id'] for r in JSONStorage('docs.json').load()] == [1, 2, 3]
+
+
+def test_replay_raises_on_a_corrupt_entry_mid_journal(data_dir):
+    store = JSONStorage('docs.json')
+    for i in range(1, 4):
+        put(store, {'id': i})
+    with open(store.journal_filename, encoding='utf-8') as f:
+        lines = f.readlines()
+    lines[1] = lines[1][:20] + '\n'
+    with open(store.journal_filename, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    
+    with pytest.raises(JournalCorrupt):
+        JSONStorage('docs.json').load()
+    with pytest.raises(JournalCorrupt):
+        store.load()
+
+
+def test_replay_applies_deletes_after_snapshot(data_dir):
+    store = JSONStorage('docs.json')
+    put(store, {'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'})
+    store.compact()
+    delete(store, 1)
+    put(store, {'id': 2, 'name': 'b2'})
+    
+    reopened = JSONStorage('docs.json')
+    assert [dict(r) for r in reopened.load()] == [{'id': 2, 'name': 'b2'}]
+    assert reopened.version == 3
+
+
+def test_compaction_then_reload_in_another_process(data_dir):
+    store = JSONStorage('docs.json')
+    for i in range(1, 6):
+        put(store, {'id': i, 'name': f'doc {i}'})
+    delete(store, 2)
+    store.compact()
+    with open(store.journal_filename, encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == [{'version': 6, 'ops': []}]
+    
+    loaded = run_in_other_process(data_dir, 'print(json.dumps({"version": store.version, '
+                                            '"ids": [r["id"] for r in store.load()]}))')
+    assert loaded == {'version': 6, 'ids': [1, 3, 4, 5]}
+    
+    version = run_in_other_process(data_dir, "with store.transaction() as txn:\n"
+                                             "    storage._log_put(txn, {'id': 6, 'name': 'doc 6'})\n"
+                                             "print(store.version)")
+    assert version == 7
+    assert [r['id'] for r in store.load()] == [1, 3, 4, 5, 6]
+    assert store.version == 7
+
+
+def test_group_commit_syncs_every_write_once_at_exit(data_dir, monkeypatch):
+    store = JSONStorage('docs.json')
+    synced = []
+    sync = store.sync
+    monkeypatch.setattr(store, 'sync', lambda seq=None: (synced.append(seq), sync(seq)))
+    
+    with group_commit():
+        for i in range(1, 4):
+            put(store, {'id': i})
+        assert synced == []
+    assert synced == [3]
+    assert store._synced_seq == 3
+    
+    def write(first):
+        for record_id in range(first, first + 10):
+            put(store, {'id': record_id})
+    
+    threads = [Thread(target=write, args=(first,)) for first in range(100, 140, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store._synced_seq == store._written_seq == 43
+    assert len(JSONStorage('docs.json').load()) == 43
+
+
+def snapshot_state(snapshot):
+    indexes = {name: {key: list(ids) for key, ids in index.items()} for name, index in snapshot.indexes.items()}
+    return list(snapshot.by_id), indexes, [dict(r) for r in snapshot.records]
+
+
+def test_indexes_match_a_rebuild_after_put_and_delete_ops(data_dir):
+    store = JSONStorage('docs.json', indexes=INDEXES)
+    rng = random.Random(10)
+    for _ in range(200):
+        before = store._current()
+        before_state = snapshot_state(before)
+        with store.transaction() as txn:
+            for _ in range(rng.randint(1, 4)):
+                record_id = rng.randint(1, 30)
+                if rng.random() < 0.3:
+                    _log_delete(txn, record_id)
+                else:
+                    _log_put(txn, {'id': record_id, 'folder_id': rng.choice([None, 1, 2]),
+                                   'tag_ids': rng.sample(range(5), rng.randint(0, 3))})
+        
+        after = store._current()
+        by_id, indexes = store._build_indexes(after.records)
+        assert list(after.by_id) == list(by_id)
+        assert after.indexes == indexes
+        assert after.max_id == max(by_id, default=0)
+        assert snapshot_state(before) == before_state
+    assert snapshot_state(JSONStorage('docs.json', indexes=INDEXES)._current()) == snapshot_state(store._current())
+
+
+def test_sort_orders_follow_commits_without_a_resort(data_dir, monkeypatch):
+    orders = {'rank': lambda d: (d['rank'], d['id'])}
+    store = JSONStorage('docs.json', orders=orders)
+    put(store, *({'id': i, 'rank': i % 7} for i in range(1, 31)))
+    store.page('rank')
+    rng = random.Random(17)
+    for _ in range(50):
+        with store.transaction() as txn:
+            for _ in range(rng.randint(1, 4)):
+                record_id = rng.randint(1, 40)
+                if rng.random() < 0.3:
+                    _log_delete(txn, record_id)
+                else:
+                    _log_put(txn, {'id': record_id, 'rank': rng.randint(0, 9)})
+        keys, records = store._current().orders['rank']
+        expected = sorted(store._current().records, key=orders['rank'])
+        assert list(records) == expected
+        assert list(keys) == [orders['rank'](r) for r in expected]
+    
+    # Commits touching many records leave the order to be sorted on first use.
+    monkeypatch.setattr(storage, 'ORDER_REPLAY_LIMIT', 2)
+    put(store, *({'id': i, 'rank': 0} for i in range(1, 4)))
+    assert store._current().orders == {}
+    assert [r['id'] for r in store.page('rank', 3)] == [r['id'] for r in sorted(
+        store._current().records, key=orders['rank'], reverse=True)][:3]
+
+
+def test_page_cursors_walk_the_whole_order(json_api):
+    docs = [json_api.create_document(f'{i}.md') for i in range(7)]
+    json_api.update_document(docs[2]['id'], content='touched')
+    order = lambda d: (d['updated_at'], d['id'])
+    expected = [d['id'] for d in sorted(json_api.get_all_documents(), key=order, reverse=True)]
+    seen, after = [], None
+    while True:
+        page = json_api.get_documents_page(3, after)
+        if not page:
+            break
+        seen += [d['id'] for d in page]
+        after = order(page[-1])
+    assert seen == expected
+    assert seen[0] == docs[2]['id']
+
+
+def test_transaction_reads_its_own_changes(data_dir):
+    store = JSONStorage('docs.json')
+    put(store, {'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'})
+    with store.transaction() as txn:
+        assert _txn_next_id(txn) == 3
+        _log_delete(txn, 2)
+        assert _txn_get(txn, 2) is None
+        assert _txn_next_id(txn) == 2
+        _log_put(txn, {'id': 2, 'name': 'c'})
+        assert _txn_get(txn, 2)['name'] == 'c'
+        assert store.get(2)['name'] == 'b'
+    assert [r['name'] for r in store.load()] == ['a', 'c']
+
+
+def folder_paths(api):
+    return {f['id']: f['path'] for f in api.get_all_folders()}
+
+
+def test_moving_a_folder_rewrites_its_subtree(api):
+    a = api.create_folder('a')
+    b = api.create_folder('b', a['id'])
+    c = api.create_folder('c', b['id'])
+    d = api.create_folder('d')
+    
+    moved = api.move_folder(b['id'], d['id'])
+    assert (moved['parent_id'], moved['path']) == (d['id'], f"/{d['id']}/{b['id']}/")
+    assert folder_paths(api)[c['id']] == f"/{d['id']}/{b['id']}/{c['id']}/"
+    assert {f['id'] for f in api.get_folder_subtree(d['id'])} == {d['id'], b['id'], c['id']}
+    assert [f['id'] for f in api.get_folder_subtree(a['id'])] == [a['id']]
+    
+    api.move_folder(b['id'], None)
+    assert folder_paths(api)[c['id']] == f"/{b['id']}/{c['id']}/"
+
+
+def test_a_folder_cannot_move_into_its_own_subtree(api):
+    a = api.create_folder('a')
+    b = api.create_folder('b', a['id'])
+    c = api.create_folder('c', b['id'])
+    before = folder_paths(api)
+    
+    for parent_id in (a['id'], c['id']):
+        with pytest.raises(ValueError, match='own subtree'):
+            api.move_folder(a['id'], parent_id)
+    with pytest.raises(ValueError, match='not found'):
+        api.move_folder(a['id'], 999)
+    assert folder_paths(api) == before
+
+
+def test_subtrees_stop_at_path_segment_boundaries(api):
+    folders = [api.create_folder(f'f{i}') for i in range(1, 11)]
+    one, ten = folders[0], folders[9]
+    assert (one['id'], ten['id']) == (1, 10)
+    child = api.create_folder('child', one['id'])
+    ten_child = api.create_folder('ten child', ten['id'])
+    api.create_document('in ten.md', folder_id=ten['id'])
+    
+    assert {f['id'] for f in api.get_folder_subtree(one['id'])} == {one['id'], child['id']}
+    assert api.count_documents_in_folder_tree(one['id']) == 0
+    
+    api.move_folder(one['id'], folders[1]['id'])
+    assert folder_paths(api)[ten_child['id']] == f"/10/{ten_child['id']}/"
+    api.delete_folder(one['id'])
+    assert api.get_folder_by_id(ten['id']) is not None
+    assert api.get_folder_by_id(ten_child['id']) is not None
+    assert api.count_documents_in_folder_tree(ten['id']) == 1
+
+
+def test_deleting_a_folder_deletes_its_subtree(api):
+    a = api.create_folder('a')
+    b = api.create_folder('b', a['id'])
+    c = api.create_folder('c', b['id'])
+    other = api.create_folder('other')
+    in_c = api.create_document('in c.md', folder_id=c['id'])
+    in_other = api.create_document('in other.md', folder_id=other['id'])
+    
+    api.delete_folder(a['id'])
+    assert [f['id'] for f in api.get_all_folders()] == [other['id']]
+    assert api.get_document_by_id(in_c['id'])['folder_id'] is None
+    assert api.get_document_by_id(in_other['id'])['folder_id'] == other['id']
+    api.delete_folder(a['id'])
+
+
+def test_updating_content_to_none_leaves_it_unchanged(api):
+    doc = api.create_document('a.md', 'body')
+    updated = api.update_document(doc['id'], content=None, is_favorite=True)
+    assert updated['is_favorite'] is True
+    assert 'content' not in updated
+    assert api.get_document_content(updated) == 'body'
+    assert updated['content_hash'] == doc['content_hash']
+
+
+def test_changed_since_follows_commits_reloads_and_compaction(data_dir, monkeypatch):
+    store = JSONStorage('docs.json')
+    put(store, {'id': 1}, {'id': 2})
+    put(store, {'id': 3})
+    delete(store, 1)
+    assert store.changed_since(1) == {1, 3}
+    assert store.changed_since(3) == set()
+    assert store.changed_since(0) == {1, 2, 3}
+    
+    reopened = JSONStorage('docs.json')
+    assert reopened.changed_since(2) == {1}
+    store.compact()
+    assert JSONStorage('docs.json').changed_since(2) is None
+    put(store, {'id': 4})
+    assert JSONStorage('docs.json').changed_since(3) == {4}
+    
+    monkeypatch.setattr('storage.CHANGE_HISTORY', 2)
+    put(store, {'id': 5})
+    put(store, {'id': 6})
+    assert store.changed_since(5) == {6}
+    assert store.changed_since(4) == {5, 6}
+    assert store.changed_since(3) is None
+    assert JSONStorage('docs.json').changed_since(3) is None
+    assert JSONStorage('docs.json').changed_since(4) == {5, 6}
+
+
+@pytest.mark.parametrize('format', sorted(storage.SERIALIZERS))
+def test_version_without_a_journal_is_persisted_in_the_snapshot(data_dir, format):
+    store = JSONStorage('docs.json', journal=False, format=format)
+    versions = []
+    for i in range(1, 4):
+        put(store, {'id': i})
+        versions.append(store.version)
+    # Writes landing within one mtime tick still get distinct versions.
+    assert versions == [1, 2, 3]
+    assert store.changed_since(1) == {2, 3}
+    
+    reopened = JSONStorage('docs.json', journal=False)
+    assert (reopened.version, [r['id'] for r in reopened.load()]) == (3, [1, 2, 3])
+    delete(reopened, 2)
+    assert store.version == 4
+    assert store.changed_since(3) is None
+
+
+@pytest.mark.parametrize('payload', [b'[{"id": 1}]', b'MKREC1\n\x00\x00\x00\x09{"id": 1}'])
+def test_snapshots_without_a_version_load_as_version_zero(data_dir, payload):
+    (data_dir / 'docs.json').write_bytes(payload)
+    store = JSONStorage('docs.json', journal=False)
+    assert (store.version, [dict(r) for r in store.load()]) == (0, [{'id': 1}])
+    put(store, {'id': 2})
+    assert JSONStorage('docs.json', journal=False).version == 1
@@ -0,0 +1,56 @@
+import io
+import zipfile
+from concurrent.futures import Future
+
+import pytest
+
+try:
+    import zip_export
+except (ImportError, OSError) as e:
+    # The renderer needs WeasyPrint and its system libraries.
+    pytest.skip(f'zip_export cannot be imported: {e}', allow_module_level=True)
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """Record the formats sent to the export pool, rendering them in-process."""
+    formats = []
+
+    def submit(fmt, content, title, digest=None, block=False):
+        formats.append(fmt)
+        future = Future()
+        future.set_result(zip_export.render_export(fmt, content, title, digest))
+        return future
+
+    monkeypatch.setattr(zip_export.pool, 'submit', submit)
+    return formats
+
+
+def archive(fmt, entries):
+    data = b''.join(zip_export.stream_zip(iter(entries), fmt, window=2))
+    return zipfile.ZipFile(io.BytesIO(data))
+
+
+@pytest.mark.parametrize('fmt', ['html', 'docx', 'odt', 'epub'])
+def test_rendered_formats_go_to_the_pool(submitted, fmt):
+    entries = [(f'{name}.{fmt}', f'# {name}\n\ntext', name, None) for name in ('a', 'b', 'c')]
+    with archive(fmt, entries) as zf:
+        assert zf.namelist() == [f'a.{fmt}', f'b.{fmt}', f'c.{fmt}']
+    assert submitted == [fmt] * 3
+
+
+def test_source_formats_are_written_inline(submitted):
+    with archive('md', [('a.md', '# a', 'a', None)]) as zf:
+        assert zf.read('a.md') == b'# a'
+    assert submitted == []
+
+
+def test_failed_entries_become_error_files(monkeypatch):
+    def submit(fmt, content, title, digest=None, block=False):
+        future = Future()
+        future.set_exception(RuntimeError('boom'))
+        return future
+
+    monkeypatch.setattr(zip_export.pool, 'submit', submit)
+    with archive('pdf', [('a.pdf', '# a', 'a', None)]) as zf:
+        assert zf.read('a.pdf.error.txt') == b'RuntimeError: boom\n'
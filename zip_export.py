@@ -0,0 +1,83 @@
+"""Streamed ZIP archives of exported documents.
+
+``stream_zip`` writes each entry as soon as it is rendered and yields the
+archive bytes produced so far, so a response can start before the last
+document is exported and only a window of entries is held in memory.
+Entries are rendered in parallel by the export pool, up to ``window`` at
+a time; entries are still written in the order given.
+"""
+import io
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import Future
+
+from export_jobs import pool
+from renderer import render_export
+
+# Formats whose "rendering" is just encoding the Markdown source: a round
+# trip through a worker would cost more than the work. Every other format
+# (HTML, PDF, DOCX, ODT, EPUB, ...) goes to the export pool.
+INLINE_FORMATS = ('txt', 'md')
+
+_UNSAFE = re.compile(r'[\x00-\x1f/\\:*?"<>|]')
+
+
+def safe_part(name):
+    """Return ``name`` usable as one component of an archive path."""
+    return _UNSAFE.sub('_', name).strip().lstrip('.') or '_'
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, unseekable stream holding what ZipFile wrote until drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _export(fmt, content, title, digest):
+    if fmt not in INLINE_FORMATS:
+        return pool.submit(fmt, content, title, digest, block=True)
+    future = Future()
+    future.set_result(render_export(fmt, content, title, digest))
+    return future
+
+
+def stream_zip(entries, fmt, window=None):
+    """Yield the bytes of a ZIP of ``entries`` exported as ``fmt``.
+
+    ``entries`` yields ``(arcname, content, title, digest)`` and is consumed
+    lazily. An entry that fails to render is replaced by
+    ``<arcname>.error.txt`` holding the error, so the archive stays valid.
+    """
+    window = window or pool.workers * 2
+    sink = _Sink()
+    pending = deque()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        def write_next():
+            arcname, future = pending.popleft()
+            try:
+                archive.writestr(arcname, future.result())
+            except Exception as e:
+                archive.writestr(f'{arcname}.error.txt', f'{type(e).__name__}: {e}\n')
+            return sink.drain()
+
+        for arcname, content, title, digest in entries:
+            pending.append((arcname, _export(fmt, content, title, digest)))
+            while len(pending) >= window or (pending and pending[0][1].done()):
+                yield write_next()
+        while pending:
+            yield write_next()
+    yield sink.drain()